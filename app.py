@@ -1,100 +1,231 @@
-from flask import Flask, render_template, redirect, url_for, flash, request, jsonify
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager, UserMixin, login_user, login_required, current_user, logout_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from flask import (Flask, Blueprint, current_app, render_template, redirect, url_for, flash, request, jsonify, send_file,
+                   abort, stream_with_context)
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from flask_login import login_user, login_required, current_user, logout_user
+from datetime import date, datetime, timedelta
+from itertools import groupby
+from sqlalchemy import and_, func, inspect, tuple_
+from sqlalchemy.exc import OperationalError
+from config import Config
+from models import db, User, UserSnapshot, Folder, Record, Mistake, AudioBlob, Job, StatsDaily, bump_folders_versions
+from extensions import (EXTENSION_KEY, login_manager, audio_store, user_cache, password_hasher, login_limiter,
+                        job_queue, request_metrics, asset_manifest)
 from forms import RegistrationForm, LoginForm
+from jobs import JobQueue, JobFailed
+import uploads
+import archive
+from uploads import UploadTooLarge
+from storage import AudioStore, AudioMissing, create_audio_store
+from identity_cache import IdentityCache
+from metrics import RequestMetrics
+from passwords import PasswordHasher, HasherBusy, RateLimiter
+from compression import Compression, precompress_directory, serve_precompressed
+import assets
+from assets import AssetManifest
+import stats
+import counters
+import search
+from sqlite_profile import install_pragmas, current_pragmas, missing_foreign_key_indexes, add_missing_columns
 import os
+import io
+import zipfile
+import hashlib
+import hmac
 import base64
+import json
+import time
+import click
+from contextlib import ExitStack
+from functools import partial
+from urllib.parse import quote
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'd2f8a8b1c4e5f6a7b8c9d0e1f2a3b4c5d6e7f8a9b0c1d2'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = 'static/uploads'
-
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-db = SQLAlchemy(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
-
-# Модель пользователя
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    first_name = db.Column(db.String(50), nullable=False)
-    last_name = db.Column(db.String(50), nullable=False)
-    login = db.Column(db.String(50), unique=True, nullable=False)
-    password_hash = db.Column(db.String(255), nullable=False)
-
-    folders = db.relationship("Folder", backref="user", lazy=True)
-
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
-
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
-
-# Модель папки
-class Folder(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    records = db.relationship("Record", backref="folder", lazy=True)
-
-class Record(db.Model):
-    __tablename__ = "record"
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
-    id_folder = db.Column(db.Integer, db.ForeignKey("folder.id"), nullable=False)
-    name = db.Column(db.String(255), nullable=False)
-    trash = db.Column(db.Integer, default=0, nullable=False)
-    length = db.Column(db.Float, nullable=True)
-    audio_file = db.Column(db.String(255), nullable=True)
-    datetime = db.Column(db.DateTime, default=datetime.utcnow)
-
-    # Связь с таблицей Mistake (один ко многим)
-    mistakes = db.relationship("Mistake", backref="record", lazy=True, cascade="all, delete-orphan")
-
-class Mistake(db.Model):
-    __tablename__ = "mistake"
-    id = db.Column(db.Integer, primary_key=True)
-    record_id = db.Column(db.Integer, db.ForeignKey("record.id"), nullable=False)
-    comment = db.Column(db.String(255), nullable=True)
-    time_of_mistake = db.Column(db.Float, nullable=True)
-    type = db.Column(db.Integer, nullable=True)
-
-# Загрузка пользователя для Flask-Login
+# Маршруты и команды приложения; create_app регистрирует их без префикса URL.
+# Тяжелые модули (waveform с numpy) импортируются внутри функций, которым они нужны
+bp = Blueprint('main', __name__, cli_group=None)
+
+# Обработчики фоновых задач; create_app передает их очереди каждого приложения
+job_handlers = {}
+
+def job_handler(kind, on_failure=None):
+    def register(func):
+        job_handlers[kind] = (func, on_failure)
+        return func
+    return register
+
+# Фабрика приложения. config - класс или объект с настройками (по умолчанию Config)
+def create_app(config=Config):
+    app = Flask(__name__)
+    app.config.from_object(config)
+    if not app.config['UPLOAD_SESSIONS_FOLDER']:
+        app.config['UPLOAD_SESSIONS_FOLDER'] = os.path.join(app.instance_path, 'upload_sessions')
+    if not app.config['STORAGE_CACHE_FOLDER']:
+        app.config['STORAGE_CACHE_FOLDER'] = os.path.join(app.instance_path, 'storage_cache')
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['UPLOAD_SESSIONS_FOLDER'], exist_ok=True)
+
+    db.init_app(app)
+    login_manager.init_app(app)
+    init_database(app)
+
+    queue = JobQueue(
+        app, db, Job,
+        poll_interval=app.config['JOB_POLL_INTERVAL'],
+        lock_timeout=app.config['JOB_LOCK_TIMEOUT'],
+        max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+        retry_delay=app.config['JOB_RETRY_DELAY']
+    )
+    queue.handlers.update(job_handlers)
+    metrics = RequestMetrics(
+        app, db,
+        slow_request_threshold=app.config['SLOW_REQUEST_THRESHOLD'],
+        slow_query_count=app.config['SLOW_REQUEST_QUERIES']
+    )
+    metrics.collector(cache_and_queue_metrics)
+    app.extensions[EXTENSION_KEY] = {
+        'audio_store': create_audio_store(app.config),
+        'user_cache': IdentityCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL']),
+        'password_hasher': PasswordHasher(
+            app.config['PASSWORD_HASH_METHOD'],
+            max_workers=app.config['PASSWORD_HASH_WORKERS'],
+            max_pending=app.config['PASSWORD_HASH_QUEUE'],
+            timeout=app.config['PASSWORD_HASH_TIMEOUT']
+        ),
+        'login_limiter': RateLimiter(app.config['LOGIN_RATE_LIMIT'], app.config['LOGIN_RATE_WINDOW']),
+        'job_queue': queue,
+        'request_metrics': metrics,
+    }
+
+    app.register_blueprint(bp)
+    # Регистрируется после метрик, чтобы в метриках учитывался размер уже сжатого ответа
+    Compression(app, min_size=app.config['COMPRESS_MIN_SIZE'], level=app.config['COMPRESS_LEVEL'])
+    serve_precompressed(app)
+    app.extensions[EXTENSION_KEY]['asset_manifest'] = AssetManifest(app)
+    return app
+
+# Создаем недостающие таблицы и индексы в существующей базе
+def init_database(app):
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            install_pragmas(db.engine, app.config['SQLITE_PRAGMAS'])
+        existing_tables = set(inspect(db.engine).get_table_names())
+        db.create_all()
+        added_columns = add_missing_columns(db.engine, db.metadata)
+        if "mistake.time_ms" in added_columns:
+            with db.engine.begin() as connection:
+                connection.exec_driver_sql(
+                    "UPDATE mistake SET time_ms = CAST(ROUND(time_of_mistake * 1000) AS INTEGER) "
+                    "WHERE time_of_mistake IS NOT NULL"
+                )
+        if "record.trashed_at" in added_columns:
+            # Срок хранения уже лежащих в корзине записей отсчитывается с момента обновления
+            with db.engine.begin() as connection:
+                connection.exec_driver_sql(
+                    "UPDATE record SET trash = 1, trashed_at = CURRENT_TIMESTAMP "
+                    "WHERE id_folder IN (SELECT id FROM folder WHERE name = 'Корзина')"
+                )
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+        # Триггеры статистики; при первом запуске таблица заполняется по уже существующим записям
+        with db.engine.begin() as connection:
+            stats.install_triggers(connection)
+            if StatsDaily.__tablename__ not in existing_tables:
+                stats.rebuild(connection)
+        # Триггеры счетчиков; после добавления столбцов счетчики заполняются по уже существующим данным
+        with db.engine.begin() as connection:
+            counters.install_triggers(connection)
+            if any(column in added_columns for column in ("record.recorder_mistakes", "folder.record_count")):
+                counters.repair(connection)
+        # Полнотекстовый индекс; для существующей базы он строится один раз при создании
+        try:
+            with db.engine.begin() as connection:
+                created = not search.index_exists(connection)
+                search.install(connection)
+                if created:
+                    search.rebuild(connection)
+        except OperationalError as e:
+            app.logger.warning(f"Поиск недоступен, SQLite собран без FTS5: {str(e)}")
+        missing_indexes = missing_foreign_key_indexes(db.engine, db.metadata)
+        if missing_indexes:
+            app.logger.warning(f"Нет индексов для внешних ключей: {', '.join(missing_indexes)}")
+
+# Состояние кэша пользователей и очереди задач на момент опроса метрик
+def cache_and_queue_metrics():
+    cache = user_cache.stats()
+    jobs = db.session.query(Job.status, func.count(Job.id)).group_by(Job.status).all()
+    return [
+        ('speakpeak_user_cache_size', 'gauge', "Пользователей в кэше процесса", [({}, cache['size'])]),
+        ('speakpeak_user_cache_hits_total', 'counter', "Попадания в кэш пользователей", [({}, cache['hits'])]),
+        ('speakpeak_user_cache_misses_total', 'counter', "Промахи кэша пользователей", [({}, cache['misses'])]),
+        ('speakpeak_jobs', 'gauge', "Фоновые задачи по статусу", [({'status': status}, count) for status, count in jobs]),
+    ]
+
+@bp.app_context_processor
+def inject_icons_stylesheet():
+    vendored = current_app.config['FONT_AWESOME_VENDOR_PATH']
+    if asset_manifest.exists(vendored):
+        return {'icons_stylesheet': asset_manifest.url(vendored)}
+    return {'icons_stylesheet': current_app.config['FONT_AWESOME_URL']}
+
+# Воркеры запускаются с первым запросом, а не при импорте, чтобы не стартовать в CLI-командах
+@bp.before_app_request
+def start_job_workers():
+    if job_queue.start(current_app.config['JOB_WORKERS']):
+        schedule_trash_purge()
+
+# Ответ JSON с сильным ETag. Если у клиента та же версия, возвращается 304 без сборки данных
+def conditional_json(etag, build_payload, private=False):
+    # Сжатый ответ уходит со слабым ETag, поэтому сравнение слабое
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(build_payload())
+    response.set_etag(etag)
+    # Браузер хранит ответ, но перед использованием всегда перепроверяет его по ETag
+    response.cache_control.no_cache = True
+    if private:
+        response.cache_control.private = True
+    return response
+
+# Загрузка пользователя для Flask-Login: запрос к базе только при промахе кэша
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    snapshot = user_cache.get(user_id)
+    if snapshot is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        snapshot = UserSnapshot(user)
+        user_cache.put(user_id, snapshot)
+    return snapshot
 
 # Главная страница
-@app.route("/")
+@bp.route("/")
 def index():
     return render_template("index.html", user=current_user)
 
 # Инструкция по настройке BlackHole
-@app.route("/blackhole-instructions")
+@bp.route("/blackhole-instructions")
 def blackhole_instructions():
     return render_template("blackhole-instructions.html", user=current_user)
 
 # Страница записи
-@app.route("/record")
+@bp.route("/record")
 @login_required
 def record():
     return render_template("record.html", user=current_user)
 
 # Страница сохранения
-@app.route("/save")
+@bp.route("/save")
 @login_required
 def save():
-    return render_template("save.html", user=current_user)
+    return render_template("save.html", user=current_user, direct_uploads=audio_store.supports_direct_upload)
 
 # Страница воспроизведения
-@app.route("/playback/<int:record_id>")
+@bp.route("/playback/<int:record_id>")
 def playback(record_id):
-    record = Record.query.get_or_404(record_id)
+    record = db.get_or_404(Record, record_id)
     # Проверяем, является ли текущий пользователь владельцем записи
     is_owner = current_user.is_authenticated and record.user_id == current_user.id
     return render_template("playback.html", 
@@ -103,43 +234,87 @@ def playback(record_id):
                          record_name=record.name,
                          is_owner=is_owner)
 
-@app.route('/folder/<int:folder_id>')
+# Длительность для списков: 05:07 или 1:02:03
+@bp.app_template_filter('duration')
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds or 0)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+# Страница записей папки по курсору: новые сверху, грузятся только нужные колонки,
+# день вычисляется в SQL. Курсор - (datetime, id) последней отданной записи
+def encode_cursor(row):
+    return base64.urlsafe_b64encode(f"{row.datetime.isoformat()}|{row.id}".encode()).decode()
+
+def decode_cursor(cursor):
+    value, record_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(value), int(record_id)
+
+def folder_records_page(folder_id, cursor=None, limit=None):
+    limit = limit or current_app.config['FOLDER_PAGE_SIZE']
+    day = func.date(Record.datetime).label('day')
+    query = db.session.query(Record.id, Record.name, Record.audio_file, Record.datetime, Record.length,
+                             Record.recorder_mistakes, Record.review_mistakes, day) \
+        .filter(Record.id_folder == folder_id)
+    if cursor:
+        query = query.filter(tuple_(Record.datetime, Record.id) < decode_cursor(cursor))
+    rows = query.order_by(Record.datetime.desc(), Record.id.desc()).limit(limit + 1).all()
+    
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    days = []
+    for day_value, group in groupby(rows[:limit], key=lambda row: row.day):
+        days.append({
+            "date": datetime.strptime(day_value, '%Y-%m-%d').strftime('%d.%m.%Y'),
+            "records": [{
+                "id": row.id,
+                "name": row.name or os.path.splitext(os.path.basename(row.audio_file))[0],
+                "duration": format_duration(row.length),
+                "recorder_mistakes": row.recorder_mistakes,
+                "review_mistakes": row.review_mistakes
+            } for row in group]
+        })
+    return days, next_cursor
+
+@bp.route('/folder/<int:folder_id>')
 @login_required
 def folder(folder_id):
-    folder = Folder.query.get_or_404(folder_id)
+    folder = db.get_or_404(Folder, folder_id)
     if folder.user_id != current_user.id:
         flash('Доступ запрещен', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
-    # Получаем записи и группируем их по датам
-    records = Record.query.filter_by(id_folder=folder_id).all()
-    records_by_date = {}
-    
-    for record in records:
-        if not hasattr(record, 'name') or not record.name:
-            record.name = os.path.splitext(os.path.basename(record.audio_file))[0]
-        
-        date = record.datetime.strftime('%d.%m.%Y')
-        if date not in records_by_date:
-            records_by_date[date] = []
-        records_by_date[date].append(record)
-    
-    # Сортируем даты в обратном порядке (новые записи сверху)
-    sorted_dates = sorted(records_by_date.keys(), reverse=True)
+    # Первая страница рендерится сервером, остальные подгружаются при прокрутке
+    days, next_cursor = folder_records_page(folder_id)
     
     return render_template('folder.html', 
                          folder=folder, 
                          user=current_user,
-                         records_by_date=records_by_date,
-                         sorted_dates=sorted_dates)
+                         days=days,
+                         next_cursor=next_cursor)
+
+# API для подгрузки записей папки при прокрутке
+@bp.route('/api/folders/<int:folder_id>/records', methods=["GET"])
+@login_required
+def get_folder_records(folder_id):
+    folder = db.get_or_404(Folder, folder_id)
+    if folder.user_id != current_user.id:
+        return jsonify({"error": "Доступ запрещен"}), 403
+    
+    limit = min(request.args.get('limit', current_app.config['FOLDER_PAGE_SIZE'], type=int), 200)
+    try:
+        days, next_cursor = folder_records_page(folder_id, request.args.get('cursor'), max(limit, 1))
+    except ValueError:
+        return jsonify({"error": "Некорректный курсор"}), 400
+    
+    return jsonify({"days": days, "next_cursor": next_cursor})
 
-@app.route('/add_folder')
+@bp.route('/add_folder')
 @login_required
 def add_folder():
     folders = Folder.query.filter_by(user_id=current_user.id).all()
     return render_template('add_folder.html', user=current_user)
 
-@app.route('/create_folder', methods=['GET', 'POST'])
+@bp.route('/create_folder', methods=['GET', 'POST'])
 @login_required
 def create_folder():
     if request.method == 'POST':
@@ -149,19 +324,19 @@ def create_folder():
             new_folder = Folder(name=folder_name, user_id=current_user.id)
             db.session.add(new_folder)
             db.session.commit()
-            return redirect(url_for('folder', folder_id=new_folder.id))
+            return redirect(url_for('main.folder', folder_id=new_folder.id))
         else:
             flash('Название папки не может быть пустым', 'danger')
-            return redirect(url_for('add_folder'))
+            return redirect(url_for('main.add_folder'))
     else:
         # Если метод GET, перенаправляем на страницу создания папки
-        return redirect(url_for('add_folder'))
+        return redirect(url_for('main.add_folder'))
 
 # Регистрация
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     form = RegistrationForm()
     
@@ -181,7 +356,11 @@ def register():
             last_name=last_name,
             login=login,
         )
-        user.set_password(password)
+        try:
+            user.set_password(password)
+        except HasherBusy:
+            flash('Сервер перегружен, попробуйте еще раз через несколько секунд.', 'danger')
+            return render_template('register.html', form=form), 503
         db.session.add(user)
         db.session.commit()
 
@@ -195,15 +374,15 @@ def register():
         login_user(user)
 
         flash('Регистрация прошла успешно! Вы вошли в систему.', 'success')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     return render_template('register.html', form=form)
 
 # Вход
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     form = LoginForm()
     
@@ -211,111 +390,689 @@ def login():
         login = form.login.data
         password = form.password.data
         
+        limiter_key = login.lower()
+        if not login_limiter.allow(limiter_key):
+            flash('Слишком много попыток входа. Попробуйте позже', 'danger')
+            return render_template('login.html', form=form), 429
+        
         user = User.query.filter_by(login=login).first()
-        if user and user.check_password(password):
+        try:
+            valid = user is not None and user.check_password(password)
+        except HasherBusy:
+            flash('Сервер перегружен, попробуйте войти еще раз через несколько секунд', 'danger')
+            return render_template('login.html', form=form), 503
+        if valid:
+            login_limiter.reset(limiter_key)
+            # Хэш, посчитанный по старым параметрам, заменяется, пока известен пароль
+            if password_hasher.needs_rehash(user.password_hash):
+                try:
+                    user.set_password(password)
+                    db.session.commit()
+                except HasherBusy:
+                    pass
             login_user(user)
             flash('Вы успешно вошли!', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         else:
             flash('Ошибка входа. Проверьте логин и пароль', 'danger')
     
     return render_template('login.html', form=form)
 
 # Выход
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
     flash('Вы вышли из системы.', 'success')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
+
+# Временные метки ошибок: повторяющееся поле формы, список через запятую или JSON-массив
+def parse_error_times(values):
+    times = []
+    for value in values:
+        value = value.strip()
+        if not value:
+            continue
+        if value.startswith('['):
+            times.extend(float(v) for v in json.loads(value))
+        else:
+            times.extend(float(v) for v in value.split(',') if v.strip())
+    return times
+
+# Учет ссылок на файл хранилища ведется в той же транзакции, что и изменение записи.
+# UPDATE берет блокировку записи SQLite до конца транзакции, поэтому проверка файла ниже не может
+# пересечься с remove_unreferenced_audio: если очистка уже удалила файл с теми же байтами,
+# он восстанавливается из копии staged, а без копии поднимается AudioMissing
+def acquire_blob(audio_file, size, staged=None):
+    digest = AudioStore.digest_of(audio_file)
+    updated = AudioBlob.query.filter_by(hash=digest).update({AudioBlob.ref_count: AudioBlob.ref_count + 1})
+    if not updated:
+        db.session.add(AudioBlob(hash=digest, path=audio_file, size=size, ref_count=1))
+    if not audio_store.exists(audio_file):
+        if staged is None:
+            raise AudioMissing(audio_file)
+        staged.restore()
+
+# Возвращает True, если на файл больше никто не ссылается и после коммита его можно удалить
+def release_blob(audio_file):
+    digest = AudioStore.digest_of(audio_file)
+    if not digest:
+        # Файл, сохраненный до перехода на хранилище, принадлежит одной записи
+        return True
+    AudioBlob.query.filter_by(hash=digest).update({AudioBlob.ref_count: AudioBlob.ref_count - 1})
+    deleted = AudioBlob.query.filter(AudioBlob.hash == digest, AudioBlob.ref_count <= 0).delete()
+    return bool(deleted)
+
+# Удаление файла и его индекса пиков, если в базе на него больше нет ссылок. Проверка и удаление
+# идут в одной транзакции записи: DELETE берет блокировку, и acquire_blob параллельной загрузки
+# тех же байтов ждет ее, а затем видит, что файла нет, и кладет его заново. Транзакция коммитится здесь
+def remove_unreferenced_audio(audio_file):
+    from waveform import peaks_path
+    digest = AudioStore.digest_of(audio_file)
+    try:
+        if digest:
+            db.session.execute(
+                AudioBlob.__table__.delete().where(AudioBlob.hash == digest, AudioBlob.ref_count <= 0)
+            )
+            if db.session.query(AudioBlob.hash).filter_by(hash=digest).first():
+                return
+        for path in (audio_file, peaks_path(audio_file)):
+            audio_store.delete(path)
+    finally:
+        db.session.commit()
+
+# Папка "Корзина" пользователя; ищется по индексу (user_id, name)
+def get_trash_folder(user_id, create=False):
+    trash_folder = Folder.query.filter_by(user_id=user_id, name='Корзина').first()
+    if trash_folder is None and create:
+        trash_folder = Folder(name='Корзина', user_id=user_id)
+        db.session.add(trash_folder)
+        db.session.flush()
+    return trash_folder
+
+# Перенос всех записей пользователя, подходящих под условие, одним UPDATE.
+# При переносе в корзину запоминается время удаления, при переносе из нее - сбрасывается
+def move_records(user_id, condition, target_folder, trash_folder):
+    values = {Record.id_folder: target_folder.id, Record.version: Record.version + 1}
+    if trash_folder is not None and target_folder.id == trash_folder.id:
+        values.update({Record.trash: 1, Record.trashed_at: datetime.utcnow()})
+    else:
+        values.update({Record.trash: 0, Record.trashed_at: None})
+    return Record.query.filter(
+        Record.user_id == user_id,
+        Record.id_folder != target_folder.id,
+        condition
+    ).update(values, synchronize_session=False)
+
+# Удаление навсегда всех записей под условием несколькими запросами без загрузки строк в ORM:
+# ошибки, задачи, ссылки на файлы хранилища и сами записи. Файлы, на которые больше никто не ссылается,
+# удаляет фоновая задача уже после коммита. Коммит остается за вызывающим
+def purge_records(condition):
+    selected_ids = db.select(Record.id).where(condition)
+    selected_files = db.select(Record.audio_file).where(condition, Record.audio_file.isnot(None))
+    audio_files = [path for (path,) in db.session.execute(selected_files.distinct())]
+    
+    if audio_files:
+        # ref_count уменьшается сразу на число удаляемых записей, ссылающихся на файл
+        removed_refs = db.select(func.count()).where(condition, Record.audio_file == AudioBlob.path).scalar_subquery()
+        db.session.execute(
+            AudioBlob.__table__.update()
+            .where(AudioBlob.path.in_(selected_files))
+            .values(ref_count=AudioBlob.ref_count - removed_refs)
+        )
+        db.session.execute(
+            AudioBlob.__table__.delete().where(AudioBlob.path.in_(audio_files), AudioBlob.ref_count <= 0)
+        )
+    
+    db.session.execute(Mistake.__table__.delete().where(Mistake.record_id.in_(selected_ids)))
+    db.session.execute(Job.__table__.delete().where(Job.record_id.in_(selected_ids)))
+    deleted = db.session.execute(Record.__table__.delete().where(condition)).rowcount
+    
+    if audio_files:
+        job_queue.enqueue('remove_audio', payload={'files': audio_files})
+    return deleted
+
+# Автоочистка корзины: записи старше срока хранения удаляются пачками, каждая пачка - своя транзакция
+def purge_expired_trash(retention_days, batch_size):
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    purged = 0
+    while True:
+        batch = [record_id for (record_id,) in db.session.query(Record.id)
+                 .filter(Record.trash == 1, Record.trashed_at < cutoff)
+                 .order_by(Record.trashed_at)
+                 .limit(batch_size)]
+        if not batch:
+            return purged
+        purged += purge_records(Record.id.in_(batch))
+        db.session.commit()
+        job_queue.notify()
+
+def create_record(folder_id, record_name, duration, errors, audio_file, audio_size, staged=None):
+    new_record = Record(
+        user_id=current_user.id,
+        id_folder=folder_id,
+        name=record_name,
+        length=duration / 1000,
+        audio_file=audio_file,
+        status='processing'
+    )
+    db.session.add(new_record)
+    acquire_blob(audio_file, audio_size, staged)
+    db.session.flush()
+    # Задача обработки создается в той же транзакции, что и запись
+    job = job_queue.enqueue('process_record', new_record.id)
+    
+    for error_time in errors:
+        mistake = Mistake(
+            record_id=new_record.id,
+            time_of_mistake=error_time / 1000,
+            type=1
+        )
+        db.session.add(mistake)
+    
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # Не оставляем на диске файл без записи в базе
+        remove_unreferenced_audio(audio_file)
+        raise
+    job_queue.notify()
+    return new_record, job
+
+# Файл хранилища должен существовать и совпадать по размеру и хэшу с учетом в audio_blob.
+# audio_path - локальная копия файла, полученная через audio_store.local_copy
+def check_audio_integrity(audio_file, audio_path):
+    digest = AudioStore.digest_of(audio_file)
+    if not digest:
+        return
+    blob = db.session.get(AudioBlob, digest)
+    if blob is not None and blob.size != os.path.getsize(audio_path):
+        raise JobFailed(f"Размер файла не совпадает: {audio_file}")
+    hasher = hashlib.sha256()
+    with open(audio_path, "rb") as f:
+        for chunk in iter(lambda: f.read(current_app.config['UPLOAD_CHUNK_SIZE']), b''):
+            hasher.update(chunk)
+    if hasher.hexdigest() != digest:
+        raise JobFailed(f"Хэш файла не совпадает: {audio_file}")
+
+def mark_record_failed(job):
+    if job.record is not None:
+        job.record.status = 'failed'
+
+# Обработка после загрузки: проверка файла, индекс пиков и настоящая длительность вместо присланной клиентом.
+# Если формат не читается (webm без ffmpeg), запись остается с длительностью клиента
+@job_handler('process_record', on_failure=mark_record_failed)
+def process_record_job(job):
+    from waveform import UnsupportedAudio, load_peaks_level, peaks_path
+    record = db.session.get(Record, job.record_id)
+    if record is None or not record.audio_file:
+        return
+    
+    if not audio_store.exists(record.audio_file):
+        raise JobFailed(f"Аудиофайл не найден: {record.audio_file}")
+    with audio_store.local_copy(record.audio_file) as audio_path:
+        check_audio_integrity(record.audio_file, audio_path)
+        try:
+            if not audio_store.fetch(peaks_path(record.audio_file)):
+                build_peaks_index(record.audio_file, audio_path)
+            duration = load_peaks_level(audio_store.local_path(record.audio_file))['duration']
+            if duration:
+                record.length = duration / 1000
+            update_speech_segments(record)
+        except UnsupportedAudio as e:
+            current_app.logger.warning(f"Индекс пиков не построен для {record.audio_file}: {str(e)}")
+    record.status = 'ready'
+
+# Индекс пиков строится по локальной копии аудио и сохраняется в хранилище рядом с ним
+def build_peaks_index(audio_file, audio_path):
+    from waveform import peaks_path, save_peaks
+    audio_store.store_derived(save_peaks(audio_path), peaks_path(audio_file))
+
+# Локальная копия индекса пиков; для старых записей индекс строится. False - аудиофайла нет
+def ensure_peaks_index(audio_file):
+    from waveform import peaks_path
+    if audio_store.fetch(peaks_path(audio_file)):
+        return True
+    if not audio_store.exists(audio_file):
+        return False
+    with audio_store.local_copy(audio_file) as audio_path:
+        build_peaks_index(audio_file, audio_path)
+    return True
+
+# Сегментация речи по индексу пиков (он уже должен быть получен через ensure_peaks_index)
+def update_speech_segments(record):
+    from waveform import speech_segments
+    segments = speech_segments(audio_store.local_path(record.audio_file))
+    record.speech_segments = json.dumps(segments, separators=(',', ':'))
+    record.voiced_seconds = sum(end - start for start, end in segments) / 1000
+    return segments
+
+# Кнопку ошибки во время записи обычно нажимают с опозданием, уже в паузе после фразы.
+# Для воспроизведения такие отметки переносятся на границу ближайшей фразы (целые мс); в базе остается
+# время нажатия, поэтому перенос пересчитывается при смене параметров сегментации
+def snapped_recorder_times(record, errors):
+    from waveform import snap_to_speech
+    if not record.speech_segments:
+        return [round(error['time']) for error in errors]
+    snapped = snap_to_speech([error['time'] for error in errors], json.loads(record.speech_segments))
+    return [round(time) for time in snapped]
+
+# Удаление файлов после purge_records. Файл, на который снова сослались (загрузили те же байты), остается
+@job_handler('remove_audio')
+def remove_audio_job(job):
+    for audio_file in json.loads(job.payload)['files']:
+        remove_unreferenced_audio(audio_file)
+
+# Следующий запуск автоочистки корзины ставится, только если в очереди его еще нет
+def schedule_trash_purge(delay=0):
+    if not Job.query.filter_by(kind='purge_trash', status='queued').first():
+        job_queue.enqueue('purge_trash', run_after=datetime.utcnow() + timedelta(seconds=delay))
+        db.session.commit()
+
+@job_handler('purge_trash')
+def purge_trash_job(job):
+    purged = purge_expired_trash(current_app.config['TRASH_RETENTION_DAYS'], current_app.config['PURGE_BATCH_SIZE'])
+    if purged:
+        current_app.logger.info(f"Из корзины удалено записей: {purged}")
+    schedule_trash_purge(current_app.config['PURGE_INTERVAL'])
+
+# Ручная очистка корзины от старых записей: flask --app app purge-trash --days 30
+@bp.cli.command("purge-trash")
+@click.option("--days", type=int, default=None, help="Срок хранения в корзине (по умолчанию TRASH_RETENTION_DAYS)")
+def purge_trash_command(days):
+    if days is None:
+        days = current_app.config['TRASH_RETENTION_DAYS']
+    purged = purge_expired_trash(days, current_app.config['PURGE_BATCH_SIZE'])
+    # Файлы удаляются здесь же, не дожидаясь воркеров
+    job_queue.drain()
+    print(f"Удалено записей из корзины: {purged}")
+
+# Состояние фоновой задачи; доступно владельцу записи
+@bp.route("/api/jobs/<int:job_id>", methods=["GET"])
+@login_required
+def get_job(job_id):
+    job = db.get_or_404(Job, job_id)
+    if job.record is None or job.record.user_id != current_user.id:
+        return jsonify({"error": "Доступ запрещен"}), 403
+    return jsonify({
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "error": job.error,
+        "record_id": job.record_id,
+        "record_status": job.record.status
+    })
+
+# Отдельный процесс с воркерами: flask --app app worker --threads 2
+@bp.cli.command("worker")
+@click.option("--threads", default=1, show_default=True, help="Число потоков-воркеров")
+def worker_command(threads):
+    print(f"Воркеров запущено: {threads}")
+    job_queue.start(threads)
+    schedule_trash_purge()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        job_queue.stop()
 
 # API для сохранения записи
-@app.route("/api/records", methods=["POST"])
+@bp.route("/api/records", methods=["POST"])
 @login_required
 def save_record():
     try:
-        data = request.json
-        if not data:
-            return jsonify({"error": "Нет данных"}), 400
-            
+        # Старые клиенты присылают аудио в base64 внутри JSON
+        if request.is_json:
+            return save_record_json()
+        return save_record_stream()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Ошибка при сохранении записи: {str(e)}")
+        return jsonify({"error": f"Ошибка при сохранении записи: {str(e)}"}), 500
+
+def save_record_json():
+    data = request.json
+    if not data:
+        return jsonify({"error": "Нет данных"}), 400
+    if data.get("upload"):
+        return save_record_uploaded(data)
+        
+    record_name = data.get("name")
+    folder_id = int(data.get("folder"))
+    audio_base64 = data.get("audio")
+    duration = data.get("duration")
+    errors = data.get("errors", [])
+    
+    if not all([record_name, folder_id, audio_base64, duration is not None]):
+        return jsonify({"error": "Не все обязательные поля заполнены"}), 400
+    
+    # Проверка существования папки и доступа к ней
+    folder = db.session.get(Folder, folder_id)
+    if not folder or folder.user_id != current_user.id:
+        return jsonify({"error": "Папка не найдена или доступ запрещен"}), 404
+    
+    try:
+        if ',' in audio_base64:
+            audio_data = base64.b64decode(audio_base64.split(',')[1])
+        else:
+            audio_data = base64.b64decode(audio_base64)
+    except Exception as e:
+        current_app.logger.error(f"Ошибка декодирования base64: {str(e)}")
+        return jsonify({"error": f"Ошибка формата аудио: {str(e)}"}), 400
+    
+    # Сохраняем файл
+    try:
+        staged = audio_store.write(io.BytesIO(audio_data), current_app.config['MAX_UPLOAD_SIZE'])
+    except UploadTooLarge:
+        return jsonify({"error": "Файл слишком большой"}), 413
+    except Exception as e:
+        current_app.logger.error(f"Ошибка при сохранении файла: {str(e)}")
+        return jsonify({"error": f"Ошибка при сохранении файла: {str(e)}"}), 500
+    
+    with staged:
+        new_record, job = create_record(folder_id, record_name, duration, errors, staged.path, staged.size, staged)
+    return jsonify({"success": True, "record_id": new_record.id, "status": new_record.status, "job_id": job.id})
+
+# Потоковая загрузка: multipart/form-data с полем audio
+# или сырое тело запроса (audio/*, application/octet-stream) с полями в строке запроса
+def save_record_stream():
+    limit = current_app.config['MAX_UPLOAD_SIZE']
+    if request.content_length is not None and request.content_length > limit:
+        return jsonify({"error": "Файл слишком большой"}), 413
+    
+    if request.mimetype == 'multipart/form-data':
+        fields = request.form
+        audio_file = request.files.get("audio")
+        audio_stream = audio_file.stream if audio_file else None
+    else:
+        fields = request.args
+        audio_stream = request.stream
+    
+    try:
+        record_name = fields.get("name")
+        folder_id = int(fields.get("folder", 0))
+        duration = fields.get("duration", type=float)
+        errors = parse_error_times(fields.getlist("errors"))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Некорректные поля записи: {str(e)}"}), 400
+    
+    if not all([record_name, folder_id, audio_stream, duration is not None]):
+        return jsonify({"error": "Не все обязательные поля заполнены"}), 400
+    
+    # Проверка существования папки и доступа к ней
+    folder = db.session.get(Folder, folder_id)
+    if not folder or folder.user_id != current_user.id:
+        return jsonify({"error": "Папка не найдена или доступ запрещен"}), 404
+    
+    try:
+        staged = audio_store.write(audio_stream, limit)
+    except UploadTooLarge:
+        return jsonify({"error": "Файл слишком большой"}), 413
+    except Exception as e:
+        current_app.logger.error(f"Ошибка при сохранении файла: {str(e)}")
+        return jsonify({"error": f"Ошибка при сохранении файла: {str(e)}"}), 500
+    
+    with staged:
+        if not staged.size:
+            remove_unreferenced_audio(staged.path)
+            return jsonify({"error": "Аудиофайл пуст"}), 400
+        new_record, job = create_record(folder_id, record_name, duration, errors, staged.path, staged.size, staged)
+    return jsonify({"success": True, "record_id": new_record.id, "status": new_record.status, "job_id": job.id})
+
+# Прямая загрузка в хранилище (S3): клиент присылает sha256 и размер файла, получает подписанный PUT
+# и токен загрузки, загружает файл сам, а затем сохраняет запись JSON-запросом {"upload": токен, ...}.
+# Если хранилище прямых ссылок не дает, ответ 501 и файл загружается через /api/records
+def upload_serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt='direct-upload')
+
+@bp.route("/api/records/direct-upload", methods=["POST"])
+@login_required
+def create_direct_upload():
+    if not audio_store.supports_direct_upload:
+        return jsonify({"error": "Хранилище не поддерживает прямую загрузку"}), 501
+    
+    data = request.json or {}
+    digest = str(data.get("sha256") or '').lower()
+    try:
+        size = int(data.get("size") or 0)
+    except (TypeError, ValueError):
+        size = 0
+    if len(digest) != 64 or not all(c in '0123456789abcdef' for c in digest) or size <= 0:
+        return jsonify({"error": "Нужны sha256 и размер файла"}), 400
+    if size > current_app.config['MAX_UPLOAD_SIZE']:
+        return jsonify({"error": "Файл слишком большой"}), 413
+    
+    upload = audio_store.presign_upload(digest)
+    upload['token'] = upload_serializer().dumps({'path': upload['path'], 'size': size, 'user': current_user.id})
+    return jsonify(upload)
+
+# Сохранение записи по файлу, загруженному напрямую. Файл должен появиться в хранилище с заявленным
+# размером уже после выдачи токена: ссылаться на чужой файл, зная только его хэш, нельзя
+def save_record_uploaded(data):
+    try:
+        upload, issued = upload_serializer().loads(
+            data["upload"], max_age=current_app.config['UPLOAD_SESSION_TTL'], return_timestamp=True
+        )
+    except BadSignature:
+        return jsonify({"error": "Недействительный токен загрузки"}), 400
+    if upload['user'] != current_user.id:
+        return jsonify({"error": "Недействительный токен загрузки"}), 400
+    
+    try:
         record_name = data.get("name")
-        folder_id = int(data.get("folder"))
-        audio_base64 = data.get("audio")
+        folder_id = int(data.get("folder") or 0)
         duration = data.get("duration")
-        errors = data.get("errors", [])
-        
-        if not all([record_name, folder_id, audio_base64, duration is not None]):
-            return jsonify({"error": "Не все обязательные поля заполнены"}), 400
-        
-        # Проверка существования папки и доступа к ней
-        folder = Folder.query.get(folder_id)
-        if not folder or folder.user_id != current_user.id:
-            return jsonify({"error": "Папка не найдена или доступ запрещен"}), 404
-        
-        try:
-            if ',' in audio_base64:
-                audio_data = base64.b64decode(audio_base64.split(',')[1])
-            else:
-                audio_data = base64.b64decode(audio_base64)
-        except Exception as e:
-            app.logger.error(f"Ошибка декодирования base64: {str(e)}")
-            return jsonify({"error": f"Ошибка формата аудио: {str(e)}"}), 400
-        
-        # Создаем папку для загрузок, если она не существует
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-        
-        audio_filename = f"{record_name}_{current_user.id}_{int(datetime.utcnow().timestamp())}.wav"
-        audio_path = os.path.join(app.config['UPLOAD_FOLDER'], audio_filename)
-        
-        # Сохраняем файл
-        try:
-            with open(audio_path, "wb") as f:
-                f.write(audio_data)
-        except Exception as e:
-            app.logger.error(f"Ошибка при сохранении файла: {str(e)}")
-            return jsonify({"error": f"Ошибка при сохранении файла: {str(e)}"}), 500
-        
-        new_record = Record(
-            user_id=current_user.id,
-            id_folder=folder_id,
-            name=record_name,
-            length=duration / 1000,
-            audio_file=audio_filename
+        errors = [float(t) for t in data.get("errors", [])]
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Некорректные поля записи: {str(e)}"}), 400
+    
+    if not all([record_name, folder_id, duration is not None]):
+        return jsonify({"error": "Не все обязательные поля заполнены"}), 400
+    
+    folder = db.session.get(Folder, folder_id)
+    if not folder or folder.user_id != current_user.id:
+        return jsonify({"error": "Папка не найдена или доступ запрещен"}), 404
+    
+    stat = audio_store.stat(upload['path'])
+    # Минута запаса на расхождение часов приложения и хранилища
+    if stat is None or stat[0] != upload['size'] or stat[1] < issued.timestamp() - 60:
+        return jsonify({"error": "Файл не загружен в хранилище"}), 409
+    
+    try:
+        new_record, job = create_record(folder_id, record_name, duration, errors, upload['path'], upload['size'])
+    except AudioMissing:
+        # Копии файла у приложения нет: его удалила очистка после проверки выше, клиент загрузит заново
+        db.session.rollback()
+        return jsonify({"error": "Файл не загружен в хранилище"}), 409
+    return jsonify({"success": True, "record_id": new_record.id, "status": new_record.status, "job_id": job.id})
+
+
+# Докачка длинных записей: сессия создается до или во время записи, части загружаются
+# PUT-запросами с контрольной суммой SHA-256, после чего сессия превращается в запись
+def get_upload_session(upload_id):
+    try:
+        meta = uploads.load_session(current_app.config['UPLOAD_SESSIONS_FOLDER'], upload_id)
+    except uploads.UploadSessionNotFound:
+        return None
+    if meta['user_id'] != current_user.id:
+        return None
+    return meta
+
+@bp.route("/api/uploads", methods=["POST"])
+@login_required
+def create_upload():
+    try:
+        root = current_app.config['UPLOAD_SESSIONS_FOLDER']
+        uploads.purge_expired(root, current_app.config['UPLOAD_SESSION_TTL'])
+        upload_id = uploads.create_session(root, current_user.id)
+        return jsonify({"success": True, "upload_id": upload_id})
+    except Exception as e:
+        current_app.logger.error(f"Ошибка при создании загрузки: {str(e)}")
+        return jsonify({"error": f"Ошибка при создании загрузки: {str(e)}"}), 500
+
+@bp.route("/api/uploads/<upload_id>", methods=["GET"])
+@login_required
+def get_upload(upload_id):
+    if not get_upload_session(upload_id):
+        return jsonify({"error": "Загрузка не найдена"}), 404
+    
+    received = uploads.received_chunks(current_app.config['UPLOAD_SESSIONS_FOLDER'], upload_id)
+    return jsonify({
+        "upload_id": upload_id,
+        "received": list(received),
+        "bytes": sum(received.values())
+    })
+
+@bp.route("/api/uploads/<upload_id>/chunks/<int:index>", methods=["PUT"])
+@login_required
+def put_upload_chunk(upload_id, index):
+    if not get_upload_session(upload_id):
+        return jsonify({"error": "Загрузка не найдена"}), 404
+    
+    checksum = request.headers.get("X-Chunk-SHA256")
+    if not checksum:
+        return jsonify({"error": "Не указана контрольная сумма части"}), 400
+    
+    limit = current_app.config['MAX_UPLOAD_CHUNK_SIZE']
+    if request.content_length is not None and request.content_length > limit:
+        return jsonify({"error": "Часть слишком большая"}), 413
+    
+    try:
+        size = uploads.write_chunk(
+            current_app.config['UPLOAD_SESSIONS_FOLDER'], upload_id, index,
+            request.stream, checksum, limit, current_app.config['UPLOAD_CHUNK_SIZE'],
+            current_app.config['MAX_UPLOAD_SIZE']
         )
-        db.session.add(new_record)
-        db.session.flush()
-        
-        for error_time in errors:
-            mistake = Mistake(
-                record_id=new_record.id,
-                time_of_mistake=error_time / 1000,
-                type=1
+    except uploads.SessionTooLarge:
+        return jsonify({"error": "Запись слишком большая"}), 413
+    except UploadTooLarge:
+        return jsonify({"error": "Часть слишком большая"}), 413
+    except uploads.ChecksumMismatch:
+        return jsonify({"error": "Контрольная сумма не совпадает"}), 422
+    except Exception as e:
+        current_app.logger.error(f"Ошибка при сохранении части: {str(e)}")
+        return jsonify({"error": f"Ошибка при сохранении части: {str(e)}"}), 500
+    
+    return jsonify({"success": True, "index": index, "size": size})
+
+@bp.route("/api/uploads/<upload_id>/complete", methods=["POST"])
+@login_required
+def complete_upload(upload_id):
+    root = current_app.config['UPLOAD_SESSIONS_FOLDER']
+    if not get_upload_session(upload_id):
+        return jsonify({"error": "Загрузка не найдена"}), 404
+    
+    data = request.json or {}
+    try:
+        record_name = data.get("name")
+        folder_id = int(data.get("folder") or 0)
+        chunk_count = int(data.get("chunks") or 0)
+        duration = data.get("duration")
+        errors = [float(t) for t in data.get("errors", [])]
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Некорректные поля записи: {str(e)}"}), 400
+    
+    if not all([record_name, folder_id, chunk_count, duration is not None]):
+        return jsonify({"error": "Не все обязательные поля заполнены"}), 400
+    
+    folder = db.session.get(Folder, folder_id)
+    if not folder or folder.user_id != current_user.id:
+        return jsonify({"error": "Папка не найдена или доступ запрещен"}), 404
+    
+    try:
+        uploads.claim_session(root, upload_id)
+    except uploads.UploadSessionNotFound:
+        return jsonify({"error": "Загрузка уже завершается"}), 409
+    
+    assembled_path = audio_store.temp_path()
+    try:
+        uploads.assemble(
+            root, upload_id, chunk_count, assembled_path,
+            current_app.config['MAX_UPLOAD_SIZE'], current_app.config['UPLOAD_CHUNK_SIZE']
+        )
+        staged = audio_store.import_file(assembled_path)
+    except uploads.MissingChunks as e:
+        uploads.release_session(root, upload_id)
+        return jsonify({"error": "Загружены не все части", "missing": e.missing}), 409
+    except UploadTooLarge:
+        uploads.release_session(root, upload_id)
+        return jsonify({"error": "Файл слишком большой"}), 413
+    except Exception as e:
+        uploads.release_session(root, upload_id)
+        if os.path.exists(assembled_path):
+            os.remove(assembled_path)
+        current_app.logger.error(f"Ошибка при сборке файла: {str(e)}")
+        return jsonify({"error": f"Ошибка при сборке файла: {str(e)}"}), 500
+    
+    # Запись и ее ошибки создаются одной транзакцией
+    try:
+        with staged:
+            new_record, job = create_record(
+                folder_id, record_name, duration, errors, staged.path, staged.size, staged
             )
-            db.session.add(mistake)
-        
-        db.session.commit()
-        return jsonify({"success": True, "record_id": new_record.id})
     except Exception as e:
-        db.session.rollback()
-        app.logger.error(f"Ошибка при сохранении записи: {str(e)}")
+        uploads.release_session(root, upload_id)
+        current_app.logger.error(f"Ошибка при сохранении записи: {str(e)}")
         return jsonify({"error": f"Ошибка при сохранении записи: {str(e)}"}), 500
+    
+    uploads.remove_session(root, upload_id)
+    return jsonify({"success": True, "record_id": new_record.id, "status": new_record.status, "job_id": job.id})
+
+@bp.route("/api/uploads/<upload_id>", methods=["DELETE"])
+@login_required
+def cancel_upload(upload_id):
+    if not get_upload_session(upload_id):
+        return jsonify({"error": "Загрузка не найдена"}), 404
+    uploads.remove_session(current_app.config['UPLOAD_SESSIONS_FOLDER'], upload_id)
+    return jsonify({"success": True})
+
+# Заранее сжатые копии статики для отдачи без сжатия на лету: flask --app app compress-static
+@bp.cli.command("compress-static")
+def compress_static_command():
+    written = precompress_directory(
+        current_app.static_folder, skip=[os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'])]
+    )
+    print(f"Сжатых файлов записано: {len(written)}")
+
+# Сборка статики с отпечатками в static/build и сжатые копии собранных файлов: flask --app app build-assets.
+# Запущенные процессы подхватывают новый манифест после перезапуска
+@bp.cli.command("build-assets")
+def build_assets_command():
+    manifest = assets.build(current_app.static_folder, skip=[os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'])])
+    written = precompress_directory(os.path.join(current_app.static_folder, assets.BUILD_DIR))
+    print(f"Собрано файлов: {len(manifest)}, сжатых копий: {len(written)}")
 
+# Локальная копия Font Awesome вместо CDN: flask --app app vendor-icons [--subset]
+@bp.cli.command("vendor-icons")
+@click.option("--subset", is_flag=True, help="Оставить в шрифтах только иконки из шаблонов и скриптов (нужен fonttools)")
+def vendor_icons_command(subset):
+    target = os.path.join(current_app.static_folder, 'vendor', 'fontawesome')
+    fonts = assets.vendor_font_awesome(
+        current_app.config['FONT_AWESOME_URL'], target, subset=subset,
+        search_roots=[os.path.join(current_app.root_path, current_app.template_folder),
+                      os.path.join(current_app.static_folder, 'js')]
+    )
+    print(f"Font Awesome сохранен в {target}, шрифтов: {len(fonts)}. Пересоберите статику: flask --app app build-assets")
 
-@app.route("/api/records/<int:record_id>", methods=["GET"])
+# Очистка просроченных сессий докачки: flask --app app purge-uploads
+@bp.cli.command("purge-uploads")
+def purge_uploads_command():
+    purged = uploads.purge_expired(current_app.config['UPLOAD_SESSIONS_FOLDER'], current_app.config['UPLOAD_SESSION_TTL'])
+    print(f"Удалено просроченных загрузок: {purged}")
+
+@bp.route("/api/records/<int:record_id>", methods=["GET"])
 def get_record(record_id):
-    try:
-        record = Record.query.get_or_404(record_id)
-        
-        audio_path = os.path.join(app.config['UPLOAD_FOLDER'], record.audio_file)
-        
-        if not os.path.exists(audio_path):
-            return jsonify({"error": "Аудиофайл не найден"}), 404
-        
-        with open(audio_path, "rb") as f:
-            audio_data = f.read()
-        
-        audio_base64 = f"data:audio/wav;base64,{base64.b64encode(audio_data).decode('utf-8')}"
-        
+    # Для проверки ETag читаются только версия и время создания (id может быть переиспользован после удаления)
+    row = db.session.query(Record.version, Record.datetime).filter_by(id=record_id).first()
+    if row is None:
+        abort(404)
+    etag = f"r{record_id}-{int(row.datetime.timestamp()) if row.datetime else 0}-{row.version}"
+    
+    def build_payload():
+        record = db.session.get(Record, record_id)
         mistakes = Mistake.query.filter_by(record_id=record_id).all()
         errors = [{
             'id': mistake.id,
@@ -324,27 +1081,115 @@ def get_record(record_id):
             'type': mistake.type
         } for mistake in mistakes]
         
-        record_data = {
+        recorder_errors = [e for e in errors if e['type'] == 1]
+        for error, snapped in zip(recorder_errors, snapped_recorder_times(record, recorder_errors)):
+            error['snapped'] = snapped
+        
+        return {
             "id": record.id,
             "name": record.name,
             "folder": record.id_folder,
-            "audio": audio_base64,
+            "audio": url_for('main.get_record_audio', record_id=record.id),
             "duration": record.length * 1000,
-            "errors": [e for e in errors if e['type'] == 1],
+            "status": record.status,
+            "errors": recorder_errors,
             "playbackErrors": [e for e in errors if e['type'] == 2]
         }
-        
-        return jsonify(record_data)
+    
+    try:
+        return conditional_json(etag, build_payload)
     except Exception as e:
-        app.logger.error(f"Ошибка при получении записи: {str(e)}")
+        current_app.logger.error(f"Ошибка при получении записи: {str(e)}")
         return jsonify({"error": f"Ошибка при получении записи: {str(e)}"}), 500
 
+# Аудио записи отдается отдельным файлом: ETag, Last-Modified и Range/206
+# обрабатывает send_file, а сервер может отдать файл через sendfile без копирования.
+# Если хранилище дает прямые ссылки (S3), браузер перенаправляется на подписанную ссылку.
+# Доступ такой же, как у страницы воспроизведения: по ссылке
+@bp.route("/api/records/<int:record_id>/audio", methods=["GET"])
+def get_record_audio(record_id):
+    record = db.get_or_404(Record, record_id)
+    if not record.audio_file:
+        abort(404)
+    
+    download_url = audio_store.download_url(record.audio_file)
+    if download_url:
+        response = redirect(download_url)
+        # Ссылка действует ограниченное время, кэшировать перенаправление нельзя
+        response.cache_control.no_store = True
+        return response
+    
+    audio_path = os.path.abspath(audio_store.full_path(record.audio_file))
+    if not os.path.exists(audio_path):
+        return jsonify({"error": "Аудиофайл не найден"}), 404
+    
+    response = send_file(
+        audio_path,
+        mimetype='audio/wav',
+        conditional=True,
+        etag=True,
+        max_age=current_app.config['AUDIO_CACHE_MAX_AGE']
+    )
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+# Один уровень пирамиды пиков для визуализатора: ?level=N или ?bars=N (самый грубый уровень
+# не меньше чем с N столбцами). Для старых записей индекс строится при первом запросе
+@bp.route("/api/records/<int:record_id>/peaks", methods=["GET"])
+def get_record_peaks(record_id):
+    from waveform import UnsupportedAudio, load_peaks_level
+    record = db.get_or_404(Record, record_id)
+    if not record.audio_file:
+        return jsonify({"error": "Аудиофайл не найден"}), 404
+    
+    try:
+        try:
+            if not ensure_peaks_index(record.audio_file):
+                return jsonify({"error": "Аудиофайл не найден"}), 404
+        except UnsupportedAudio as e:
+            return jsonify({"error": f"Индекс пиков недоступен: {str(e)}"}), 404
+        
+        try:
+            peaks = load_peaks_level(
+                audio_store.local_path(record.audio_file),
+                level=request.args.get('level', type=int),
+                bars=request.args.get('bars', type=int)
+            )
+        except IndexError:
+            return jsonify({"error": "Такого уровня нет"}), 400
+        
+        response = jsonify(peaks)
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['AUDIO_CACHE_MAX_AGE']
+        return response
+    except Exception as e:
+        current_app.logger.error(f"Ошибка при получении пиков: {str(e)}")
+        return jsonify({"error": f"Ошибка при получении пиков: {str(e)}"}), 500
+
+# Отрезки речи записи: переход между фразами и пропуск пауз при прослушивании.
+# Пока запись обрабатывается, ответ 202; старые записи размечаются командой detect-speech
+@bp.route("/api/records/<int:record_id>/speech", methods=["GET"])
+def get_record_speech(record_id):
+    record = db.get_or_404(Record, record_id)
+    # Отрезки считает только фоновая обработка и команда detect-speech; запрос ничего не пишет в базу
+    if record.speech_segments is None:
+        if record.status == 'processing':
+            return jsonify({"status": record.status}), 202
+        return jsonify({"error": "Сегментация для записи недоступна"}), 404
+    
+    etag = f"s{record_id}-{int(record.datetime.timestamp()) if record.datetime else 0}-{record.version}"
+    return conditional_json(etag, lambda: {
+        "segments": json.loads(record.speech_segments),
+        "voiced": (record.voiced_seconds or 0) * 1000,
+        "duration": (record.length or 0) * 1000
+    })
+
 # API для добавления ошибки воспроизведения
-@app.route("/api/records/<int:record_id>/errors", methods=["POST"])
+@bp.route("/api/records/<int:record_id>/errors", methods=["POST"])
 @login_required
 def add_error(record_id):
     try:
-        record = Record.query.get_or_404(record_id)
+        record = db.get_or_404(Record, record_id)
         
         if record.user_id != current_user.id:
             return jsonify({"error": "Доступ запрещен"}), 403
@@ -368,12 +1213,12 @@ def add_error(record_id):
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
-@app.route("/api/mistakes/<int:mistake_id>", methods=["DELETE"])
+@bp.route("/api/mistakes/<int:mistake_id>", methods=["DELETE"])
 @login_required
 def delete_mistake(mistake_id):
     try:
-        mistake = Mistake.query.get_or_404(mistake_id)
-        record = Record.query.get(mistake.record_id)
+        mistake = db.get_or_404(Mistake, mistake_id)
+        record = db.session.get(Record, mistake.record_id)
         
         if record.user_id != current_user.id:
             return jsonify({"error": "Доступ запрещен"}), 403
@@ -384,30 +1229,40 @@ def delete_mistake(mistake_id):
         return jsonify({"success": True})
     except Exception as e:
         db.session.rollback()
-        app.logger.error(f"Ошибка при удалении ошибки: {str(e)}")
+        current_app.logger.error(f"Ошибка при удалении ошибки: {str(e)}")
         return jsonify({"error": f"Ошибка при удалении ошибки: {str(e)}"}), 500
 
 # API для получения папок
-@app.route("/api/folders", methods=["GET"])
+@bp.route("/api/folders", methods=["GET"])
 @login_required
 def get_folders():
     try:
-        folders = Folder.query.filter_by(user_id=current_user.id).all()
-        folders_data = [{"id": folder.id, "name": folder.name} for folder in folders]
-        return jsonify(folders_data)
+        version = db.session.query(User.folders_version).filter_by(id=current_user.id).scalar()
+        
+        def build_payload():
+            folders = Folder.query.filter_by(user_id=current_user.id).all()
+            return [{"id": folder.id, "name": folder.name} for folder in folders]
+        
+        return conditional_json(f"f{current_user.id}-{version}", build_payload, private=True)
     except Exception as e:
-        app.logger.error(f"Ошибка при получении папок: {str(e)}")
+        current_app.logger.error(f"Ошибка при получении папок: {str(e)}")
         return jsonify({"error": f"Ошибка при получении папок: {str(e)}"}), 500
 
-@app.route('/init_folders')
+@bp.route('/init_folders')
 def init_folders():
     try:
-        # Создаем папку "Черновики" для каждого пользователя, у которого её нет
-        users = User.query.all()
-        for user in users:
-            if not Folder.query.filter_by(user_id=user.id, name="Черновики").first():
-                drafts_folder = Folder(name="Черновики", user_id=user.id)
-                db.session.add(drafts_folder)
+        # Создаем папку "Черновики" для каждого пользователя, у которого её нет.
+        # Такие пользователи выбираются одним запросом, папки вставляются одним executemany мимо ORM
+        has_drafts = db.session.query(Folder.id).filter(
+            Folder.user_id == User.id, Folder.name == "Черновики"
+        ).exists()
+        user_ids = [user_id for (user_id,) in db.session.query(User.id).filter(~has_drafts)]
+        if user_ids:
+            db.session.execute(
+                Folder.__table__.insert(),
+                [{"name": "Черновики", "user_id": user_id} for user_id in user_ids]
+            )
+            bump_folders_versions(user_ids)
         
         db.session.commit()
         return jsonify({"message": "Папки успешно созданы"})
@@ -415,7 +1270,7 @@ def init_folders():
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
-@app.route('/init_test_user')
+@bp.route('/init_test_user')
 def init_test_user():
     try:
         # Создаем тестового пользователя, если его нет
@@ -440,27 +1295,32 @@ def init_test_user():
         return jsonify({"error": str(e)}), 500
 
 # API для обновления комментария к ошибке
-@app.route("/api/records/<int:record_id>/errors/comment", methods=["POST"])
+@bp.route("/api/records/<int:record_id>/errors/comment", methods=["POST"])
 @login_required
 def update_error_comment(record_id):
     try:
-        record = Record.query.get_or_404(record_id)
+        record = db.get_or_404(Record, record_id)
         
         # Проверка доступа
         if record.user_id != current_user.id:
             return jsonify({"error": "Доступ запрещен"}), 403
         
         data = request.json
+        mistake_id = data.get("id")
         time = data.get("time")
         comment = data.get("comment", "").strip()
         
-        if time is None:
+        if mistake_id is None and time is None:
             return jsonify({"error": "Время ошибки не указано"}), 400
         
-        mistake = Mistake.query.filter_by(
-            record_id=record_id,
-            time_of_mistake=time/1000
-        ).first()
+        # Ошибка ищется по id, а старые клиенты - по индексированному времени в миллисекундах
+        if mistake_id is not None:
+            mistake = Mistake.query.filter_by(id=mistake_id, record_id=record_id).first()
+        else:
+            mistake = Mistake.query.filter_by(
+                record_id=record_id,
+                time_ms=int(round(time))
+            ).first()
         
         if not mistake:
             return jsonify({"error": "Ошибка не найдена"}), 404
@@ -473,22 +1333,101 @@ def update_error_comment(record_id):
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
-@app.route('/settings')
+# Пакетное изменение ошибок записи: добавление, комментарии и удаление одной транзакцией.
+# Операции: {"op": "add", "time": мс, "type": 1|2, "comment": ..., "client_id": ...},
+# {"op": "comment", "id"|"client_id"|"time": ..., "comment": ...}, {"op": "delete", "id"|"client_id": ...}.
+# client_id позволяет сослаться на ошибку, добавленную в этом же пакете
+@bp.route("/api/records/<int:record_id>/mistakes/batch", methods=["POST"])
+@login_required
+def batch_mistakes(record_id):
+    record = db.get_or_404(Record, record_id)
+    if record.user_id != current_user.id:
+        return jsonify({"error": "Доступ запрещен"}), 403
+    
+    operations = (request.json or {}).get("operations")
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "Нет операций"}), 400
+    if len(operations) > current_app.config['MISTAKE_BATCH_LIMIT']:
+        return jsonify({"error": "Слишком много операций в одном запросе"}), 400
+    
+    try:
+        # Все ошибки, на которые ссылаются по id, загружаются одним запросом
+        referenced_ids = [op["id"] for op in operations if isinstance(op, dict) and op.get("id") is not None]
+        existing = {m.id: m for m in Mistake.query.filter(
+            Mistake.record_id == record_id,
+            Mistake.id.in_(referenced_ids)
+        )} if referenced_ids else {}
+        created = {}
+        applied = []
+        
+        for index, op in enumerate(operations):
+            kind = op.get("op") if isinstance(op, dict) else None
+            if kind == "add":
+                if op.get("time") is None:
+                    raise ValueError(f"Операция {index}: время ошибки не указано")
+                mistake = Mistake(
+                    record_id=record_id,
+                    time_of_mistake=op["time"] / 1000,
+                    type=op.get("type") if op.get("type") in (1, 2) else 2,
+                    comment=(op.get("comment") or "").strip() or None
+                )
+                db.session.add(mistake)
+                if op.get("client_id") is not None:
+                    created[op["client_id"]] = mistake
+            elif kind in ("comment", "delete"):
+                if op.get("id") is not None:
+                    mistake = existing.get(op["id"])
+                elif op.get("client_id") is not None:
+                    mistake = created.get(op["client_id"])
+                elif op.get("time") is not None:
+                    mistake = Mistake.query.filter_by(record_id=record_id, time_ms=int(round(op["time"]))).first()
+                else:
+                    mistake = None
+                if mistake is None:
+                    raise LookupError(f"Операция {index}: ошибка не найдена")
+                
+                if kind == "comment":
+                    mistake.comment = (op.get("comment") or "").strip()
+                elif mistake in db.session.new:
+                    db.session.expunge(mistake)
+                else:
+                    db.session.delete(mistake)
+            else:
+                raise ValueError(f"Операция {index}: неизвестный тип {kind!r}")
+            applied.append((op, mistake))
+        
+        db.session.commit()
+    except LookupError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 404
+    except (ValueError, TypeError) as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Ошибка при пакетном изменении ошибок: {str(e)}")
+        return jsonify({"error": f"Ошибка при пакетном изменении ошибок: {str(e)}"}), 500
+    
+    # Для добавленных ошибок клиент получает id из базы по своему client_id
+    results = [{"op": op["op"], "client_id": op.get("client_id"), "id": mistake.id} for op, mistake in applied]
+    return jsonify({"success": True, "results": results})
+
+@bp.route('/settings')
 @login_required
 def settings():
     return render_template('settings.html', user=current_user)
 
-@app.route('/folders')
+@bp.route('/folders')
 @login_required
 def folders():
     user_folders = Folder.query.filter_by(user_id=current_user.id).all()
     return render_template('folders.html', user=current_user, folders=user_folders)
 
-@app.route('/api/folders/<int:folder_id>', methods=["DELETE"])
+@bp.route('/api/folders/<int:folder_id>', methods=["DELETE"])
 @login_required
 def delete_folder(folder_id):
     try:
-        folder = Folder.query.get_or_404(folder_id)
+        folder = db.get_or_404(Folder, folder_id)
         
         if folder.user_id != current_user.id:
             return jsonify({"error": "Доступ запрещен"}), 403
@@ -496,22 +1435,11 @@ def delete_folder(folder_id):
         if folder.name in ['Корзина', 'Черновики']:
             return jsonify({"error": "Нельзя удалить системную папку"}), 400
         
-        if folder.records:
-            trash_folder = Folder.query.filter_by(user_id=current_user.id, name='Корзина').first()
-            
-            if not trash_folder:
-                trash_folder = Folder(name='Корзина', user_id=current_user.id)
-                db.session.add(trash_folder)
-                db.session.flush()
-            
-            for record in folder.records:
-                record.id_folder = trash_folder.id
-            
-            moved_files_count = len(folder.records)
-        else:
-            moved_files_count = 0
-        
-        db.session.delete(folder)
+        # Записи переносятся в корзину и папка удаляется без загрузки записей в память
+        trash_folder = get_trash_folder(current_user.id, create=True)
+        moved_files_count = move_records(current_user.id, Record.id_folder == folder.id, trash_folder, trash_folder)
+        Folder.query.filter_by(id=folder.id).delete(synchronize_session=False)
+        bump_folders_versions([current_user.id])
         db.session.commit()
         
         return jsonify({
@@ -522,11 +1450,11 @@ def delete_folder(folder_id):
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/folders/<int:folder_id>/rename', methods=["POST"])
+@bp.route('/api/folders/<int:folder_id>/rename', methods=["POST"])
 @login_required
 def rename_folder(folder_id):
     try:
-        folder = Folder.query.get_or_404(folder_id)
+        folder = db.get_or_404(Folder, folder_id)
         
         if folder.user_id != current_user.id:
             return jsonify({"error": "Доступ запрещен"}), 403
@@ -545,7 +1473,164 @@ def rename_folder(folder_id):
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
-@app.route('/settings/profile', methods=['GET', 'POST'])
+# Выгрузка папки ZIP-архивом, который собирается во время отдачи (формат описан в archive.py).
+# Записи и их ошибки читаются пачками, аудио копируется из хранилища кусками,
+# поэтому память не зависит от размера папки, а архив не складывается ни в память, ни на диск
+@bp.route('/api/folders/<int:folder_id>/export', methods=["GET"])
+@login_required
+def export_folder(folder_id):
+    folder = db.session.get(Folder, folder_id)
+    if not folder or folder.user_id != current_user.id:
+        return jsonify({"error": "Папка не найдена или доступ запрещен"}), 404
+    
+    entries = export_entries(folder.id, folder.name, current_app.config['EXPORT_BATCH_SIZE'])
+    response = current_app.response_class(
+        stream_with_context(archive.stream_zip(entries, current_app.config['UPLOAD_CHUNK_SIZE'])),
+        mimetype='application/zip'
+    )
+    response.headers['Content-Disposition'] = (
+        f"attachment; filename=\"speakpeak-folder-{folder.id}.zip\"; filename*=UTF-8''{quote(folder.name)}.zip"
+    )
+    response.cache_control.no_store = True
+    return response
+
+def export_entries(folder_id, folder_name, batch_size):
+    yield archive.FOLDER_ENTRY, archive.folder_entry(folder_name), None
+    exported_audio = {}
+    index = last_id = 0
+    while True:
+        records = Record.query.filter(Record.id_folder == folder_id, Record.id > last_id) \
+            .order_by(Record.id).limit(batch_size).all()
+        if not records:
+            return
+        last_id = records[-1].id
+        mistakes = {}
+        for mistake in Mistake.query.filter(Mistake.record_id.in_([r.id for r in records])) \
+                .order_by(Mistake.record_id, Mistake.time_ms):
+            mistakes.setdefault(mistake.record_id, []).append(mistake)
+        batch = []
+        for record in records:
+            index += 1
+            directory = archive.record_dir(index, record.name)
+            audio = exported_audio.get(record.audio_file)
+            new_audio = None
+            if record.audio_file and audio is None:
+                if audio_store.exists(record.audio_file):
+                    audio = new_audio = exported_audio[record.audio_file] = f"{directory}/{archive.AUDIO_ENTRY}"
+                else:
+                    current_app.logger.warning(f"Выгрузка: нет аудиофайла {record.audio_file} (запись {record.id})")
+            entry = archive.record_entry(record, mistakes.get(record.id, []), audio)
+            batch.append((directory, entry, record.datetime, record.audio_file, new_audio))
+        # Пока копируется аудио пачки, транзакция чтения не держится открытой
+        db.session.rollback()
+        
+        for directory, entry, created, audio_file, new_audio in batch:
+            yield f"{directory}/{archive.RECORD_ENTRY}", entry, created
+            if new_audio:
+                yield new_audio, partial(audio_store.open, audio_file), created
+
+# Восстановление папки из архива выгрузки: в новую папку (название из архива или ?name=)
+# или в существующую (?folder=id). Архив принимается телом запроса (application/zip) или полем archive
+# формы и сначала пишется на диск: оглавление ZIP лежит в конце файла, поэтому разобрать архив прямо
+# из потока нельзя. Аудио переносится в хранилище кусками, каждая запись сохраняется своей транзакцией,
+# а индекс пиков и сегментация строятся фоновыми задачами
+@bp.route('/api/folders/import', methods=["POST"])
+@login_required
+def import_folder():
+    limit = current_app.config['MAX_IMPORT_SIZE']
+    if request.content_length is not None and request.content_length > limit:
+        return jsonify({"error": "Архив слишком большой"}), 413
+    
+    folder = None
+    if request.args.get("folder"):
+        folder = db.session.get(Folder, request.args.get("folder", type=int) or 0)
+        if not folder or folder.user_id != current_user.id:
+            return jsonify({"error": "Папка не найдена или доступ запрещен"}), 404
+    
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get("archive")
+        stream = upload.stream if upload else None
+    else:
+        stream = request.stream
+    if stream is None:
+        return jsonify({"error": "Архив не передан"}), 400
+    
+    archive_path = audio_store.temp_path()
+    try:
+        uploads.stream_to_file(stream, archive_path, limit, current_app.config['UPLOAD_CHUNK_SIZE'])
+        # Копии аудио (см. StagedAudio) удаляются, когда все записи архива сохранены
+        with zipfile.ZipFile(archive_path) as zip_file, ExitStack() as stack:
+            meta = archive.read_folder(zip_file)
+            if folder is None:
+                folder = Folder(name=(request.args.get("name") or meta.get('folder') or 'Импорт')[:100],
+                                user_id=current_user.id)
+                db.session.add(folder)
+                db.session.commit()
+            imported = import_records(zip_file, folder.id, stack)
+    except UploadTooLarge:
+        return jsonify({"error": "Архив слишком большой"}), 413
+    except (zipfile.BadZipFile, archive.InvalidArchive) as e:
+        db.session.rollback()
+        return jsonify({"error": f"Некорректный архив: {str(e)}"}), 400
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Ошибка при импорте архива: {str(e)}")
+        return jsonify({"error": f"Ошибка при импорте архива: {str(e)}"}), 500
+    finally:
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+    
+    return jsonify({"success": True, "folder_id": folder.id, "imported": imported})
+
+def import_records(zip_file, folder_id, stack):
+    stored_audio = {}
+    imported = 0
+    for data in archive.read_records(zip_file):
+        staged = audio_file = audio_size = None
+        if data['audio']:
+            if data['audio'] not in stored_audio:
+                with zip_file.open(data['audio']) as source:
+                    stored_audio[data['audio']] = stack.enter_context(
+                        audio_store.write(source, current_app.config['MAX_UPLOAD_SIZE'])
+                    )
+            staged = stored_audio[data['audio']]
+            audio_file, audio_size = staged.path, staged.size
+        
+        record = Record(
+            user_id=current_user.id,
+            id_folder=folder_id,
+            name=data['name'],
+            length=data['duration'] / 1000 if data['duration'] is not None else None,
+            audio_file=audio_file,
+            status='processing' if audio_file else 'ready'
+        )
+        if data['created']:
+            record.datetime = data['created']
+        db.session.add(record)
+        if audio_file:
+            acquire_blob(audio_file, audio_size, staged)
+        db.session.flush()
+        if audio_file:
+            job_queue.enqueue('process_record', record.id)
+        for mistake in data['mistakes']:
+            db.session.add(Mistake(
+                record_id=record.id,
+                time_of_mistake=mistake['time'] / 1000,
+                type=mistake['type'],
+                comment=mistake['comment']
+            ))
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            if audio_file:
+                remove_unreferenced_audio(audio_file)
+            raise
+        job_queue.notify()
+        imported += 1
+    return imported
+
+@bp.route('/settings/profile', methods=['GET', 'POST'])
 @login_required
 def profile_settings():
     if request.method == 'POST':
@@ -554,20 +1639,24 @@ def profile_settings():
         
         if not first_name or not last_name:
             flash('Все поля должны быть заполнены', 'danger')
-            return redirect(url_for('profile_settings'))
+            return redirect(url_for('main.profile_settings'))
         
         try:
-            current_user.first_name = first_name
-            current_user.last_name = last_name
+            user = db.session.get(User, current_user.id)
+            user.first_name = first_name
+            user.last_name = last_name
             db.session.commit()
+            user_cache.invalidate(user.id)
             flash('Данные успешно обновлены', 'success')
+            # current_user этого запроса еще старый: новые данные покажет следующий запрос
+            return redirect(url_for('main.profile_settings'))
         except Exception as e:
             db.session.rollback()
             flash('Ошибка при обновлении данных', 'danger')
             
     return render_template('profile_settings.html', user=current_user)
 
-@app.route('/settings/password', methods=['GET', 'POST'])
+@bp.route('/settings/password', methods=['GET', 'POST'])
 @login_required
 def password_settings():
     if request.method == 'POST':
@@ -577,20 +1666,23 @@ def password_settings():
         
         if not all([current_password, new_password, confirm_password]):
             flash('Все поля должны быть заполнены', 'danger')
-            return redirect(url_for('password_settings'))
-            
-        if not current_user.check_password(current_password):
-            flash('Неверный текущий пароль', 'danger')
-            return redirect(url_for('password_settings'))
+            return redirect(url_for('main.password_settings'))
             
         if new_password != confirm_password:
             flash('Новые пароли не совпадают', 'danger')
-            return redirect(url_for('password_settings'))
+            return redirect(url_for('main.password_settings'))
             
+        user = db.session.get(User, current_user.id)
         try:
-            current_user.set_password(new_password)
+            if not user.check_password(current_password):
+                flash('Неверный текущий пароль', 'danger')
+                return redirect(url_for('main.password_settings'))
+            user.set_password(new_password)
             db.session.commit()
+            user_cache.invalidate(user.id)
             flash('Пароль успешно изменен', 'success')
+        except HasherBusy:
+            flash('Сервер перегружен, попробуйте еще раз через несколько секунд', 'danger')
         except Exception as e:
             db.session.rollback()
             flash('Ошибка при изменении пароля', 'danger')
@@ -598,11 +1690,11 @@ def password_settings():
     return render_template('password_settings.html', user=current_user)
 
 # API для обновления имени записи
-@app.route("/api/records/<int:record_id>/rename", methods=["POST"])
+@bp.route("/api/records/<int:record_id>/rename", methods=["POST"])
 @login_required
 def rename_record(record_id):
     try:
-        record = Record.query.get_or_404(record_id)
+        record = db.get_or_404(Record, record_id)
         
         # Проверка доступа
         if record.user_id != current_user.id:
@@ -623,24 +1715,25 @@ def rename_record(record_id):
         return jsonify({"error": str(e)}), 500
 
 # API для перемещения записи в корзину
-@app.route("/api/records/<int:record_id>/trash", methods=["POST"])
+@bp.route("/api/records/<int:record_id>/trash", methods=["POST"])
 @login_required
 def trash_record(record_id):
     try:
-        record = Record.query.get_or_404(record_id)
+        record = db.get_or_404(Record, record_id)
         
         # Проверка доступа
         if record.user_id != current_user.id:
             return jsonify({"error": "Доступ запрещен"}), 403
         
         # Находим папку "Корзина"
-        trash_folder = Folder.query.filter_by(user_id=current_user.id, name="Корзина").first()
+        trash_folder = get_trash_folder(current_user.id)
         if not trash_folder:
             return jsonify({"error": "Папка Корзина не найдена"}), 404
         
         # Перемещаем запись в корзину
         record.id_folder = trash_folder.id
         record.trash = 1  # Помечаем как удаленную
+        record.trashed_at = datetime.utcnow()
         db.session.commit()
         
         return jsonify({"success": True})
@@ -649,36 +1742,241 @@ def trash_record(record_id):
         return jsonify({"error": str(e)}), 500
 
 # API для постоянного удаления записи
-@app.route("/api/records/<int:record_id>/delete", methods=["DELETE"])
+@bp.route("/api/records/<int:record_id>/delete", methods=["DELETE"])
 @login_required
 def delete_record(record_id):
     try:
-        record = Record.query.get_or_404(record_id)
+        record = db.get_or_404(Record, record_id)
         
         # Проверка доступа
         if record.user_id != current_user.id:
             return jsonify({"error": "Доступ запрещен"}), 403
         
         # Проверяем, находится ли запись в корзине
-        trash_folder = Folder.query.filter_by(user_id=current_user.id, name="Корзина").first()
+        trash_folder = get_trash_folder(current_user.id)
         if not trash_folder or record.id_folder != trash_folder.id:
             return jsonify({"error": "Запись должна быть в корзине для полного удаления"}), 400
         
-        # Удаляем файл записи
-        audio_path = os.path.join(app.config['UPLOAD_FOLDER'], record.audio_file)
-        if os.path.exists(audio_path):
-            os.remove(audio_path)
+        # Файл удаляется только после коммита и только если другие записи на него не ссылаются
+        audio_file = record.audio_file
+        unreferenced = audio_file and release_blob(audio_file)
         
         # Удаляем запись (связанные ошибки удалятся автоматически благодаря cascade="all, delete-orphan")
         db.session.delete(record)
         db.session.commit()
         
+        if unreferenced:
+            remove_unreferenced_audio(audio_file)
+        
         return jsonify({"success": True})
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+# Статистика занятий за период: /api/stats?from=2025-01-01&to=2025-01-31&group=day|month|folder|total.
+# Можно ограничить одной папкой (folder=id); корзина не учитывается, если не передан include_trash=1
+@bp.route("/api/stats", methods=["GET"])
+@login_required
+def get_stats():
+    try:
+        date_from = date.fromisoformat(request.args["from"]) if request.args.get("from") else None
+        date_to = date.fromisoformat(request.args["to"]) if request.args.get("to") else None
+        folder_id = request.args.get("folder", type=int)
+    except ValueError as e:
+        return jsonify({"error": f"Некорректная дата: {str(e)}"}), 400
+    
+    group = request.args.get("group", "day")
+    if group not in stats.GROUPINGS:
+        return jsonify({"error": f"Группировка должна быть одной из: {', '.join(stats.GROUPINGS)}"}), 400
+    
+    exclude_folder = None
+    if request.args.get("include_trash") != "1":
+        trash_folder = get_trash_folder(current_user.id)
+        exclude_folder = trash_folder.id if trash_folder else None
+    
+    rows = stats.query_stats(
+        db.session, current_user.id, date_from, date_to,
+        group=group, folder_id=folder_id, exclude_folder=exclude_folder
+    )
+    if group == 'folder':
+        names = dict(db.session.query(Folder.id, Folder.name).filter_by(user_id=current_user.id))
+        for row in rows:
+            row['folder_name'] = names.get(row['folder'])
+    return jsonify({"group": group, "rows": rows})
+
+# Поиск по названиям записей и комментариям к ошибкам: /api/search?q=урок&page=2.
+# Слова ищутся по префиксу, записи отсортированы по релевантности, к каждой приложены совпавшие ошибки
+@bp.route("/api/search", methods=["GET"])
+@login_required
+def search_records():
+    query = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    limit = min(max(request.args.get("limit", current_app.config['SEARCH_PAGE_SIZE'], type=int), 1), 100)
+    if not query:
+        return jsonify({"results": [], "page": page, "has_more": False})
+    
+    try:
+        results, has_more = search.search(
+            db.session, current_user.id, query, limit, (page - 1) * limit,
+            include_trash=request.args.get("include_trash") == "1"
+        )
+    except OperationalError as e:
+        current_app.logger.error(f"Ошибка поиска: {str(e)}")
+        return jsonify({"error": "Поиск недоступен"}), 503
+    
+    for result in results:
+        result["url"] = url_for('main.playback', record_id=result["id"])
+    return jsonify({"results": results, "page": page, "has_more": has_more})
+
+# Метрики процесса в формате Prometheus
+@bp.route("/metrics", methods=["GET"])
+def metrics():
+    token = current_app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        abort(401)
+    return current_app.response_class(request_metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# Перестройка поискового индекса: flask --app app rebuild-search
+@bp.cli.command("rebuild-search")
+def rebuild_search_command():
+    with db.engine.begin() as connection:
+        search.install(connection)
+        rows = search.rebuild(connection)
+    print(f"Строк в поисковом индексе: {rows}")
+
+# Полный пересчет статистики, если данные менялись мимо триггеров: flask --app app rebuild-stats
+@bp.cli.command("rebuild-stats")
+def rebuild_stats_command():
+    with db.engine.begin() as connection:
+        stats.install_triggers(connection)
+        rows = stats.rebuild(connection)
+    print(f"Строк статистики: {rows}")
+
+# Пересчет счетчиков записей и папок, если данные менялись мимо триггеров: flask --app app repair-counters
+@bp.cli.command("repair-counters")
+def repair_counters_command():
+    with db.engine.begin() as connection:
+        counters.install_triggers(connection)
+        records, folders = counters.repair(connection)
+    print(f"Исправлено записей: {records}, папок: {folders}")
+
+# Массовое перемещение записей: {"records": [id, ...], "folder": id}. Чужие записи пропускаются,
+# перенос в корзину помечает записи удаленными, перенос из корзины восстанавливает их
+@bp.route("/api/records/move", methods=["POST"])
+@login_required
+def move_records_api():
+    data = request.json or {}
+    try:
+        record_ids = [int(record_id) for record_id in data.get("records", [])]
+        folder_id = int(data.get("folder") or 0)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Некорректный запрос: {str(e)}"}), 400
+    
+    if not record_ids or not folder_id:
+        return jsonify({"error": "Не указаны записи или папка"}), 400
+    if len(record_ids) > current_app.config['RECORD_BATCH_LIMIT']:
+        return jsonify({"error": "Слишком много записей в одном запросе"}), 400
+    
+    folder = db.session.get(Folder, folder_id)
+    if not folder or folder.user_id != current_user.id:
+        return jsonify({"error": "Папка не найдена или доступ запрещен"}), 404
+    
+    try:
+        moved = move_records(current_user.id, Record.id.in_(record_ids), folder, get_trash_folder(current_user.id))
+        db.session.commit()
+        return jsonify({"success": True, "moved": moved})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+# Очистка корзины пользователя целиком; файлы удаляются в фоне после коммита
+@bp.route("/api/trash/empty", methods=["POST"])
+@login_required
+def empty_trash():
+    trash_folder = get_trash_folder(current_user.id)
+    if not trash_folder:
+        return jsonify({"success": True, "deleted": 0})
+    
+    try:
+        deleted = purge_records(and_(Record.user_id == current_user.id, Record.id_folder == trash_folder.id))
+        db.session.commit()
+        job_queue.notify()
+        return jsonify({"success": True, "deleted": deleted})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+# Перенос файлов, сохраненных до появления хранилища: flask --app app migrate-audio.
+# Старый файл удаляется только после коммита, поэтому команду можно запускать повторно
+@bp.cli.command("migrate-audio")
+def migrate_audio_command():
+    from waveform import peaks_path
+    migrated = missing = 0
+    legacy_records = [r.id for r in Record.query.filter(Record.audio_file.isnot(None)).all()
+                      if not AudioStore.digest_of(r.audio_file)]
+    for record_id in legacy_records:
+        record = db.session.get(Record, record_id)
+        legacy_file = record.audio_file
+        # Старые файлы всегда лежат в UPLOAD_FOLDER, даже если хранилище уже S3
+        legacy_path = os.path.join(current_app.config['UPLOAD_FOLDER'], legacy_file)
+        if not os.path.exists(legacy_path):
+            missing += 1
+            print(f"Файл не найден: {legacy_file} (запись {record.id})")
+            continue
+        
+        with audio_store.import_file(legacy_path, move=False) as staged:
+            audio_file = staged.path
+            legacy_peaks = peaks_path(legacy_path)
+            if os.path.exists(legacy_peaks) and not audio_store.exists(peaks_path(audio_file)):
+                audio_store.store_derived(legacy_peaks, peaks_path(audio_file))
+            
+            record.audio_file = audio_file
+            acquire_blob(audio_file, staged.size, staged)
+            db.session.commit()
+        
+        # Один старый файл мог принадлежать нескольким записям
+        if not Record.query.filter_by(audio_file=legacy_file).first():
+            for path in (legacy_path, legacy_peaks):
+                if os.path.exists(path):
+                    os.remove(path)
+        migrated += 1
+    
+    print(f"Перенесено записей: {migrated}, не найдено файлов: {missing}")
+
+# Сегментация речи для записей, обработанных до ее появления: flask --app app detect-speech.
+# С --all пересчитываются все записи (например, после изменения порогов в waveform.py)
+@bp.cli.command("detect-speech")
+@click.option("--all", "recompute", is_flag=True, help="Пересчитать и уже размеченные записи")
+def detect_speech_command(recompute):
+    from waveform import UnsupportedAudio
+    query = db.session.query(Record.id).filter(Record.audio_file.isnot(None), Record.status == 'ready')
+    if not recompute:
+        query = query.filter(Record.speech_segments.is_(None))
+    done = skipped = 0
+    for (record_id,) in query.all():
+        record = db.session.get(Record, record_id)
+        try:
+            if not ensure_peaks_index(record.audio_file):
+                raise UnsupportedAudio(f"Аудиофайл не найден: {record.audio_file}")
+            update_speech_segments(record)
+            db.session.commit()
+            done += 1
+        except UnsupportedAudio as e:
+            db.session.rollback()
+            skipped += 1
+            print(f"Запись {record_id} пропущена: {str(e)}")
+    print(f"Размечено записей: {done}, пропущено: {skipped}")
+
+# Проверка профиля базы: flask --app app check-db
+@bp.cli.command("check-db")
+def check_db_command():
+    with db.engine.connect() as connection:
+        for name, value in current_pragmas(connection, current_app.config['SQLITE_PRAGMAS']).items():
+            print(f"{name} = {value}")
+    missing = missing_foreign_key_indexes(db.engine, db.metadata)
+    print("Нет индексов для: " + ", ".join(missing) if missing else "Индексы для всех внешних ключей на месте")
+
 # Запуск приложения
 if __name__ == "__main__":
-    app.run(debug=True)
-    
\ No newline at end of file
+    create_app().run(debug=True)
+    
@@ -0,0 +1,134 @@
+import io
+import json
+import posixpath
+import re
+import zipfile
+from datetime import datetime
+
+# Архив выгрузки папки: folder.json с названием папки и версией формата, затем для каждой записи
+# каталог <номер>-<название>/ с record.json (поля записи и ее ошибки) и audio.wav.
+# Если у нескольких записей одинаковое аудио, файл кладется один раз, а record.json ссылается на него.
+# Время в record.json - в миллисекундах, как в API
+
+FORMAT_VERSION = 1
+FOLDER_ENTRY = 'folder.json'
+RECORD_ENTRY = 'record.json'
+AUDIO_ENTRY = 'audio.wav'
+UNSAFE_NAME_RE = re.compile(r'[\x00-\x1f/\\:*?"<>|]+')
+
+
+class InvalidArchive(Exception):
+    pass
+
+
+# Приемник для zipfile: накапливает записанные байты, пока генератор их не заберет.
+# Поток не поддерживает seek, поэтому zipfile пишет размеры и CRC после данных (data descriptor)
+class _ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+# ZIP собирается на лету и отдается кусками. entries - итератор (имя, данные, время изменения):
+# данные - bytes (сжимаются) или функция без аргументов, открывающая файл на чтение (копируется без сжатия
+# кусками по chunk_size). В памяти одновременно лежит не больше одного куска
+def stream_zip(entries, chunk_size=64 * 1024):
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as archive:
+        for name, data, modified in entries:
+            info = zipfile.ZipInfo(name, date_time=(modified or datetime.now()).timetuple()[:6])
+            if isinstance(data, bytes):
+                info.compress_type = zipfile.ZIP_DEFLATED
+                archive.writestr(info, data)
+            else:
+                info.compress_type = zipfile.ZIP_STORED
+                with data() as source, archive.open(info, 'w', force_zip64=True) as target:
+                    for chunk in iter(lambda: source.read(chunk_size), b''):
+                        target.write(chunk)
+                        yield sink.take()
+            yield sink.take()
+    yield sink.take()
+
+
+def to_json(value):
+    return json.dumps(value, ensure_ascii=False, indent=2).encode('utf-8')
+
+
+def record_dir(index, name):
+    safe = UNSAFE_NAME_RE.sub('_', name).strip(' .')[:80] or 'record'
+    return f"{index:05d}-{safe}"
+
+
+def folder_entry(folder_name):
+    return to_json({'format': FORMAT_VERSION, 'folder': folder_name})
+
+
+def record_entry(record, mistakes, audio):
+    return to_json({
+        'name': record.name,
+        'created': record.datetime.isoformat() if record.datetime else None,
+        'duration': record.length * 1000 if record.length is not None else None,
+        'audio': audio,
+        'mistakes': [{
+            'time': mistake.time_of_mistake * 1000 if mistake.time_of_mistake is not None else None,
+            'type': mistake.type,
+            'comment': mistake.comment,
+        } for mistake in mistakes],
+    })
+
+
+def _load(archive, name):
+    try:
+        with archive.open(name) as f:
+            return json.load(f)
+    except KeyError:
+        raise InvalidArchive(f"В архиве нет {name}")
+    except ValueError as e:
+        raise InvalidArchive(f"Некорректный {name}: {str(e)}")
+
+
+def read_folder(archive):
+    meta = _load(archive, FOLDER_ENTRY)
+    if not isinstance(meta, dict) or meta.get('format') != FORMAT_VERSION:
+        raise InvalidArchive("Неподдерживаемая версия архива")
+    return meta
+
+
+# Записи архива по порядку каталогов: словарь с полями записи, где audio - имя файла аудио в архиве или None
+def read_records(archive):
+    names = set(archive.namelist())
+    for name in sorted(names):
+        if posixpath.basename(name) != RECORD_ENTRY:
+            continue
+        data = _load(archive, name)
+        try:
+            record = {
+                'name': str(data['name'])[:255],
+                'created': datetime.fromisoformat(data['created']) if data.get('created') else None,
+                'duration': float(data['duration']) if data.get('duration') is not None else None,
+                'audio': None,
+                'mistakes': [{
+                    'time': float(mistake['time']),
+                    'type': mistake.get('type') if mistake.get('type') in (1, 2) else 2,
+                    'comment': mistake.get('comment') or None,
+                } for mistake in data.get('mistakes') or [] if mistake.get('time') is not None],
+            }
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            raise InvalidArchive(f"Некорректный {name}: {str(e)}")
+        if data.get('audio'):
+            audio = posixpath.normpath(str(data['audio']))
+            if audio not in names:
+                raise InvalidArchive(f"{name}: в архиве нет {audio}")
+            record['audio'] = audio
+        yield record
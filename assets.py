@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shutil
+import urllib.parse
+import urllib.request
+
+from flask import request, url_for
+
+try:
+    from fontTools import subset as font_subset
+except ImportError:
+    font_subset = None
+
+# Сборка статики с отпечатками: каждый файл копируется в static/build под именем с хэшем содержимого
+# (css/folder.css -> css/folder.3f2a1b9c0d.css), а manifest.json сопоставляет логическое имя с собранным.
+# Такие файлы никогда не меняются по своему адресу, поэтому отдаются с Cache-Control: immutable
+
+BUILD_DIR = 'build'
+MANIFEST_NAME = 'manifest.json'
+SKIP_SUFFIXES = ('.gz', '.br', '.part')
+CSS_URL_RE = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def fingerprint(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def hashed_name(path, digest):
+    root, ext = posixpath.splitext(path)
+    return f"{root}.{digest}{ext}"
+
+
+# Ссылки url(...) в CSS на другие файлы статики заменяются ссылками на их собранные копии
+def rewrite_css(css, css_path, manifest):
+    base = posixpath.dirname(css_path)
+    hashed_base = posixpath.dirname(manifest.get(css_path, css_path))
+
+    def replace(match):
+        quote, target = match.groups()
+        if re.match(r'^(?:[a-z]+:|/|#)', target):
+            return match.group(0)
+        clean = re.split(r'[?#]', target, maxsplit=1)[0]
+        logical = posixpath.normpath(posixpath.join(base, clean))
+        if logical not in manifest:
+            return match.group(0)
+        relative = posixpath.relpath(manifest[logical], hashed_base)
+        fragment = '#' + target.split('#', 1)[1] if '#' in target else ''
+        return f"url({quote}{relative}{fragment}{quote})"
+
+    return CSS_URL_RE.sub(replace, css)
+
+
+def _asset_files(static_folder, skip):
+    skip = [os.path.abspath(path) for path in skip]
+    for directory, subdirectories, files in os.walk(static_folder):
+        subdirectories[:] = sorted(
+            name for name in subdirectories
+            if not name.startswith('.') and os.path.abspath(os.path.join(directory, name)) not in skip
+        )
+        for name in sorted(files):
+            if name.startswith('.') or name.endswith(SKIP_SUFFIXES):
+                continue
+            full_path = os.path.join(directory, name)
+            yield os.path.relpath(full_path, static_folder).replace(os.sep, '/'), full_path
+
+
+# Полная пересборка static/build. CSS обрабатывается последним: его хэш учитывает
+# переписанные ссылки, поэтому новая версия шрифта или картинки дает и новый адрес CSS
+def build(static_folder, skip=()):
+    build_root = os.path.join(static_folder, BUILD_DIR)
+    tmp_root = build_root + '.part'
+    shutil.rmtree(tmp_root, ignore_errors=True)
+    files = list(_asset_files(static_folder, list(skip) + [build_root, tmp_root]))
+    manifest = {}
+    contents = {}
+    for logical, full_path in sorted(files, key=lambda item: item[0].endswith('.css')):
+        with open(full_path, 'rb') as f:
+            data = f.read()
+        if logical.endswith('.css'):
+            data = rewrite_css(data.decode('utf-8'), logical, manifest).encode('utf-8')
+        manifest[logical] = hashed_name(logical, fingerprint(data))
+        contents[logical] = data
+
+    for logical, data in contents.items():
+        target = os.path.join(tmp_root, manifest[logical])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(data)
+    with open(os.path.join(tmp_root, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    shutil.rmtree(build_root, ignore_errors=True)
+    os.replace(tmp_root, build_root)
+    return manifest
+
+
+# Разрешение логических имен в адреса собранных файлов для шаблонов: {{ asset_url('css/menu.css') }}.
+# Без сборки (разработка) отдается обычный адрес static. В режиме отладки манифест
+# перечитывается после каждой пересборки
+class AssetManifest:
+    def __init__(self, app):
+        self.app = app
+        self.path = os.path.join(app.static_folder, BUILD_DIR, MANIFEST_NAME)
+        self._mtime = None
+        self._entries = {}
+        self.load()
+        app.add_template_global(self.url, 'asset_url')
+        app.after_request(self.cache_headers)
+
+    def load(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            self._mtime, self._entries = None, {}
+            return
+        if mtime != self._mtime:
+            with open(self.path) as f:
+                self._entries = json.load(f)
+            self._mtime = mtime
+
+    def url(self, name):
+        if self.app.debug:
+            self.load()
+        hashed = self._entries.get(name)
+        if hashed is None:
+            return url_for('static', filename=name)
+        return url_for('static', filename=f"{BUILD_DIR}/{hashed}")
+
+    def exists(self, name):
+        return name in self._entries or os.path.isfile(os.path.join(self.app.static_folder, name))
+
+    # Файлы из static/build неизменны по адресу: браузер не перепроверяет их до года
+    def cache_headers(self, response):
+        if (request.endpoint == 'static' and response.status_code in (200, 304)
+                and (request.view_args or {}).get('filename', '').startswith(BUILD_DIR + '/')
+                and not request.view_args['filename'].endswith(MANIFEST_NAME)):
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        return response
+
+
+ICON_RULE_RE = re.compile(r'([^{}]+)\{([^{}]*)\}')
+ICON_CODEPOINT_RE = re.compile(r'(?:content|--fa)\s*:\s*"\\([0-9a-fA-F]+)')
+ICON_CLASS_RE = re.compile(r'\bfa-([a-z0-9-]+)')
+
+
+# Иконки, которые используются в шаблонах и скриптах (классы fa-*)
+def used_icon_names(*roots):
+    names = set()
+    for root in roots:
+        for directory, _, files in os.walk(root):
+            for name in files:
+                if name.endswith(('.html', '.js')):
+                    with open(os.path.join(directory, name), encoding='utf-8', errors='ignore') as f:
+                        names.update(ICON_CLASS_RE.findall(f.read()))
+    return names
+
+
+# Кодовые точки глифов для выбранных иконок по правилам CSS Font Awesome
+def icon_codepoints(css, names):
+    codepoints = set()
+    for selectors, body in ICON_RULE_RE.findall(css):
+        match = ICON_CODEPOINT_RE.search(body)
+        if match and names.intersection(ICON_CLASS_RE.findall(selectors)):
+            codepoints.add(int(match.group(1), 16))
+    return codepoints
+
+
+# Локальная копия Font Awesome: CSS и шрифты скачиваются в static/vendor/fontawesome.
+# С subset и установленным fontTools шрифты урезаются до иконок, найденных в шаблонах и скриптах
+def vendor_font_awesome(css_url, target, subset=False, search_roots=()):
+    css_dir = os.path.join(target, 'css')
+    os.makedirs(css_dir, exist_ok=True)
+    with urllib.request.urlopen(css_url) as response:
+        css = response.read().decode('utf-8')
+
+    fonts = []
+    for _, font in CSS_URL_RE.findall(css):
+        if font.startswith('data:'):
+            continue
+        font = re.split(r'[?#]', font, maxsplit=1)[0]
+        font_path = os.path.normpath(os.path.join(css_dir, font))
+        if font_path in fonts:
+            continue
+        os.makedirs(os.path.dirname(font_path), exist_ok=True)
+        with urllib.request.urlopen(urllib.parse.urljoin(css_url, font)) as response, open(font_path, 'wb') as f:
+            shutil.copyfileobj(response, f)
+        fonts.append(font_path)
+
+    with open(os.path.join(css_dir, posixpath.basename(css_url)), 'w', encoding='utf-8') as f:
+        f.write(css)
+
+    if subset:
+        if font_subset is None:
+            raise RuntimeError("Для урезания шрифтов нужен пакет fonttools (pip install fonttools brotli)")
+        codepoints = icon_codepoints(css, used_icon_names(*search_roots))
+        for font_path in fonts:
+            if not font_path.endswith(('.woff2', '.ttf')):
+                continue
+            options = font_subset.Options()
+            options.flavor = 'woff2' if font_path.endswith('.woff2') else None
+            font = font_subset.load_font(font_path, options)
+            subsetter = font_subset.Subsetter(options)
+            subsetter.populate(unicodes=codepoints)
+            subsetter.subset(font)
+            font_subset.save_font(font, font_path, options)
+    return fonts
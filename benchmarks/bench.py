@@ -0,0 +1,452 @@
+"""Нагрузочный бенчмарк HTTP API SpeakPeak.
+
+Создает временную базу с синтетическими пользователями, папками, записями (сгенерированные WAV)
+и ошибками, поднимает приложение на локальном порту в отдельном процессе и гоняет настоящие
+маршруты из нескольких потоков. Результат - пропускная способность, p50/p95/p99 и число
+SQL-запросов на запрос по каждому маршруту, а также память процесса сервера за весь прогон
+(клиенты в нее не входят); сохраняется в JSON для сравнения между прогонами.
+
+    python benchmarks/bench.py --users 10 --records 50 --concurrency 8 --duration 30
+    python benchmarks/bench.py --compare benchmarks/results/<прошлый прогон>.json
+"""
+import argparse
+import http.cookiejar
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+import wave
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'bench-password'
+
+# Доли операций в смеси нагрузки: (маршрут Flask, метод) -> вес
+DEFAULT_MIX = {
+    'get_record': 35,
+    'folder': 20,
+    'batch_mistakes': 20,
+    'save_record': 10,
+    'get_folders': 10,
+    'delete_folder': 5,
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк HTTP API")
+    parser.add_argument('--users', type=int, default=5, help="число пользователей")
+    parser.add_argument('--folders', type=int, default=3, help="папок на пользователя (кроме системных)")
+    parser.add_argument('--records', type=int, default=20, help="записей в каждой папке")
+    parser.add_argument('--mistakes', type=int, default=5, help="ошибок в каждой записи")
+    parser.add_argument('--audio-seconds', type=float, default=5.0, help="длина сгенерированных WAV")
+    parser.add_argument('--sample-rate', type=int, default=16000)
+    parser.add_argument('--distinct-audio', type=int, default=20,
+                        help="сколько разных аудиофайлов на все записи (остальные - дубликаты в хранилище)")
+    parser.add_argument('--concurrency', type=int, default=8, help="число параллельных клиентов")
+    parser.add_argument('--duration', type=float, default=20.0, help="длительность нагрузки, секунд")
+    parser.add_argument('--seed', type=int, default=1, help="seed генератора для воспроизводимости")
+    parser.add_argument('--workdir', help="каталог для временной базы и файлов (по умолчанию временный)")
+    parser.add_argument('--output', help="куда сохранить JSON (по умолчанию benchmarks/results/<время>.json)")
+    parser.add_argument('--compare', help="JSON прошлого прогона для сравнения")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="допустимый рост p95 при сравнении (0.2 = 20%%), иначе код выхода 1")
+    return parser.parse_args()
+
+
+def make_wav(seconds, sample_rate, rng):
+    samples = int(seconds * sample_rate)
+    t = np.arange(samples) / sample_rate
+    signal = 0.3 * np.sin(2 * np.pi * rng.uniform(120, 400) * t) + 0.05 * rng.standard_normal(samples)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes((np.clip(signal, -1, 1) * 32767).astype('<i2').tobytes())
+    return buffer.getvalue()
+
+
+# Приложение с временной базой и каталогами внутри workdir
+def load_app(workdir):
+    sys.path.insert(0, ROOT)
+    from app import create_app
+    from config import Config
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+        UPLOAD_FOLDER = os.path.join(workdir, 'uploads')
+        UPLOAD_SESSIONS_FOLDER = os.path.join(workdir, 'upload_sessions')
+        JOB_WORKERS = 1
+
+    return create_app(BenchConfig)
+
+
+def seed(app, args, rng):
+    from extensions import audio_store
+    from models import db, User, Folder, Record, Mistake, AudioBlob
+    from storage import AudioStore
+
+    started = time.perf_counter()
+    audio = []
+    with app.app_context():
+        for _ in range(args.distinct_audio):
+            with audio_store.write(
+                io.BytesIO(make_wav(args.audio_seconds, args.sample_rate, rng)), app.config['MAX_UPLOAD_SIZE']
+            ) as staged:
+                audio.append((staged.path, staged.size))
+
+        password_hash = User(login='', first_name='', last_name='')
+        password_hash.set_password(PASSWORD)
+        password_hash = password_hash.password_hash
+
+        users = {}
+        refs = defaultdict(int)
+        now = datetime.utcnow()
+        for number in range(args.users):
+            user = User(first_name='Bench', last_name=str(number), login=f'bench{number:04d}',
+                        password_hash=password_hash)
+            db.session.add(user)
+            db.session.flush()
+            folders = [Folder(name='Черновики', user_id=user.id), Folder(name='Корзина', user_id=user.id)]
+            folders += [Folder(name=f'Папка {i}', user_id=user.id) for i in range(args.folders)]
+            db.session.add_all(folders)
+            db.session.flush()
+
+            record_rows = []
+            for folder in folders[:1] + folders[2:]:
+                for i in range(args.records):
+                    path, _ = audio[rng.integers(len(audio))]
+                    refs[path] += 1
+                    record_rows.append({
+                        'user_id': user.id, 'id_folder': folder.id, 'name': f'Запись {folder.id}-{i}',
+                        'length': args.audio_seconds, 'audio_file': path, 'status': 'ready',
+                        'datetime': now - timedelta(minutes=int(rng.integers(0, 90 * 24 * 60))),
+                    })
+            record_ids = [row.id for row in db.session.execute(
+                db.insert(Record).returning(Record.id), record_rows
+            )] if record_rows else []
+
+            mistake_rows = [{
+                'record_id': record_id,
+                'time_of_mistake': float(rng.uniform(0, args.audio_seconds)),
+                'type': int(rng.integers(1, 3)),
+                'comment': 'синтетическая ошибка' if rng.random() < 0.3 else None,
+            } for record_id in record_ids for _ in range(args.mistakes)]
+            if mistake_rows:
+                for row in mistake_rows:
+                    row['time_ms'] = int(round(row['time_of_mistake'] * 1000))
+                db.session.execute(db.insert(Mistake), mistake_rows)
+
+            users[user.login] = {
+                'records': record_ids,
+                'folders': [folder.id for folder in folders if folder.name != 'Корзина'],
+                'drafts': folders[0].id,
+            }
+        sizes = dict(audio)
+        db.session.execute(db.insert(AudioBlob), [
+            {'hash': AudioStore.digest_of(path), 'path': path, 'size': sizes[path], 'ref_count': count}
+            for path, count in refs.items()
+        ])
+        db.session.commit()
+
+    return users, {
+        'users': args.users,
+        'records': sum(len(user['records']) for user in users.values()),
+        'mistakes': sum(len(user['records']) for user in users.values()) * args.mistakes,
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+
+
+# Счетчик SQL-запросов по маршруту; запросы фоновых задач попадают в "background"
+class QueryCounter:
+    def __init__(self, app):
+        from flask import has_request_context, request
+        from sqlalchemy import event
+        from models import db
+
+        self.counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+        def count(*args):
+            if has_request_context():
+                # Имя маршрута без префикса блюпринта: main.get_record -> get_record
+                key = f"{(request.endpoint or 'unknown').rsplit('.', 1)[-1]} {request.method}"
+            else:
+                key = 'background'
+            with self._lock:
+                self.counts[key] += 1
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', count)
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Client:
+    def __init__(self, base_url, timings, errors):
+        self.base_url = base_url
+        self.timings = timings
+        self.errors = errors
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect()
+        )
+
+    # Возвращает (статус, тело, заголовки); время попадает в статистику под именем name
+    def request(self, name, method, path, body=None, headers=None):
+        request = urllib.request.Request(self.base_url + path, data=body, method=method, headers=headers or {})
+        started = time.perf_counter()
+        try:
+            with self.opener.open(request) as response:
+                status, data, response_headers = response.status, response.read(), response.headers
+        except urllib.error.HTTPError as e:
+            status, data, response_headers = e.code, e.read(), e.headers
+        elapsed = (time.perf_counter() - started) * 1000
+        if name:
+            self.timings[name].append(elapsed)
+            if status >= 400:
+                self.errors[name] += 1
+        return status, data, response_headers
+
+    def json(self, name, method, path, payload):
+        return self.request(name, method, path, json.dumps(payload).encode(),
+                            {'Content-Type': 'application/json'})
+
+    def form(self, name, path, fields):
+        return self.request(name, 'POST', path, urllib.parse.urlencode(fields).encode(),
+                            {'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def multipart(self, name, path, fields, file_field, file_name, file_data):
+        boundary = uuid.uuid4().hex
+        parts = []
+        for key, value in fields.items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode())
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+                     f'filename="{file_name}"\r\nContent-Type: audio/wav\r\n\r\n'.encode())
+        parts.append(file_data)
+        parts.append(f'\r\n--{boundary}--\r\n'.encode())
+        return self.request(name, 'POST', path, b''.join(parts),
+                            {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+
+
+def login(client, user_login):
+    _, page, _ = client.request(None, 'GET', '/login')
+    token = re.search(rb'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1).decode()
+    status, _, _ = client.form('login POST', '/login', {'csrf_token': token, 'login': user_login, 'password': PASSWORD})
+    return status == 302
+
+
+def run_client(base_url, user_login, data, args, deadline, seed_value, timings, errors, upload):
+    rng = random.Random(seed_value)
+    client = Client(base_url, timings, errors)
+    if not login(client, user_login):
+        return
+    operations, weights = zip(*DEFAULT_MIX.items())
+
+    while time.perf_counter() < deadline:
+        operation = rng.choices(operations, weights)[0]
+        if operation == 'get_record':
+            client.request('get_record GET', 'GET', f"/api/records/{rng.choice(data['records'])}")
+        elif operation == 'folder':
+            client.request('folder GET', 'GET', f"/folder/{rng.choice(data['folders'])}")
+        elif operation == 'get_folders':
+            client.request('get_folders GET', 'GET', '/api/folders')
+        elif operation == 'batch_mistakes':
+            record_id = rng.choice(data['records'])
+            client.json('batch_mistakes POST', 'POST', f"/api/records/{record_id}/mistakes/batch", {'operations': [
+                {'op': 'add', 'time': rng.uniform(0, args.audio_seconds * 1000), 'type': 2, 'client_id': 'a'},
+                {'op': 'comment', 'client_id': 'a', 'comment': 'бенчмарк'},
+            ]})
+        elif operation == 'save_record':
+            status, body, _ = client.multipart('save_record POST', '/api/records', {
+                'name': 'Бенчмарк', 'folder': data['drafts'],
+                'duration': int(args.audio_seconds * 1000), 'errors': '[100, 200]',
+            }, 'audio', 'recording.wav', upload)
+            if status == 200:
+                data['records'].append(json.loads(body)['record_id'])
+        elif operation == 'delete_folder':
+            status, _, headers = client.form('create_folder POST', '/create_folder', {'folder_name': 'Временная'})
+            match = re.search(r'/folder/(\d+)', headers.get('Location', '')) if status == 302 else None
+            if match:
+                client.request('delete_folder DELETE', 'DELETE', f"/api/folders/{match.group(1)}")
+
+
+# Сервер работает в дочернем процессе, чтобы его память не смешивалась с памятью клиентов.
+# Процесс сообщает порт, обслуживает запросы до команды остановки и возвращает счетчики SQL
+def serve(app, connection):
+    counter = QueryCounter(app)
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    connection.send(server.server_port)
+    connection.recv()
+    server.shutdown()
+    connection.send(dict(counter.counts))
+
+
+# Память процесса из /proc/<pid>/status в МБ: VmRSS - текущая, VmHWM - пиковая с запуска процесса.
+# Пик ядро отслеживает само, поэтому достаточно прочитать его перед нагрузкой и после нее
+def process_memory(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            fields = dict(line.split(':', 1) for line in f if line.startswith(('VmRSS', 'VmHWM')))
+    except OSError:
+        return None
+    return {key: round(int(value.split()[0]) / 1024, 1) for key, value in fields.items()}
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, max(0, int(round(share * len(ordered))) - 1))], 2)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result, baseline=None):
+    header = f"{'маршрут':28} {'запросов':>9} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'ошибок':>7} {'SQL/запр':>9}"
+    if baseline:
+        header += f" {'p95 было':>9} {'Δp95':>7}"
+    print(header)
+    for name, row in sorted(result['endpoints'].items()):
+        line = (f"{name:28} {row['count']:>9} {row['rps']:>8} {row['p50_ms']:>8} {row['p95_ms']:>8} "
+                f"{row['p99_ms']:>8} {row['errors']:>7} {row['queries_per_request'] or '-':>9}")
+        old = (baseline or {}).get('endpoints', {}).get(name)
+        if old:
+            line += f" {old['p95_ms']:>9} {(row['p95_ms'] / old['p95_ms'] - 1) * 100:>+6.0f}%"
+        print(line)
+    total = result['total']
+    memory = result['server_memory']
+    memory = f"{memory['start_rss_mb']} -> {memory['peak_rss_mb']} МБ" if memory else "нет данных"
+    print(f"Всего: {total['count']} запросов, {total['rps']} rps, ошибок {total['errors']}, "
+          f"фоновых SQL {result['background_queries']}, память сервера {memory}")
+
+
+# Маршруты, у которых p95 вырос больше порога относительно прошлого прогона
+def regressions(result, baseline, threshold):
+    found = []
+    for name, row in result['endpoints'].items():
+        old = baseline['endpoints'].get(name)
+        if old and old['p95_ms'] and row['p95_ms'] > old['p95_ms'] * (1 + threshold):
+            found.append(name)
+    return found
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='speakpeak-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    if os.path.exists(os.path.join(workdir, 'bench.db')):
+        sys.exit(f"В {workdir} уже есть bench.db: бенчмарку нужна пустая база")
+
+    app = load_app(workdir)
+    users, seeded = seed(app, args, rng)
+    print(f"База: {workdir}, пользователей {seeded['users']}, записей {seeded['records']}, "
+          f"ошибок {seeded['mistakes']} ({seeded['seconds']} с)")
+
+    # Соединения из пула не должны достаться дочернему процессу
+    with app.app_context():
+        from models import db
+        db.engine.dispose()
+    connection, child_connection = multiprocessing.Pipe()
+    server = multiprocessing.get_context('fork').Process(target=serve, args=(app, child_connection), daemon=True)
+    server.start()
+    base_url = f"http://127.0.0.1:{connection.recv()}"
+    memory_before = process_memory(server.pid)
+
+    timings, errors = defaultdict(list), defaultdict(int)
+    upload = make_wav(args.audio_seconds, args.sample_rate, rng)
+    logins = list(users)
+    started = time.perf_counter()
+    deadline = started + args.duration
+    clients = [threading.Thread(target=run_client, args=(
+        base_url, logins[i % len(logins)], users[logins[i % len(logins)]], args, deadline,
+        args.seed * 1000 + i, timings, errors, upload
+    )) for i in range(args.concurrency)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - started
+    memory_after = process_memory(server.pid)
+    connection.send('stop')
+    query_counts = connection.recv()
+    server.join()
+
+    endpoints = {}
+    for name, values in timings.items():
+        queries = query_counts.get(name)
+        endpoints[name] = {
+            'count': len(values),
+            'rps': round(len(values) / elapsed, 1),
+            'p50_ms': percentile(values, 0.50),
+            'p95_ms': percentile(values, 0.95),
+            'p99_ms': percentile(values, 0.99),
+            'errors': errors[name],
+            'queries_per_request': round(queries / len(values), 1) if queries else None,
+        }
+    count = sum(len(values) for values in timings.values())
+    result = {
+        'meta': {
+            'started': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'args': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'workdir')},
+        },
+        'seed': seeded,
+        'endpoints': endpoints,
+        'total': {'count': count, 'rps': round(count / elapsed, 1), 'errors': sum(errors.values())},
+        'background_queries': query_counts.get('background', 0),
+        # Только процесс сервера; None там, где нет /proc
+        'server_memory': {
+            'start_rss_mb': memory_before['VmRSS'], 'peak_rss_mb': memory_after['VmHWM'],
+        } if memory_before and memory_after else None,
+    }
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results',
+                                         datetime.utcnow().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    print(f"Результат: {output}")
+
+    if baseline:
+        slower = regressions(result, baseline, args.threshold)
+        if slower:
+            print(f"p95 вырос больше чем на {args.threshold:.0%}: {', '.join(slower)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import gzip
+import mimetypes
+import os
+
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Сжатие ответов и отдача заранее сжатых статических файлов.
+# brotli и zstd используются, только если установлены соответствующие пакеты
+
+COMPRESSIBLE_MIMETYPES = (
+    'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+    'application/json', 'image/svg+xml',
+)
+COMPRESSIBLE_EXTENSIONS = ('.html', '.css', '.js', '.json', '.svg', '.txt', '.map')
+# Расширение заранее сжатой копии для каждого кодирования
+PRECOMPRESSED_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def available_encodings():
+    encodings = []
+    if brotli is not None:
+        encodings.append('br')
+    if zstandard is not None:
+        encodings.append('zstd')
+    encodings.append('gzip')
+    return encodings
+
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return gzip.compress(data, compresslevel=min(level, 9), mtime=0)
+
+
+# Первое из кодирований в порядке предпочтения сервера, которое принимает клиент
+def negotiate(encodings):
+    accepted = request.accept_encodings
+    for encoding in encodings:
+        if accepted.quality(encoding) > 0:
+            return encoding
+    return None
+
+
+# Сжатие динамических ответов (HTML, JSON) в after_request. Не сжимаются потоковые ответы,
+# файлы из send_file, ответы короче min_size и типы не из списка
+class Compression:
+    def __init__(self, app, types=COMPRESSIBLE_MIMETYPES, min_size=500, level=6, encodings=None):
+        self.mimetypes = set(types)
+        self.min_size = min_size
+        self.level = level
+        self.encodings = [e for e in (encodings or available_encodings()) if e in available_encodings()]
+        app.after_request(self.compress_response)
+
+    def compress_response(self, response):
+        if response.mimetype not in self.mimetypes or 'Content-Encoding' in response.headers:
+            return response
+        response.vary.add('Accept-Encoding')
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or (response.content_length or 0) < self.min_size):
+            return response
+
+        encoding = negotiate(self.encodings)
+        if encoding is None:
+            return response
+
+        data = compress(response.get_data(), encoding, self.level)
+        response.set_data(data)
+        response.headers['Content-Encoding'] = encoding
+        # Сжатое тело отличается побайтно, поэтому сильный ETag становится слабым
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+# Заранее сжатые копии статических файлов: рядом с app.js появляются app.js.gz и app.js.br.
+# Копия пишется, только если она меньше оригинала; неизменившиеся файлы пропускаются
+def precompress_directory(root, level=9, skip=()):
+    skip = [os.path.abspath(path) for path in skip]
+    written = []
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories[:] = [name for name in subdirectories
+                             if not name.startswith('.') and os.path.abspath(os.path.join(directory, name)) not in skip]
+        for name in files:
+            if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            source = os.path.join(directory, name)
+            with open(source, 'rb') as f:
+                data = f.read()
+            for encoding, suffix in PRECOMPRESSED_SUFFIXES.items():
+                if encoding not in available_encodings():
+                    continue
+                target = source + suffix
+                if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+                    continue
+                compressed = compress(data, encoding, 11 if encoding == 'br' else level)
+                if len(compressed) >= len(data):
+                    if os.path.exists(target):
+                        os.remove(target)
+                    continue
+                with open(target + '.part', 'wb') as f:
+                    f.write(compressed)
+                os.replace(target + '.part', target)
+                written.append(target)
+    return written
+
+
+# Отдача статики: если клиент принимает br или gzip и рядом лежит свежая сжатая копия,
+# отдается она с исходным Content-Type. Остальное обслуживает обычный обработчик Flask
+def serve_precompressed(app, max_age=None):
+    def static(filename):
+        source = safe_join(app.static_folder, filename)
+        if source and filename.endswith(COMPRESSIBLE_EXTENSIONS) and os.path.isfile(source):
+            for encoding, suffix in PRECOMPRESSED_SUFFIXES.items():
+                compressed = source + suffix
+                if (request.accept_encodings.quality(encoding) > 0 and os.path.isfile(compressed)
+                        and os.path.getmtime(compressed) >= os.path.getmtime(source)):
+                    response = send_from_directory(
+                        app.static_folder, filename + suffix,
+                        mimetype=mimetypes.guess_type(filename)[0], max_age=max_age
+                    )
+                    response.headers['Content-Encoding'] = encoding
+                    response.vary.add('Accept-Encoding')
+                    return response
+        response = app.send_static_file(filename)
+        if filename.endswith(COMPRESSIBLE_EXTENSIONS):
+            response.vary.add('Accept-Encoding')
+        return response
+
+    app.view_functions['static'] = static
@@ -1,11 +1,85 @@
-
 import os
 
-basedir = os.path.abspath(os.path.dirname(__file__))
+from sqlite_profile import DEFAULT_PRAGMAS
+
 
+# Настройки приложения по умолчанию: create_app(Config). Для другого окружения (тесты, бенчмарк)
+# достаточно унаследоваться и переопределить нужные значения
 class Config:
-    # Здесь Flask будет брать SECRET_KEY из переменной окружения, а если её нет, использовать "fallback-secret-key"
-    SECRET_KEY = os.environ.get("SECRET_KEY", "fallback-secret-key")
-    SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(basedir, "site.db")
+    # В продакшене ключ задается переменной окружения SECRET_KEY
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'd2f8a8b1c4e5f6a7b8c9d0e1f2a3b4c5d6e7f8a9b0c1d2')
+    # База и каталог аудио переопределяются переменными окружения (например, отдельная база для бенчмарков)
+    SQLALCHEMY_DATABASE_URI = os.environ.get('SPEAKPEAK_DATABASE_URI', 'sqlite:///site.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-
+    UPLOAD_FOLDER = os.environ.get('SPEAKPEAK_UPLOAD_FOLDER', 'static/uploads')
+    # Потоковая загрузка аудио: размер чанка и предельный размер файла
+    UPLOAD_CHUNK_SIZE = 64 * 1024
+    MAX_UPLOAD_SIZE = 1024 * 1024 * 1024
+    # Кэширование аудио в браузере; отдачу файлов можно переложить на nginx через USE_X_SENDFILE
+    AUDIO_CACHE_MAX_AGE = 3600
+    # Докачка: части хранятся вне static, незавершенные сессии удаляются через сутки
+    # None - каталог upload_sessions в instance-папке приложения
+    UPLOAD_SESSIONS_FOLDER = os.environ.get('SPEAKPEAK_UPLOAD_SESSIONS_FOLDER')
+    UPLOAD_SESSION_TTL = 24 * 3600
+    MAX_UPLOAD_CHUNK_SIZE = 32 * 1024 * 1024
+    # Сколько записей папки отдается за одну страницу
+    FOLDER_PAGE_SIZE = 50
+    # Прагмы SQLite, выставляемые на каждом соединении (WAL, synchronous, кэш, mmap, busy_timeout)
+    SQLITE_PRAGMAS = dict(DEFAULT_PRAGMAS)
+    # Предельное число операций в одном пакетном запросе к ошибкам
+    MISTAKE_BATCH_LIMIT = 500
+    # Кэш пользователей для Flask-Login: сколько пользователей держать в памяти процесса и сколько секунд
+    USER_CACHE_SIZE = 1024
+    USER_CACHE_TTL = 60
+    # Фоновая обработка записей: потоки-воркеры в каждом веб-процессе (0 - только отдельный flask worker),
+    # число попыток, пауза перед повтором и время, после которого задача упавшего воркера отдается другому
+    JOB_WORKERS = 1
+    JOB_MAX_ATTEMPTS = 3
+    JOB_RETRY_DELAY = 10
+    JOB_LOCK_TIMEOUT = 600
+    JOB_POLL_INTERVAL = 1.0
+    # Записи в корзине удаляются навсегда через столько дней; очистка идет пачками раз в PURGE_INTERVAL секунд
+    TRASH_RETENTION_DAYS = 30
+    PURGE_BATCH_SIZE = 500
+    PURGE_INTERVAL = 24 * 3600
+    # Предельное число записей в одном запросе массового перемещения
+    RECORD_BATCH_LIMIT = 1000
+    # Сколько записей отдается за одну страницу поиска
+    SEARCH_PAGE_SIZE = 20
+    # Метрики Prometheus на /metrics; если задан токен, опрос требует заголовок Authorization: Bearer <токен>.
+    # Запросы дольше SLOW_REQUEST_THRESHOLD секунд пишутся в журнал вместе с самыми медленными SQL (None - не писать)
+    METRICS_TOKEN = os.environ.get('SPEAKPEAK_METRICS_TOKEN')
+    SLOW_REQUEST_THRESHOLD = 1.0
+    SLOW_REQUEST_QUERIES = 5
+    # Хэширование паролей: метод и стоимость в формате Werkzeug ("scrypt", "scrypt:65536:8:1", "pbkdf2:sha256:600000").
+    # Старые хэши пересчитываются при успешном входе. Хэши считаются в отдельном пуле из PASSWORD_HASH_WORKERS потоков,
+    # ждать могут не больше PASSWORD_HASH_QUEUE запросов и не дольше PASSWORD_HASH_TIMEOUT секунд
+    PASSWORD_HASH_METHOD = 'scrypt'
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_QUEUE = 32
+    PASSWORD_HASH_TIMEOUT = 10
+    # Не больше LOGIN_RATE_LIMIT попыток входа под одним логином за LOGIN_RATE_WINDOW секунд
+    LOGIN_RATE_LIMIT = 10
+    LOGIN_RATE_WINDOW = 300
+    # Сжатие HTML и JSON длиннее COMPRESS_MIN_SIZE байт (gzip, а также br и zstd, если установлены brotli и zstandard).
+    # Статика отдается из заранее сжатых копий .br/.gz, если они собраны командой flask --app app compress-static
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_LEVEL = 6
+    # Иконки Font Awesome берутся с CDN, пока локальная копия не скачана командой flask --app app vendor-icons
+    FONT_AWESOME_URL = 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.7.2/css/all.min.css'
+    FONT_AWESOME_VENDOR_PATH = 'vendor/fontawesome/css/all.min.css'
+    # Хранилище аудио: 'local' - каталог UPLOAD_FOLDER, 's3' - S3-совместимый бакет (AWS, MinIO; нужен boto3,
+    # учетные данные берутся из обычных переменных AWS_*). С S3 браузер загружает и скачивает аудио напрямую
+    # по подписанным ссылкам, которые действуют S3_URL_EXPIRES секунд; в CORS бакета нужно разрешить PUT и GET
+    # с адреса сайта. Индексы пиков кэшируются в STORAGE_CACHE_FOLDER (None - storage_cache в instance-папке)
+    STORAGE_BACKEND = os.environ.get('SPEAKPEAK_STORAGE', 'local')
+    S3_BUCKET = os.environ.get('SPEAKPEAK_S3_BUCKET')
+    S3_PREFIX = os.environ.get('SPEAKPEAK_S3_PREFIX', 'audio/')
+    S3_ENDPOINT_URL = os.environ.get('SPEAKPEAK_S3_ENDPOINT_URL')
+    S3_REGION = os.environ.get('SPEAKPEAK_S3_REGION')
+    S3_URL_EXPIRES = 3600
+    STORAGE_CACHE_FOLDER = os.environ.get('SPEAKPEAK_STORAGE_CACHE_FOLDER')
+    # Выгрузка папки архивом: записи и ошибки читаются из базы пачками по EXPORT_BATCH_SIZE.
+    # Загружаемый архив сначала пишется на диск, поэтому его размер ограничен отдельно
+    EXPORT_BATCH_SIZE = 100
+    MAX_IMPORT_SIZE = 16 * 1024 * 1024 * 1024
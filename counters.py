@@ -0,0 +1,82 @@
+# Счетчики для списков: у записи - число ошибок по типам, у папки - число записей и их общая длительность.
+# Как и stats_daily, они поддерживаются триггерами SQLite в той же транзакции, что и изменение,
+# поэтому верны и после массовых UPDATE/DELETE (перенос в корзину, удаление папки, очистка).
+# Если данные менялись мимо триггеров, счетчики пересчитывает repair
+
+RECORD_COUNTERS = ('recorder_mistakes', 'review_mistakes')
+FOLDER_COUNTERS = ('record_count', 'total_length')
+# Длительность папки накапливается суммой float, мелкое расхождение ошибкой не считается
+LENGTH_TOLERANCE = 0.001
+
+
+def _mistake_delta(row, sign):
+    return (f"UPDATE record SET recorder_mistakes = recorder_mistakes {sign} ({row}.type IS 1), "
+            f"review_mistakes = review_mistakes {sign} ({row}.type IS 2) WHERE id = {row}.record_id;")
+
+
+def _record_delta(row, sign):
+    return (f"UPDATE folder SET record_count = record_count {sign} 1, "
+            f"total_length = total_length {sign} COALESCE({row}.length, 0) WHERE id = {row}.id_folder;")
+
+
+TRIGGERS = {
+    'counters_mistake_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS counters_mistake_insert AFTER INSERT ON mistake BEGIN
+            {_mistake_delta('NEW', '+')}
+        END""",
+    'counters_mistake_delete': f"""
+        CREATE TRIGGER IF NOT EXISTS counters_mistake_delete AFTER DELETE ON mistake BEGIN
+            {_mistake_delta('OLD', '-')}
+        END""",
+    'counters_mistake_update': f"""
+        CREATE TRIGGER IF NOT EXISTS counters_mistake_update AFTER UPDATE OF type, record_id ON mistake BEGIN
+            {_mistake_delta('OLD', '-')}
+            {_mistake_delta('NEW', '+')}
+        END""",
+    'counters_record_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS counters_record_insert AFTER INSERT ON record BEGIN
+            {_record_delta('NEW', '+')}
+        END""",
+    'counters_record_delete': f"""
+        CREATE TRIGGER IF NOT EXISTS counters_record_delete AFTER DELETE ON record BEGIN
+            {_record_delta('OLD', '-')}
+        END""",
+    'counters_record_update': f"""
+        CREATE TRIGGER IF NOT EXISTS counters_record_update AFTER UPDATE OF id_folder, length ON record BEGIN
+            {_record_delta('OLD', '-')}
+            {_record_delta('NEW', '+')}
+        END""",
+}
+
+
+def install_triggers(connection):
+    for name, ddl in TRIGGERS.items():
+        connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name}")
+        connection.exec_driver_sql(ddl)
+
+
+# Пересчет из mistake и record; меняются только строки, где счетчики разошлись.
+# Возвращает число исправленных записей и папок. Выполняется в транзакции вызывающего
+def repair(connection):
+    records = connection.exec_driver_sql("""
+        UPDATE record SET recorder_mistakes = m.recorder, review_mistakes = m.review
+        FROM (
+            SELECT r.id, count(mistake.id) FILTER (WHERE mistake.type IS 1) AS recorder,
+                   count(mistake.id) FILTER (WHERE mistake.type IS 2) AS review
+            FROM record r LEFT JOIN mistake ON mistake.record_id = r.id
+            GROUP BY r.id
+        ) m
+        WHERE m.id = record.id AND (record.recorder_mistakes IS NOT m.recorder OR record.review_mistakes IS NOT m.review)
+    """).rowcount
+    folders = connection.exec_driver_sql(f"""
+        UPDATE folder SET record_count = r.records, total_length = r.length
+        FROM (
+            SELECT f.id, count(record.id) AS records, COALESCE(sum(record.length), 0) AS length
+            FROM folder f LEFT JOIN record ON record.id_folder = f.id
+            GROUP BY f.id
+        ) r
+        WHERE r.id = folder.id AND (folder.record_count IS NOT r.records
+                                    OR abs(folder.total_length - r.length) > {LENGTH_TOLERANCE}
+                                    OR folder.total_length IS NULL)
+    """).rowcount
+    return records, folders
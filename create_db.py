@@ -1,46 +1,45 @@
-from app import create_app
-from models import db, User, Folder, Record, Mistake
 from datetime import datetime
 
-# Создаем приложение Flask
+from app import create_app, init_database
+from models import db, User, Folder, Record, Mistake
+
+# Пересоздание базы с тестовыми данными для разработки: python create_db.py.
+# Все данные в базе из настроек (SPEAKPEAK_DATABASE_URI) удаляются
 app = create_app()
 
-# Используем контекст приложения для работы с базой данных
 with app.app_context():
-    # Удаляем все таблицы (опционально, если нужно очистить базу)
     db.drop_all()
+    # Поисковый индекс не описан моделями и удаляется отдельно
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE IF EXISTS search_index")
+    # Таблицы, индексы и триггеры создаются так же, как при запуске приложения
+    init_database(app)
 
-    # Создаем все таблицы заново
-    db.create_all()
-
-    # Пример добавления тестовых данных
     user = User(
         first_name="John",
         last_name="Doe",
         login="john_doe",
     )
-    user.set_password("password123")  # Хэшируем пароль
+    user.set_password("password123")
     db.session.add(user)
-    db.session.commit()
+    db.session.flush()
 
-    # Создаем папку для пользователя
-    folder = Folder(name="My Folder", user_id=user.id)
-    db.session.add(folder)
-    db.session.commit()
+    drafts = Folder(name="Черновики", user_id=user.id)
+    db.session.add_all([drafts, Folder(name="Корзина", user_id=user.id), Folder(name="My Folder", user_id=user.id)])
+    db.session.flush()
 
-    # Создаем запись в папке
     record = Record(
         user_id=user.id,
-        id_folder=folder.id,
+        id_folder=drafts.id,
+        name="Пример записи",
         trash=0,
         length=120.5,
-        audio_file="path/to/audio.mp3",
+        audio_file=None,
         datetime=datetime.utcnow()
     )
     db.session.add(record)
-    db.session.commit()
+    db.session.flush()
 
-    # Создаем ошибку для записи
     mistake = Mistake(
         record_id=record.id,
         comment="Wrong pronunciation",
@@ -50,4 +49,4 @@ with app.app_context():
     db.session.add(mistake)
     db.session.commit()
 
-    print("База данных и тестовые данные успешно созданы!")
\ No newline at end of file
+    print("База данных и тестовые данные успешно созданы!")
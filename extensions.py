@@ -0,0 +1,25 @@
+from flask import current_app
+from flask_login import LoginManager
+from werkzeug.local import LocalProxy
+
+# Объекты, которые create_app создает для каждого приложения со своими настройками.
+# Модули обращаются к ним через эти прокси: внутри контекста приложения прокси ведет
+# к объекту текущего приложения, поэтому импорт модулей не зависит от порядка создания
+
+EXTENSION_KEY = 'speakpeak'
+
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
+
+
+def _service(name):
+    return LocalProxy(lambda: current_app.extensions[EXTENSION_KEY][name])
+
+
+audio_store = _service('audio_store')
+user_cache = _service('user_cache')
+password_hasher = _service('password_hasher')
+login_limiter = _service('login_limiter')
+job_queue = _service('job_queue')
+request_metrics = _service('request_metrics')
+asset_manifest = _service('asset_manifest')
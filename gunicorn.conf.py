@@ -0,0 +1,35 @@
+import multiprocessing
+import os
+
+# Продакшен: gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Приложение загружается один раз в главном процессе (preload_app): схема базы, триггеры и индексы
+# проверяются однократно, а воркеры стартуют копией уже импортированного кода. Соединения с базой,
+# открытые до fork, воркерам не передаются - в post_fork пул каждого воркера сбрасывается.
+# Потоки фоновых задач и хэширования паролей создаются в самих воркерах, при первом запросе.
+#
+# Перезапуск: kill -HUP <master> перезапускает воркеры без простоя, но с preload_app код не перечитывается.
+# Для выкладки нового кода: kill -USR2 <master> (запуск нового мастера), затем kill -QUIT <старый master>
+
+bind = os.environ.get('SPEAKPEAK_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# Потоки внутри воркера: долгие загрузки и отдача аудио не блокируют остальные запросы
+worker_class = 'gthread'
+threads = int(os.environ.get('SPEAKPEAK_THREADS', 4))
+preload_app = True
+# Загрузка длинной записи по медленной сети может идти минутами
+timeout = 300
+graceful_timeout = 30
+keepalive = 5
+# Периодический перезапуск воркеров ограничивает рост памяти
+max_requests = 2000
+max_requests_jitter = 200
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    from models import db
+    from wsgi import app
+
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,153 @@
+import json
+import os
+import socket
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_
+
+
+# Ошибка, после которой повторять задачу бессмысленно
+class JobFailed(Exception):
+    pass
+
+
+# Очередь фоновых задач в той же базе: внешний брокер не нужен.
+# Задачу забирает ровно один воркер (условный UPDATE по статусу), поэтому воркеры могут
+# работать потоками внутри веб-процессов и отдельными процессами (flask --app app worker) одновременно
+class JobQueue:
+    def __init__(self, app, db, job_model, poll_interval=1.0, lock_timeout=600,
+                 max_attempts=3, retry_delay=10):
+        self.app = app
+        self.db = db
+        self.Job = job_model
+        self.poll_interval = poll_interval
+        self.lock_timeout = lock_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        # Вид задачи -> (handler(job), on_failure(job) после последней неудачной попытки или None).
+        # Заполняется из app.job_handlers при создании приложения
+        self.handlers = {}
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    # Задача добавляется в текущую транзакцию и видна воркерам только после commit.
+    # payload - данные задачи в JSON, run_after - отложенный запуск
+    def enqueue(self, kind, record_id=None, payload=None, run_after=None, max_attempts=None):
+        job = self.Job(
+            kind=kind,
+            record_id=record_id,
+            payload=json.dumps(payload) if payload is not None else None,
+            status='queued',
+            attempts=0,
+            max_attempts=max_attempts or self.max_attempts,
+            run_after=run_after or datetime.utcnow()
+        )
+        self.db.session.add(job)
+        return job
+
+    def notify(self):
+        self._wake.set()
+
+    # Захват следующей задачи. Задачи упавшего воркера возвращаются в работу через lock_timeout
+    def claim(self, worker_id):
+        Job = self.Job
+        now = datetime.utcnow()
+        ready = or_(
+            and_(Job.status == 'queued', Job.run_after <= now),
+            and_(Job.status == 'running', Job.locked_at < now - timedelta(seconds=self.lock_timeout))
+        )
+        while True:
+            job_id = self.db.session.query(Job.id).filter(ready).order_by(Job.run_after, Job.id).limit(1).scalar()
+            if job_id is None:
+                self.db.session.rollback()
+                return None
+            claimed = Job.query.filter(Job.id == job_id, ready).update(
+                {Job.status: 'running', Job.locked_by: worker_id, Job.locked_at: now,
+                 Job.attempts: Job.attempts + 1},
+                synchronize_session=False
+            )
+            self.db.session.commit()
+            if claimed:
+                return self.db.session.get(Job, job_id)
+
+    def run_next(self, worker_id):
+        job = self.claim(worker_id)
+        if job is None:
+            return False
+
+        # id запоминается до запуска: после отката объект задачи просрочен, а его строку
+        # могли удалить вместе с записью, и обращение к job.id подняло бы ObjectDeletedError
+        job_id = job.id
+        handler, on_failure = self.handlers.get(job.kind, (None, None))
+        try:
+            if handler is None:
+                raise JobFailed(f"Неизвестный тип задачи: {job.kind}")
+            handler(job)
+            job.status = 'done'
+            job.error = None
+            job.finished_at = datetime.utcnow()
+            self.db.session.commit()
+        except Exception as e:
+            self.db.session.rollback()
+            job = self.db.session.get(self.Job, job_id)
+            if job is None:
+                # Задачу удалили вместе с записью, пока она выполнялась
+                return True
+            job.error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+            if isinstance(e, JobFailed) or job.attempts >= job.max_attempts:
+                job.status = 'failed'
+                job.finished_at = datetime.utcnow()
+                self.app.logger.error(f"Задача {job.id} ({job.kind}) не выполнена: {job.error}")
+                if on_failure is not None:
+                    on_failure(job)
+            else:
+                # Экспоненциальная пауза между попытками
+                job.status = 'queued'
+                job.run_after = datetime.utcnow() + timedelta(seconds=self.retry_delay * 2 ** (job.attempts - 1))
+                self.app.logger.warning(f"Задача {job.id} ({job.kind}) будет повторена: {job.error}")
+            self.db.session.commit()
+        return True
+
+    def work(self, worker_id):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    ran = self.run_next(worker_id)
+            except Exception as e:
+                self.app.logger.error(f"Ошибка воркера {worker_id}: {str(e)}")
+                ran = False
+            if not ran:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    # Пул потоков внутри процесса; повторный вызов ничего не делает. True - потоки запущены этим вызовом
+    def start(self, count):
+        with self._lock:
+            if self._threads or count <= 0:
+                return False
+            prefix = f"{socket.gethostname()}:{os.getpid()}"
+            for number in range(count):
+                thread = threading.Thread(target=self.work, args=(f"{prefix}:{number}",), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            return True
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._stop.clear()
+
+    # Выполнение готовых задач в текущем потоке, пока они есть
+    def drain(self, worker_id='drain'):
+        count = 0
+        while self.run_next(worker_id):
+            count += 1
+        return count
+
@@ -0,0 +1,207 @@
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+# Метрики процесса в текстовом формате Prometheus без внешних зависимостей.
+# Каждый процесс (воркер gunicorn) считает свои значения, Prometheus опрашивает их по отдельности
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100, 250)
+SQL_DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _endpoint():
+    return request.endpoint or 'unknown'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels(self.labelnames, key), value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labels
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(labels, (None, 0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            self._values[labels] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        samples = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_number(float(bound))}"'
+                samples.append((f"{self.name}_bucket", _labels(self.labelnames, key, [le]), cumulative))
+            samples.append((f"{self.name}_sum", _labels(self.labelnames, key), total))
+            samples.append((f"{self.name}_count", _labels(self.labelnames, key), cumulative))
+        return samples
+
+
+# Замеры HTTP-запросов и SQL: время по маршруту, число и время запросов к базе,
+# принятые и отданные байты, запросы в обработке и журнал медленных запросов.
+# SQL вне запроса (фоновые задачи, CLI) учитывается под маршрутом "background"
+class RequestMetrics:
+    def __init__(self, app, db, slow_request_threshold=None, slow_query_count=5):
+        self.app = app
+        self.slow_request_threshold = slow_request_threshold
+        self.slow_query_count = slow_query_count
+        self.collectors = []
+
+        self.requests = Counter(
+            'speakpeak_http_requests_total', "HTTP-запросы по маршруту, методу и статусу",
+            ('endpoint', 'method', 'status'))
+        self.request_duration = Histogram(
+            'speakpeak_http_request_duration_seconds', "Время обработки HTTP-запроса",
+            DURATION_BUCKETS, ('endpoint', 'method'))
+        self.in_flight = Gauge('speakpeak_http_requests_in_flight', "HTTP-запросы в обработке")
+        self.request_bytes = Counter(
+            'speakpeak_http_request_bytes_total', "Принятые байты тела запроса", ('endpoint',))
+        self.response_bytes = Counter(
+            'speakpeak_http_response_bytes_total', "Отданные байты тела ответа", ('endpoint',))
+        self.queries_per_request = Histogram(
+            'speakpeak_sql_queries_per_request', "SQL-запросов за один HTTP-запрос",
+            QUERY_COUNT_BUCKETS, ('endpoint',))
+        self.query_duration = Histogram(
+            'speakpeak_sql_query_duration_seconds', "Время выполнения SQL-запроса",
+            SQL_DURATION_BUCKETS, ('endpoint',))
+        self.metrics = [
+            self.requests, self.request_duration, self.in_flight, self.request_bytes,
+            self.response_bytes, self.queries_per_request, self.query_duration,
+        ]
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.listen(db.engine, 'handle_error', self._handle_error)
+
+    # Дополнительные значения на момент опроса: функция возвращает [(имя, тип, описание, [(метки, значение)])]
+    def collector(self, func):
+        self.collectors.append(func)
+        return func
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = []
+        g.metrics_status = None
+        self.in_flight.inc()
+
+    def _after_request(self, response):
+        g.metrics_status = response.status_code
+        if response.content_length:
+            self.response_bytes.inc((_endpoint(),), response.content_length)
+        return response
+
+    def _teardown_request(self, exc):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        queries = g.pop('metrics_queries', [])
+        status = g.pop('metrics_status', None) or 500
+        endpoint = _endpoint()
+        self.in_flight.dec()
+        self.requests.inc((endpoint, request.method, status))
+        self.request_duration.observe((endpoint, request.method), elapsed)
+        self.queries_per_request.observe((endpoint,), len(queries))
+        if request.content_length:
+            self.request_bytes.inc((endpoint,), request.content_length)
+
+        if self.slow_request_threshold is not None and elapsed >= self.slow_request_threshold:
+            slowest = sorted(queries, key=lambda query: query[1], reverse=True)[:self.slow_query_count]
+            details = ''.join(f"\n  {duration * 1000:.1f} мс: {' '.join(statement.split())[:300]}"
+                              for statement, duration in slowest)
+            self.app.logger.warning(
+                f"Медленный запрос {request.method} {request.path} ({endpoint}): {elapsed * 1000:.0f} мс, "
+                f"SQL {len(queries)} за {sum(query[1] for query in queries) * 1000:.0f} мс{details}"
+            )
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['metrics_started'].pop()
+        duration = time.perf_counter() - started
+        queries = g.get('metrics_queries') if has_request_context() else None
+        if queries is not None:
+            queries.append((statement, duration))
+            self.query_duration.observe((_endpoint(),), duration)
+        else:
+            self.query_duration.observe(('background',), duration)
+
+    # Упавший запрос не доходит до after_cursor_execute, его время снимается здесь
+    def _handle_error(self, context):
+        if context.connection is not None and context.connection.info.get('metrics_started'):
+            context.connection.info['metrics_started'].pop()
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in metric.samples())
+        for func in self.collectors:
+            for name, kind, help, samples in func():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_number(value)}")
+        return '\n'.join(lines) + '\n'
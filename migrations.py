@@ -1,9 +0,0 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-from app import app, db
-
-migrate = Migrate(app, db)
-
-if __name__ == '__main__':
-    app.run() 
\ No newline at end of file
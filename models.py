@@ -1,53 +1,98 @@
-from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from itertools import chain
+
+from flask import g
+from flask_login import UserMixin
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import validates
 
+from extensions import password_hasher
+
+# Модели и учет версий для ETag. db подключается к приложению в create_app
 db = SQLAlchemy()
 
-class User(db.Model):
-    __tablename__ = "user"
+# Модель пользователя
+class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(50), nullable=False)
     last_name = db.Column(db.String(50), nullable=False)
     login = db.Column(db.String(50), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
+    # Версия списка папок пользователя для ETag в /api/folders
+    folders_version = db.Column(db.Integer, default=0, nullable=False)
 
-    # Связь с Folder
     folders = db.relationship("Folder", backref="user", lazy=True)
 
-    # Связь с Record
-    records = db.relationship("Record", backref="user", lazy=True)
-
-    # Метод для хэширования пароля
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
-    # Метод для проверки пароля
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
 
+# Легкая копия пользователя для current_user: без password_hash и без привязки к сессии БД.
+# Изменять пользователя нужно через User, загруженного из базы, и затем сбрасывать кэш
+class UserSnapshot(UserMixin):
+    def __init__(self, user):
+        self.id = user.id
+        self.first_name = user.first_name
+        self.last_name = user.last_name
+        self.login = user.login
+
+    # Папки для меню загружаются один раз за запрос
+    @property
+    def folders(self):
+        if 'user_folders' not in g:
+            g.user_folders = Folder.query.filter_by(user_id=self.id).all()
+        return g.user_folders
+
+# Модель папки
 class Folder(db.Model):
-    __tablename__ = "folder"
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Число записей в папке и их общая длительность в секундах. Поддерживаются триггерами (см. counters.py)
+    record_count = db.Column(db.Integer, default=0, nullable=False)
+    total_length = db.Column(db.Float, default=0, nullable=False)
+    records = db.relationship("Record", backref="folder", lazy=True)
+
+    # Папки ищутся по владельцу и по имени ("Корзина", "Черновики")
+    __table_args__ = (
+        db.Index("ix_folder_user_name", "user_id", "name"),
+    )
 
 class Record(db.Model):
     __tablename__ = "record"
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
     id_folder = db.Column(db.Integer, db.ForeignKey("folder.id"), nullable=False)
     name = db.Column(db.String(255), nullable=False)
     trash = db.Column(db.Integer, default=0, nullable=False)
     length = db.Column(db.Float, nullable=True)
     audio_file = db.Column(db.String(255), nullable=True)
     datetime = db.Column(db.DateTime, default=datetime.utcnow)
+    # processing - файл сохранен, фоновая обработка еще идет; ready - готово; failed - файл поврежден
+    status = db.Column(db.String(20), default='ready', nullable=False)
+    # Когда запись попала в корзину: по этому времени работает автоочистка
+    trashed_at = db.Column(db.DateTime, nullable=True)
+    # Версия записи и ее ошибок для ETag в /api/records/<id>
+    version = db.Column(db.Integer, default=0, nullable=False)
+    # Отрезки речи JSON-списком [[начало, конец], ...] в мс и их суммарная длительность.
+    # Заполняются фоновой обработкой; NULL - сегментация еще не выполнялась
+    speech_segments = db.Column(db.Text, nullable=True)
+    voiced_seconds = db.Column(db.Float, nullable=True)
+    # Число ошибок при записи (type 1) и при прослушивании (type 2). Поддерживаются триггерами (см. counters.py)
+    recorder_mistakes = db.Column(db.Integer, default=0, nullable=False)
+    review_mistakes = db.Column(db.Integer, default=0, nullable=False)
 
     # Связь с таблицей Mistake (один ко многим)
-    mistakes = db.relationship("Mistake", backref="record", lazy=True)
+    mistakes = db.relationship("Mistake", backref="record", lazy=True, cascade="all, delete-orphan")
 
-    # Связь с Folder – позволяет получить объект папки, к которой относится запись
-    folder = db.relationship("Folder", backref="records", lazy=True)
+    # Листинг папки идет по (id_folder, datetime DESC); id входит в индекс как rowid
+    __table_args__ = (
+        db.Index("ix_record_folder_datetime", "id_folder", "datetime"),
+        db.Index("ix_record_trash_trashed_at", "trash", "trashed_at"),
+    )
 
 class Mistake(db.Model):
     __tablename__ = "mistake"
@@ -55,4 +100,95 @@ class Mistake(db.Model):
     record_id = db.Column(db.Integer, db.ForeignKey("record.id"), nullable=False)
     comment = db.Column(db.String(255), nullable=True)
     time_of_mistake = db.Column(db.Float, nullable=True)
-    type = db.Column(db.Integer, nullable=True)
\ No newline at end of file
+    # Время в целых миллисекундах: по нему ищется ошибка вместо сравнения float
+    time_ms = db.Column(db.Integer, nullable=True)
+    type = db.Column(db.Integer, nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_mistake_record_time", "record_id", "time_ms"),
+    )
+
+    @validates("time_of_mistake")
+    def sync_time_ms(self, key, value):
+        self.time_ms = None if value is None else int(round(value * 1000))
+        return value
+
+# Файл в хранилище аудио и число записей, которые на него ссылаются
+class AudioBlob(db.Model):
+    __tablename__ = "audio_blob"
+    hash = db.Column(db.String(64), primary_key=True)
+    path = db.Column(db.String(255), unique=True, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, default=0, nullable=False)
+
+# Фоновая задача. Пока задача выполняется, locked_by/locked_at указывают на воркер
+class Job(db.Model):
+    __tablename__ = "job"
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    record_id = db.Column(db.Integer, db.ForeignKey("record.id"), nullable=True, index=True)
+    payload = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(20), default='queued', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=3, nullable=False)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    record = db.relationship("Record", backref=db.backref("jobs", lazy=True, cascade="all, delete-orphan"))
+
+    # Воркеры ищут готовые задачи по статусу и времени запуска
+    __table_args__ = (
+        db.Index("ix_job_status_run_after", "status", "run_after"),
+    )
+
+# Сводная статистика по пользователю, папке и дню записи. Заполняется триггерами (см. stats.py)
+class StatsDaily(db.Model):
+    __tablename__ = "stats_daily"
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    folder_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    records = db.Column(db.Integer, default=0, nullable=False)
+    speech_seconds = db.Column(db.Float, default=0, nullable=False)
+    # Время речи без пауз по сегментации записей
+    voiced_seconds = db.Column(db.Float, default=0, nullable=False)
+    recorder_mistakes = db.Column(db.Integer, default=0, nullable=False)
+    review_mistakes = db.Column(db.Integer, default=0, nullable=False)
+
+    # Запросы статистики идут по пользователю и диапазону дней
+    __table_args__ = (
+        db.Index("ix_stats_daily_user_day", "user_id", "day"),
+    )
+
+# Версии для ETag увеличиваются одним UPDATE прямо в базе, поэтому параллельные воркеры не теряют инкременты.
+# Массовые query.update()/delete() мимо ORM должны вызывать эти функции сами
+def bump_record_versions(record_ids):
+    if record_ids:
+        db.session.execute(
+            Record.__table__.update().where(Record.id.in_(record_ids)).values(version=Record.version + 1)
+        )
+
+def bump_folders_versions(user_ids):
+    if user_ids:
+        db.session.execute(
+            User.__table__.update().where(User.id.in_(user_ids)).values(folders_version=User.folders_version + 1)
+        )
+
+# Любое изменение папки, записи или ошибки через ORM увеличивает соответствующую версию в той же транзакции
+@event.listens_for(db.session, "after_flush")
+def bump_versions_after_flush(session, flush_context):
+    record_ids, user_ids = set(), set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        if isinstance(obj, Folder):
+            user_ids.add(obj.user_id)
+        elif isinstance(obj, Mistake):
+            record_ids.add(obj.record_id)
+        elif isinstance(obj, Record) and obj not in session.new:
+            record_ids.add(obj.id)
+    bump_record_versions(record_ids)
+    bump_folders_versions(user_ids)
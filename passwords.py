@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+# Все потоки хэширования заняты и очередь заполнена: запрос лучше отклонить, чем ждать
+class HasherBusy(Exception):
+    pass
+
+
+# Хэширование паролей в отдельном ограниченном пуле потоков. Одновременно считается не больше
+# max_workers хэшей, а ждать своей очереди могут не больше max_pending запросов. Поэтому наплыв
+# входов в начале занятия занимает ограниченное число ядер и не останавливает остальные запросы
+class PasswordHasher:
+    def __init__(self, method='scrypt', max_workers=2, max_pending=32, timeout=10):
+        self.method = method
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._prefix = None
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HasherBusy()
+        try:
+            return self._executor.submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    # Хэш, посчитанный другим методом или с другой стоимостью. Параметры текущего метода
+    # берутся из заголовка пробного хэша, например "scrypt:32768:8:1" или "pbkdf2:sha256:600000"
+    def needs_rehash(self, password_hash):
+        if self._prefix is None:
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._prefix
+
+
+# Ограничение частоты попыток входа по ключу (логину) за скользящее окно.
+# Хранится в памяти процесса, число отслеживаемых ключей ограничено
+class RateLimiter:
+    def __init__(self, limit=10, window=300, max_keys=10000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._attempts = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Учитывает попытку; False - лимит исчерпан и попытку нужно отклонить
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._attempts.pop(key, None) or deque()
+            while attempts and attempts[0] <= now - self.window:
+                attempts.popleft()
+            allowed = len(attempts) < self.limit
+            if allowed:
+                attempts.append(now)
+            self._attempts[key] = attempts
+            while len(self._attempts) > self.max_keys:
+                self._attempts.popitem(last=False)
+            return allowed
+
+    def reset(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
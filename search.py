@@ -0,0 +1,148 @@
+import re
+
+from sqlalchemy import text
+
+# Полнотекстовый поиск по названиям записей и комментариям к ошибкам на SQLite FTS5.
+# Одна строка индекса на запись (rowid = 2 * record.id) и на ошибку с комментарием
+# (rowid = 2 * mistake.id + 1), поэтому триггеры обновляют индекс по rowid без просмотра таблицы.
+# Владелец хранится индексируемым токеном u<user_id>: фильтр по пользователю - часть поиска в индексе
+
+CREATE_INDEX = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        owner, body, record_id UNINDEXED, mistake_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )"""
+
+_INSERT_RECORD = """
+    INSERT INTO search_index (rowid, owner, body, record_id, mistake_id)
+    VALUES (2 * NEW.id, 'u' || NEW.user_id, NEW.name, NEW.id, NULL);"""
+
+_INSERT_MISTAKE = """
+    INSERT INTO search_index (rowid, owner, body, record_id, mistake_id)
+    SELECT 2 * NEW.id + 1, 'u' || r.user_id, NEW.comment, NEW.record_id, NEW.id
+    FROM record r WHERE r.id = NEW.record_id AND COALESCE(NEW.comment, '') != '';"""
+
+TRIGGERS = {
+    'search_record_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS search_record_insert AFTER INSERT ON record BEGIN
+            {_INSERT_RECORD}
+        END""",
+    'search_record_update': f"""
+        CREATE TRIGGER IF NOT EXISTS search_record_update AFTER UPDATE OF name, user_id ON record BEGIN
+            DELETE FROM search_index WHERE rowid = 2 * OLD.id;
+            {_INSERT_RECORD}
+        END""",
+    'search_record_delete': """
+        CREATE TRIGGER IF NOT EXISTS search_record_delete AFTER DELETE ON record BEGIN
+            DELETE FROM search_index WHERE rowid = 2 * OLD.id;
+        END""",
+    'search_mistake_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS search_mistake_insert AFTER INSERT ON mistake BEGIN
+            {_INSERT_MISTAKE}
+        END""",
+    'search_mistake_update': f"""
+        CREATE TRIGGER IF NOT EXISTS search_mistake_update AFTER UPDATE OF comment, record_id ON mistake BEGIN
+            DELETE FROM search_index WHERE rowid = 2 * OLD.id + 1;
+            {_INSERT_MISTAKE}
+        END""",
+    'search_mistake_delete': """
+        CREATE TRIGGER IF NOT EXISTS search_mistake_delete AFTER DELETE ON mistake BEGIN
+            DELETE FROM search_index WHERE rowid = 2 * OLD.id + 1;
+        END""",
+}
+
+
+def index_exists(connection):
+    return connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'"
+    ).first() is not None
+
+
+def install(connection):
+    connection.exec_driver_sql(CREATE_INDEX)
+    for ddl in TRIGGERS.values():
+        connection.exec_driver_sql(ddl)
+
+
+# Полная перестройка индекса по record и mistake; выполняется в одной транзакции вызывающего
+def rebuild(connection):
+    connection.exec_driver_sql("DELETE FROM search_index")
+    connection.exec_driver_sql("""
+        INSERT INTO search_index (rowid, owner, body, record_id, mistake_id)
+        SELECT 2 * id, 'u' || user_id, name, id, NULL FROM record
+    """)
+    connection.exec_driver_sql("""
+        INSERT INTO search_index (rowid, owner, body, record_id, mistake_id)
+        SELECT 2 * m.id + 1, 'u' || r.user_id, m.comment, m.record_id, m.id
+        FROM mistake m JOIN record r ON r.id = m.record_id
+        WHERE COALESCE(m.comment, '') != ''
+    """)
+    connection.exec_driver_sql("INSERT INTO search_index (search_index) VALUES ('optimize')")
+    return connection.exec_driver_sql("SELECT count(*) FROM search_index").scalar()
+
+
+# Запрос пользователя превращается в набор префиксных термов: "урок ошиб" -> "урок"* "ошиб"*.
+# Синтаксис FTS5 из ввода не пропускается, поэтому кавычки и операторы не ломают запрос
+def build_match(user_id, query):
+    terms = re.findall(r'\w+', query)
+    if not terms:
+        return None
+    body = ' '.join(f'"{term}"*' for term in terms)
+    return f'owner : u{int(user_id)} AND body : ({body})'
+
+
+# Записи, отсортированные по лучшему совпадению (bm25 только по body), и совпавшие ошибки этих записей
+def search(session, user_id, query, limit, offset=0, include_trash=False):
+    match = build_match(user_id, query)
+    if match is None:
+        return [], False
+
+    trash_filter = "" if include_trash else "AND r.trash = 0"
+    # MATERIALIZED не дает SQLite встроить подзапрос в GROUP BY, где bm25 недоступна
+    rows = session.execute(text(f"""
+        WITH hits AS MATERIALIZED (
+            SELECT record_id, mistake_id, bm25(search_index, 0.0, 1.0) AS rank
+            FROM search_index WHERE search_index MATCH :match
+        )
+        SELECT r.id, r.name, r.id_folder, r.datetime, min(hits.rank) AS rank,
+               max(hits.mistake_id IS NULL) AS name_match
+        FROM hits
+        JOIN record r ON r.id = hits.record_id
+        WHERE 1 {trash_filter}
+        GROUP BY r.id
+        ORDER BY rank, r.id
+        LIMIT :limit OFFSET :offset
+    """), {'match': match, 'limit': limit + 1, 'offset': offset}).mappings().all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return [], has_more
+
+    # Совпавшие ошибки только для записей текущей страницы
+    record_ids = ', '.join(str(int(row['id'])) for row in rows)
+    mistakes = {}
+    for mistake in session.execute(text(f"""
+        SELECT m.id, m.record_id, m.time_of_mistake, m.comment, m.type
+        FROM search_index JOIN mistake m ON m.id = search_index.mistake_id
+        WHERE search_index MATCH :match AND search_index.record_id IN ({record_ids})
+        ORDER BY m.record_id, m.time_ms
+    """), {'match': match}).mappings():
+        mistakes.setdefault(mistake['record_id'], []).append({
+            'id': mistake['id'],
+            'time': mistake['time_of_mistake'] * 1000,
+            'comment': mistake['comment'],
+            'type': mistake['type'],
+        })
+
+    results = [{
+        'id': row['id'],
+        'name': row['name'],
+        'folder': row['id_folder'],
+        'datetime': row['datetime'],
+        'rank': row['rank'],
+        'name_match': bool(row['name_match']),
+        'mistakes': mistakes.get(row['id'], []),
+    } for row in rows]
+    return results, has_more
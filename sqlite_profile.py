@@ -0,0 +1,89 @@
+import sqlite3
+
+from sqlalchemy import event, inspect
+
+
+# Профиль SQLite для нескольких воркеров на одном файле базы: WAL позволяет читать во время
+# записи, busy_timeout заставляет ждать блокировку вместо ошибки "database is locked"
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+}
+
+
+# Прагмы выставляются на каждом новом соединении пула
+def install_pragmas(engine, pragmas):
+    @event.listens_for(engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+
+def current_pragmas(connection, pragmas):
+    return {name: connection.exec_driver_sql(f"PRAGMA {name}").scalar() for name in pragmas}
+
+
+# Внешние ключи, по которым фильтруют маршруты, но ни один индекс в базе не начинается с этой колонки
+def missing_foreign_key_indexes(engine, metadata):
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    missing = []
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        leading = {index['column_names'][0] for index in inspector.get_indexes(table.name)
+                   if index['column_names'] and index['column_names'][0]}
+        leading |= {constraint['column_names'][0] for constraint in inspector.get_unique_constraints(table.name)}
+        primary_key = inspector.get_pk_constraint(table.name)['constrained_columns']
+        if primary_key:
+            leading.add(primary_key[0])
+        for foreign_key in table.foreign_keys:
+            if foreign_key.parent.name not in leading:
+                missing.append(f"{table.name}.{foreign_key.parent.name}")
+    return missing
+
+
+# Новые колонки моделей добавляются в уже существующие таблицы через ALTER TABLE ADD COLUMN.
+# Возвращает список добавленных колонок вида "table.column", чтобы вызывающий мог заполнить их
+def add_missing_columns(engine, metadata):
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(dialect=engine.dialect)}'
+                default = _column_default(column)
+                if default is not None:
+                    ddl += f" DEFAULT {default}"
+                    if not column.nullable:
+                        ddl += " NOT NULL"
+                connection.exec_driver_sql(ddl)
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def _column_default(column):
+    if column.server_default is not None:
+        return column.server_default.arg
+    if column.default is None or not column.default.is_scalar:
+        return None
+    value = column.default.arg
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, bool):
+        return str(int(value))
+    return str(value)
@@ -5,6 +5,16 @@ let errorTimestamps = [];
 let playbackErrorTimestamps = [];
 let activeErrorMarkers = [];
 let currentRecordId;
+let chunkedUpload = null;
+// Прямая загрузка доступна, только если сервер отметил это на странице; после ответа 501 больше не пробуем
+let directUploadAvailable = null;
+let mistakeQueue = null, mistakeFlushTimer = null, mistakeFlushing = Promise.resolve();
+let nextMistakeClientId = 1;
+const mistakeIdMap = {};
+// Время нажатия для временных id: по нему ошибку находит запрос, отправленный при уходе со страницы
+const mistakeClientTimes = {};
+// Отрезки речи [[начало, конец], ...] в мс с сервера
+let speechSegments = [];
 
 const CONFIG = {
     BAR_WIDTH: 5,
@@ -13,7 +23,12 @@ const CONFIG = {
     SAMPLE_RATE: 10,
     BAR_GAP: 11,
     INPUT_SENSITIVITY: 2.0,
-    OUTPUT_SENSITIVITY: 1.0
+    OUTPUT_SENSITIVITY: 1.0,
+    UPLOAD_TIMESLICE: 5000,
+    UPLOAD_RETRIES: 3,
+    UPLOAD_STOP_WAIT: 10000,
+    MISTAKE_FLUSH_DELAY: 1000,
+    SPEECH_RETRY_DELAY: 3000
 };
 
 const state = {
@@ -36,6 +51,9 @@ const elements = {
     stopBtn: document.getElementById('stop'),
     errorBtn: document.getElementById('error-btn'),
     playBtn: document.getElementById('play-pause'),
+    prevPhraseBtn: document.getElementById('prev-phrase'),
+    nextPhraseBtn: document.getElementById('next-phrase'),
+    skipSilenceToggle: document.getElementById('skip-silence'),
     marker: document.getElementById('playback-marker'),
     recordingTimer: document.getElementById('recording-timer'),
     playbackTimer: document.getElementById('playback-timer'),
@@ -63,7 +81,7 @@ function setupAudioContext(stream) {
     
     // Настраиваем запись
     mediaRecorder = new MediaRecorder(stream);
-    mediaRecorder.addEventListener('dataavailable', e => audioChunks.push(e.data));
+    mediaRecorder.addEventListener('dataavailable', handleDataAvailable);
     mediaRecorder.addEventListener('stop', handleRecordingStop);
     
     // Запускаем анализ аудио
@@ -175,11 +193,12 @@ async function startSystemRecording() {
         );
 
         mediaRecorder = new MediaRecorder(combinedStream);
-        mediaRecorder.addEventListener('dataavailable', e => audioChunks.push(e.data));
+        mediaRecorder.addEventListener('dataavailable', handleDataAvailable);
         mediaRecorder.addEventListener('stop', handleRecordingStop);
 
         // Запускаем запись
-        mediaRecorder.start();
+        startChunkedUpload();
+        mediaRecorder.start(CONFIG.UPLOAD_TIMESLICE);
         isRecording = true;
         recordingStartTime = performance.now();
         
@@ -289,11 +308,12 @@ async function autoStartRecording() {
         
         // Initialize MediaRecorder with the combined stream
         mediaRecorder = new MediaRecorder(destination.stream);
-        mediaRecorder.addEventListener('dataavailable', e => audioChunks.push(e.data));
+        mediaRecorder.addEventListener('dataavailable', handleDataAvailable);
         mediaRecorder.addEventListener('stop', handleRecordingStop);
         
         // Start recording
-        mediaRecorder.start();
+        startChunkedUpload();
+        mediaRecorder.start(CONFIG.UPLOAD_TIMESLICE);
         isRecording = true;
         recordingStartTime = performance.now();
         
@@ -361,7 +381,17 @@ async function init() {
     if (elements.errorBtn) elements.errorBtn.addEventListener('click', markError);
     if (elements.playBtn) elements.playBtn.addEventListener('click', togglePlayPause);
     if (elements.playback) elements.playback.addEventListener('click', handleScrubberClick);
+    if (elements.prevPhraseBtn) elements.prevPhraseBtn.addEventListener('click', () => jumpToPhrase(-1));
+    if (elements.nextPhraseBtn) elements.nextPhraseBtn.addEventListener('click', () => jumpToPhrase(1));
+    if (elements.skipSilenceToggle) {
+        elements.skipSilenceToggle.checked = localStorage.getItem('skipSilence') === '1';
+        elements.skipSilenceToggle.addEventListener('change', (e) => {
+            localStorage.setItem('skipSilence', e.target.checked ? '1' : '0');
+        });
+    }
     if (elements.saveBtn) elements.saveBtn.addEventListener('click', saveRecording);
+    // Несохраненные правки ошибок отправляются при уходе со страницы
+    window.addEventListener('pagehide', flushMistakeBatchOnLeave);
 
     // Проверяем, находимся ли мы на странице воспроизведения
     if (window.location.pathname.startsWith('/playback/')) {
@@ -555,19 +585,165 @@ function handleRecordingStop() {
     // Конвертируем в base64
     const reader = new FileReader();
     reader.readAsDataURL(audioBlob);
-    reader.onloadend = () => {
+    reader.onloadend = async () => {
         const base64Audio = reader.result;
         // Сохраняем во временное хранилище
         sessionStorage.setItem('tempAudioData', base64Audio);
         sessionStorage.setItem('tempDuration', recordingStartTime ? (performance.now() - recordingStartTime) : 0);
         sessionStorage.setItem('tempErrorTimestamps', JSON.stringify(errorTimestamps));
         sessionStorage.setItem('tempWaveformData', JSON.stringify(waveformData));
+
+        // Даем догрузиться последним частям, недостающие докачаются на странице сохранения
+        await waitForChunkedUpload();
+        if (chunkedUpload && chunkedUpload.id) {
+            sessionStorage.setItem('tempUploadId', chunkedUpload.id);
+            sessionStorage.setItem('tempChunkSizes', JSON.stringify(chunkedUpload.sizes));
+        } else {
+            sessionStorage.removeItem('tempUploadId');
+            sessionStorage.removeItem('tempChunkSizes');
+        }
         
         // Переходим на страницу сохранения
         window.location.href = '/save';
     };
 }
 
+// Докачка: части записи загружаются на сервер прямо во время записи
+function startChunkedUpload() {
+    const upload = { id: null, sizes: [] };
+    upload.queue = fetch('/api/uploads', { method: 'POST' })
+        .then(response => {
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            return response.json();
+        })
+        .then(data => {
+            upload.id = data.upload_id;
+        })
+        .catch(error => console.warn('Докачка недоступна, запись будет загружена целиком:', error));
+    chunkedUpload = upload;
+}
+
+function handleDataAvailable(e) {
+    audioChunks.push(e.data);
+
+    const upload = chunkedUpload;
+    if (!upload || !e.data.size) return;
+
+    const index = upload.sizes.length;
+    upload.sizes.push(e.data.size);
+    // Части отправляются по очереди; неудачные будут отправлены повторно при сохранении
+    upload.queue = upload.queue
+        .then(() => upload.id && uploadChunk(upload.id, index, e.data))
+        .catch(error => console.warn(`Часть ${index} не загружена:`, error));
+}
+
+function waitForChunkedUpload() {
+    if (!chunkedUpload) return Promise.resolve();
+    const timeout = new Promise(resolve => setTimeout(resolve, CONFIG.UPLOAD_STOP_WAIT));
+    return Promise.race([chunkedUpload.queue, timeout]);
+}
+
+async function sha256Hex(blob) {
+    const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    return Array.from(new Uint8Array(digest))
+        .map(b => b.toString(16).padStart(2, '0'))
+        .join('');
+}
+
+async function uploadChunk(uploadId, index, blob) {
+    const checksum = await sha256Hex(blob);
+    let lastError;
+    for (let attempt = 0; attempt < CONFIG.UPLOAD_RETRIES; attempt++) {
+        try {
+            const response = await fetch(`/api/uploads/${uploadId}/chunks/${index}`, {
+                method: 'PUT',
+                headers: { 'X-Chunk-SHA256': checksum },
+                body: blob
+            });
+            if (response.ok) return;
+            lastError = new Error(`HTTP ${response.status}`);
+            if (response.status < 500) break;
+        } catch (error) {
+            lastError = error;
+        }
+        await new Promise(resolve => setTimeout(resolve, 500 * 2 ** attempt));
+    }
+    throw lastError;
+}
+
+// Догружаем недостающие части и превращаем сессию докачки в запись
+async function finishChunkedUpload(uploadId, chunkSizes, audioBlob, fields) {
+    const total = chunkSizes.reduce((a, b) => a + b, 0);
+    if (!chunkSizes.length || total !== audioBlob.size) {
+        throw new Error('Части не совпадают с записью');
+    }
+
+    const statusResponse = await fetch(`/api/uploads/${uploadId}`);
+    if (!statusResponse.ok) throw new Error(`HTTP ${statusResponse.status}`);
+    const received = new Set((await statusResponse.json()).received);
+
+    let offset = 0;
+    for (let i = 0; i < chunkSizes.length; i++) {
+        if (!received.has(i)) {
+            await uploadChunk(uploadId, i, audioBlob.slice(offset, offset + chunkSizes[i]));
+        }
+        offset += chunkSizes[i];
+    }
+
+    const response = await fetch(`/api/uploads/${uploadId}/complete`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ ...fields, chunks: chunkSizes.length })
+    });
+    if (!response.ok) {
+        const errorText = await response.text();
+        throw new Error(`Ошибка сервера ${response.status}: ${errorText}`);
+    }
+    return response.json();
+}
+
+// Прямая загрузка в хранилище (S3) по подписанной ссылке: сервер получает только поля записи.
+// null - хранилище прямую загрузку не поддерживает, запись нужно отправить на сервер целиком
+async function saveDirectUpload(audioBlob, fields) {
+    if (directUploadAvailable === null) {
+        directUploadAvailable = Boolean(elements.saveBtn && 'directUpload' in elements.saveBtn.dataset);
+    }
+    if (!directUploadAvailable) return null;
+
+    const checksum = await sha256Hex(audioBlob);
+    const uploadResponse = await fetch('/api/records/direct-upload', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ sha256: checksum, size: audioBlob.size })
+    });
+    if (uploadResponse.status === 501) {
+        directUploadAvailable = false;
+        return null;
+    }
+    if (!uploadResponse.ok) throw new Error(`HTTP ${uploadResponse.status}`);
+    const upload = await uploadResponse.json();
+
+    const putResponse = await fetch(upload.url, {
+        method: 'PUT',
+        headers: upload.headers,
+        body: audioBlob
+    });
+    if (!putResponse.ok) throw new Error(`Хранилище ответило ${putResponse.status}`);
+
+    const response = await fetch('/api/records', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ ...fields, upload: upload.token })
+    });
+    if (!response.ok) {
+        const errorText = await response.text();
+        throw new Error(`Ошибка сервера ${response.status}: ${errorText}`);
+    }
+    return response.json();
+}
+
 // Начало записи
 function startRecording() {
     // Reset state before starting a new recording
@@ -604,30 +780,120 @@ function markError() {
     } else if (audioElement) {
         const currentTime = audioElement.currentTime * 1000;
         
-        // Используем сохраненный ID записи
-        fetch(`/api/records/${currentRecordId}/errors`, {
+        // Ошибка сразу показывается с временным id, а на сервер уходит пакетом вместе с остальными правками
+        const clientId = `c${nextMistakeClientId++}`;
+        mistakeClientTimes[clientId] = currentTime;
+        queueMistakeOperation({ op: 'add', time: currentTime, type: 2, client_id: clientId });
+
+        playbackErrorTimestamps.push(currentTime);
+        playbackErrorTimestamps.sort((a, b) => a - b);
+
+        const markerElement = createErrorMarkerElement();
+        positionErrorMarker(markerElement, currentTime);
+        addCheckpoint(currentTime, 'playback-error', clientId);
+    }
+}
+
+// Ссылка на ошибку в операции: временный id (еще не сохраненная ошибка) или id из базы
+function mistakeReference(mistakeId) {
+    mistakeId = String(mistakeId);
+    if (mistakeIdMap[mistakeId]) {
+        return { id: mistakeIdMap[mistakeId] };
+    }
+    return mistakeId.startsWith('c') ? { client_id: mistakeId } : { id: parseInt(mistakeId) };
+}
+
+// Правки ошибок копятся и отправляются одним запросом после паузы
+function queueMistakeOperation(operation) {
+    if (mistakeQueue && mistakeQueue.recordId !== currentRecordId) {
+        flushMistakeBatch();
+    }
+    if (!mistakeQueue) {
+        mistakeQueue = { recordId: currentRecordId, operations: [] };
+    }
+    mistakeQueue.operations.push(operation);
+
+    clearTimeout(mistakeFlushTimer);
+    mistakeFlushTimer = setTimeout(flushMistakeBatch, CONFIG.MISTAKE_FLUSH_DELAY);
+}
+
+// Пакеты отправляются строго по очереди, чтобы ссылки на временные id разрешались после сохранения
+function flushMistakeBatch() {
+    clearTimeout(mistakeFlushTimer);
+    const batch = mistakeQueue;
+    mistakeQueue = null;
+    if (!batch) return mistakeFlushing;
+
+    mistakeFlushing = mistakeFlushing.then(() => sendMistakeBatch(batch));
+    return mistakeFlushing;
+}
+
+// При уходе со страницы ждать предыдущий пакет нельзя: страница выгрузится раньше, чем он ответит.
+// Оставшиеся правки уходят сразу keepalive-запросом, ответ уже никто не обработает
+function flushMistakeBatchOnLeave() {
+    clearTimeout(mistakeFlushTimer);
+    const batch = mistakeQueue;
+    mistakeQueue = null;
+    if (!batch) return;
+
+    // Ошибки из пакета, который еще не ответил, ищутся на сервере по времени нажатия
+    const added = new Set(batch.operations.filter(operation => operation.op === 'add').map(operation => operation.client_id));
+    const operations = mistakeBatchOperations(batch).map(operation => {
+        if (operation.client_id && !added.has(operation.client_id) && operation.client_id in mistakeClientTimes) {
+            const { client_id, ...rest } = operation;
+            return { ...rest, time: mistakeClientTimes[client_id] };
+        }
+        return operation;
+    });
+
+    fetch(`/api/records/${batch.recordId}/mistakes/batch`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ operations }),
+        keepalive: true
+    }).catch(() => {});
+}
+
+// Временные id, сохраненные предыдущими пакетами, заменяются на настоящие
+function mistakeBatchOperations(batch) {
+    return batch.operations.map(operation => {
+        if (operation.op !== 'add' && operation.client_id && mistakeIdMap[operation.client_id]) {
+            const { client_id, ...rest } = operation;
+            return { ...rest, id: mistakeIdMap[client_id] };
+        }
+        return operation;
+    });
+}
+
+async function sendMistakeBatch(batch) {
+    const operations = mistakeBatchOperations(batch);
+
+    try {
+        const response = await fetch(`/api/records/${batch.recordId}/mistakes/batch`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ time: currentTime })
-        }).then(response => {
-            if (response.ok) {
-                return response.json();
-            }
-            throw new Error('Failed to save error');
-        }).then(data => {
-            const mistakeId = data.mistake_id;
-            playbackErrorTimestamps.push(currentTime);
-            playbackErrorTimestamps.sort((a, b) => a - b);
-
-            const markerElement = createErrorMarkerElement();
-            positionErrorMarker(markerElement, currentTime);
-            addCheckpoint(currentTime, 'playback-error', mistakeId);
-        }).catch(error => {
-            console.error('Ошибка при сохранении ошибки:', error);
-            alert('Ошибка при сохранении ошибки: ' + error.message);
+            body: JSON.stringify({ operations })
         });
+        if (!response.ok) {
+            const errorText = await response.text();
+            throw new Error(errorText);
+        }
+
+        const data = await response.json();
+        data.results.forEach(result => {
+            if (result.op !== 'add' || !result.client_id) return;
+            mistakeIdMap[result.client_id] = result.id;
+            document.querySelectorAll(`[data-mistake-id="${result.client_id}"]`).forEach(element => {
+                element.dataset.mistakeId = result.id;
+            });
+        });
+    } catch (error) {
+        console.error('Ошибка при сохранении ошибок:', error);
+        alert('Ошибка при сохранении ошибок: ' + error.message);
     }
 }
 
@@ -685,8 +951,8 @@ function addCheckpoint(time, type, mistakeId, comment = '') {
     if (isOwner) {
         checkpoint.querySelector('.delete-checkpoint').addEventListener('click', (e) => {
             e.stopPropagation();  // Останавливаем всплытие события
-            const mistakeId = e.target.dataset.mistakeId;  // Получаем mistake_id
-            deleteCheckpoint(mistakeId, checkpoint);
+            // id берется с чекпоинта: после сохранения пакета временный id там уже заменен
+            deleteCheckpoint(checkpoint.dataset.mistakeId, checkpoint);
         });
         
         // Добавляем обработчик для кнопки редактирования
@@ -744,7 +1010,7 @@ function showEditForm(checkpoint, time, type, currentComment = '') {
     editForm.querySelector('.save-comment').addEventListener('click', async () => {
         const comment = textarea.value.trim();
         try {
-            await saveComment(currentRecordId, time, comment);
+            saveComment(checkpoint, comment);
             
             // Обновляем отображение
             if (comment) {
@@ -769,44 +1035,18 @@ function showEditForm(checkpoint, time, type, currentComment = '') {
     });
 }
 
-// Сохранение комментария
-async function saveComment(recordId, time, comment) {
-    const response = await fetch(`/api/records/${recordId}/errors/comment`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ time, comment })
-    });
-
-    if (!response.ok) {
-        const error = await response.text();
-        throw new Error(error);
-    }
-
-    return response.json();
+// Сохранение комментария: ошибка определяется по id, а не по времени
+function saveComment(checkpoint, comment) {
+    queueMistakeOperation({ op: 'comment', ...mistakeReference(checkpoint.dataset.mistakeId), comment });
 }
 
-async function deleteCheckpoint(mistakeId, element) {
+function deleteCheckpoint(mistakeId, element) {
     try {
         if (!mistakeId) {
             throw new Error('ID ошибки не определен');
         }
 
-        console.log('Пытаемся удалить ошибку:', { mistakeId });
-
-        // Удаляем ошибку по mistake_id
-        const deleteResponse = await fetch(`/api/mistakes/${mistakeId}`, {
-            method: 'DELETE',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-        });
-
-        if (!deleteResponse.ok) {
-            const errorText = await deleteResponse.text();
-            throw new Error(`Ошибка при удалении ошибки: ${errorText}`);
-        }
+        queueMistakeOperation({ op: 'delete', ...mistakeReference(mistakeId) });
 
         // Удаляем элемент с экрана
         element.remove();
@@ -899,33 +1139,64 @@ async function saveRecording() {
     }
 
     try {
-        const recordData = {
+        const audioBlob = await fetch(base64Audio).then(r => r.blob());
+        const fields = {
             name: recordName,
-            folder: selectedFolder, // Теперь здесь всегда будет число
-            audio: base64Audio,
-            errors: savedErrors,
-            duration: duration
+            folder: selectedFolder,
+            duration: duration,
+            errors: savedErrors
         };
+        let result = null;
 
-        const response = await fetch('/api/records', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify(recordData)
-        });
+        // Если хранилище принимает файлы напрямую, аудио не проходит через сервер
+        try {
+            result = await saveDirectUpload(audioBlob, fields);
+        } catch (error) {
+            console.warn('Прямая загрузка не удалась, загружаем запись через сервер:', error);
+        }
 
-        if (!response.ok) {
-            const errorText = await response.text();
-            throw new Error(`Ошибка сервера ${response.status}: ${errorText}`);
+        // Если части уже загружены во время записи, остается только догрузить недостающие
+        const uploadId = sessionStorage.getItem('tempUploadId');
+        if (result && uploadId) {
+            // Сессия докачки больше не нужна
+            fetch(`/api/uploads/${uploadId}`, { method: 'DELETE' }).catch(() => {});
+        } else if (uploadId) {
+            try {
+                const chunkSizes = JSON.parse(sessionStorage.getItem('tempChunkSizes') || '[]');
+                result = await finishChunkedUpload(uploadId, chunkSizes, audioBlob, fields);
+            } catch (error) {
+                console.warn('Докачка не удалась, загружаем запись целиком:', error);
+            }
+        }
+
+        if (!result) {
+            // Отправляем аудио бинарным файлом в multipart-форме, а не base64 в JSON
+            const formData = new FormData();
+            formData.append('name', recordName);
+            formData.append('folder', selectedFolder); // Теперь здесь всегда будет число
+            formData.append('duration', duration);
+            savedErrors.forEach(errorTime => formData.append('errors', errorTime));
+            formData.append('audio', audioBlob, 'record.wav');
+
+            const response = await fetch('/api/records', {
+                method: 'POST',
+                body: formData
+            });
+
+            if (!response.ok) {
+                const errorText = await response.text();
+                throw new Error(`Ошибка сервера ${response.status}: ${errorText}`);
+            }
+            
+            result = await response.json();
         }
-        
-        const result = await response.json();
         
         // Очищаем временные данные
         sessionStorage.removeItem('tempAudioData');
         sessionStorage.removeItem('tempDuration');
         sessionStorage.removeItem('tempErrorTimestamps');
+        sessionStorage.removeItem('tempUploadId');
+        sessionStorage.removeItem('tempChunkSizes');
         
         window.location.href = `/playback/${result.record_id}`;
 
@@ -998,6 +1269,26 @@ async function analyzeAudioFile(audioBlob) {
     });
 }
 
+// Загрузка волны из серверного индекса пиков
+async function loadWaveform(recordId, audioUrl) {
+    const totalBars = Math.floor(CONFIG.VISUALIZER_WIDTH / (CONFIG.BAR_WIDTH + CONFIG.BAR_GAP / 2));
+    try {
+        const response = await fetch(`/api/records/${recordId}/peaks?bars=${totalBars}`);
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+
+        const peaks = await response.json();
+        return peaks.rms.map((value, i) => ({
+            input: value,
+            output: value,
+            time: i * peaks.bucket_duration
+        }));
+    } catch (error) {
+        console.warn('Индекс пиков недоступен, анализируем аудио в браузере:', error);
+        const audioBlob = await fetch(audioUrl).then(r => r.blob());
+        return analyzeAudioFile(audioBlob);
+    }
+}
+
 // Подготовка воспроизведения
 async function preparePlayback(recordId) {
     try {
@@ -1012,7 +1303,8 @@ async function preparePlayback(recordId) {
         
         totalDuration = recordData.duration;
         playbackErrorTimestamps = recordData.playbackErrors.map(error => error.time);
-        errorTimestamps = recordData.errors.map(error => error.time);
+        // Ошибки при записи показываются на границе фразы (snapped), в базе хранится время нажатия
+        errorTimestamps = recordData.errors.map(error => error.snapped ?? error.time);
 
         // Remove reliance on previously stored waveform data
         // waveformData = JSON.parse(sessionStorage.getItem('tempWaveformData') || '[]');
@@ -1021,7 +1313,7 @@ async function preparePlayback(recordId) {
             elements.checkpointsList.innerHTML = '';
             recordData.errors.forEach(error => {
                 addCheckpoint(
-                    error.time,
+                    error.snapped ?? error.time,
                     'recording-error',
                     error.id,  // Use the actual mistake ID
                     error.comment
@@ -1037,9 +1329,13 @@ async function preparePlayback(recordId) {
             });
         }
 
-        const audioBlob = await fetch(recordData.audio).then(r => r.blob());
-        const audioUrl = URL.createObjectURL(audioBlob);
-        audioElement = new Audio(audioUrl);
+        // Аудио загружается потоково по ссылке: воспроизведение и перемотка через Range-запросы.
+        // С S3 ссылка перенаправляет в бакет на другом домене: без CORS-запроса Web Audio считает
+        // такой звук чужим и выдает тишину, поэтому crossOrigin задается до src
+        audioElement = new Audio();
+        audioElement.crossOrigin = 'anonymous';
+        audioElement.preload = 'metadata';
+        audioElement.src = recordData.audio;
 
         // Initialize audio context and analyzer for playback
         if (!audioContext || audioContext.state === 'closed') {
@@ -1058,8 +1354,9 @@ async function preparePlayback(recordId) {
             source.connect(inputAnalyser);  // We'll use this for analysis
             source.connect(audioContext.destination); // For actual playback
             
-            // Pre-analyze the audio to generate the waveform
-            analyzeAudioFile(audioBlob).then(waveformResult => {
+            // Waveform comes from the server-side peak index; decode in the browser only as a fallback
+            loadSpeechSegments(recordId);
+            loadWaveform(recordId, recordData.audio).then(waveformResult => {
                 waveformData = waveformResult;
                 renderPlayback();
                 updateControls();
@@ -1159,9 +1456,53 @@ async function togglePlayPause() {
     }
 }
 
+// Отрезки речи считаются на сервере при обработке записи; без них переход по фразам недоступен
+async function loadSpeechSegments(recordId) {
+    try {
+        const response = await fetch(`/api/records/${recordId}/speech`);
+        if (response.status === 202) {
+            // Запись еще обрабатывается: отрезки появятся, когда фоновая задача закончит
+            speechSegments = [];
+            setTimeout(() => loadSpeechSegments(recordId), CONFIG.SPEECH_RETRY_DELAY);
+        } else {
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            speechSegments = (await response.json()).segments;
+        }
+    } catch (error) {
+        console.warn('Отрезки речи недоступны:', error);
+        speechSegments = [];
+    }
+    updateControls();
+}
+
+// Переход к началу следующей (direction = 1) или предыдущей (-1) фразы.
+// Назад из середины фразы - сначала к ее началу, как в обычных плеерах
+function jumpToPhrase(direction) {
+    if (!audioElement || !speechSegments.length) return;
+    const now = audioElement.currentTime * 1000;
+    const target = direction > 0
+        ? speechSegments.find(([start]) => start > now + 50)
+        : speechSegments.findLast(([start]) => start < now - 1000);
+    if (!target) return;
+    audioElement.currentTime = target[0] / 1000;
+    updatePlayback();
+    updatePlaybackTimer();
+}
+
+// Если включен пропуск пауз, воспроизведение перескакивает из паузы к следующей фразе
+function skipSilenceGap() {
+    if (!elements.skipSilenceToggle || !elements.skipSilenceToggle.checked) return;
+    if (!audioElement || audioElement.paused || !speechSegments.length) return;
+    const now = audioElement.currentTime * 1000;
+    if (speechSegments.some(([start, end]) => now >= start && now < end)) return;
+    const next = speechSegments.find(([start]) => start > now);
+    if (next) audioElement.currentTime = next[0] / 1000;
+}
+
 // Обновление позиции маркера воспроизведения
 function updatePlayback() {
     if (!audioElement || !elements.marker) return;
+    skipSilenceGap();
 
     const progress = (audioElement.currentTime * 1000 / totalDuration) * CONFIG.VISUALIZER_WIDTH;
     elements.marker.style.left = `${progress}px`;
@@ -1210,6 +1551,10 @@ function updateControls() {
     if (elements.stopBtn) elements.stopBtn.disabled = !isRecording;
     if (elements.errorBtn && isOwner) elements.errorBtn.disabled = !isRecording && !audioElement;
     if (elements.playBtn) elements.playBtn.disabled = !audioElement;
+    const noPhrases = !audioElement || !speechSegments.length;
+    if (elements.prevPhraseBtn) elements.prevPhraseBtn.disabled = noPhrases;
+    if (elements.nextPhraseBtn) elements.nextPhraseBtn.disabled = noPhrases;
+    if (elements.skipSilenceToggle) elements.skipSilenceToggle.disabled = noPhrases;
 }
 
 document.addEventListener('DOMContentLoaded', init);
\ No newline at end of file
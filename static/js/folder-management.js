@@ -3,6 +3,19 @@ document.addEventListener('DOMContentLoaded', function() {
     // Находим все кнопки редактирования и удаления
     const editButtons = document.querySelectorAll('.edit-folder');
     const deleteButtons = document.querySelectorAll('.delete-folder');
+    const importButton = document.getElementById('import-folder');
+    const importInput = document.getElementById('import-archive');
+    
+    // Архив выгрузки загружается телом запроса и восстанавливается в новую папку
+    if (importButton && importInput) {
+        importButton.addEventListener('click', () => importInput.click());
+        importInput.addEventListener('change', function() {
+            if (this.files.length) {
+                importFolder(this.files[0], importButton);
+                this.value = '';
+            }
+        });
+    }
     
     // Добавляем обработчики для кнопок редактирования
     editButtons.forEach(button => {
@@ -186,4 +199,24 @@ function getFilesWord(count) {
     } else {
         return 'файлов';
     }
-}
\ No newline at end of file
+}
+
+// Восстановление папки из архива выгрузки
+async function importFolder(file, button) {
+    button.disabled = true;
+    try {
+        const response = await fetch('/api/folders/import', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/zip' },
+            body: file
+        });
+        const data = await response.json();
+        if (!response.ok) throw new Error(data.error || `HTTP ${response.status}`);
+        window.location.href = `/folder/${data.folder_id}`;
+    } catch (error) {
+        console.error('Ошибка при загрузке архива:', error);
+        alert('Ошибка при загрузке архива: ' + error.message);
+    } finally {
+        button.disabled = false;
+    }
+}
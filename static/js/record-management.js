@@ -1,8 +1,23 @@
 // Обработка действий с записями (редактирование, удаление)
 document.addEventListener('DOMContentLoaded', function() {
+    bindRecordActions(document);
+    setupInfiniteScroll();
+
+    const emptyTrashButton = document.getElementById('empty-trash');
+    if (emptyTrashButton) {
+        emptyTrashButton.addEventListener('click', function() {
+            if (confirm('Удалить все записи из корзины? Это действие невозможно отменить.')) {
+                emptyTrash();
+            }
+        });
+    }
+});
+
+// Навешиваем обработчики на кнопки записей внутри root (страница или подгруженный блок)
+function bindRecordActions(root) {
     // Находим все кнопки редактирования и удаления
-    const editButtons = document.querySelectorAll('.edit-record');
-    const deleteButtons = document.querySelectorAll('.delete-record');
+    const editButtons = root.querySelectorAll('.edit-record');
+    const deleteButtons = root.querySelectorAll('.delete-record');
     
     // Добавляем обработчики для кнопок редактирования
     editButtons.forEach(button => {
@@ -38,7 +53,88 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         });
     });
-});
+}
+
+// Подгрузка следующих страниц папки при прокрутке до конца списка
+function setupInfiniteScroll() {
+    const container = document.getElementById('records-container');
+    const sentinel = document.getElementById('records-sentinel');
+    if (!container || !sentinel) return;
+
+    let loading = false;
+    const observer = new IntersectionObserver(async entries => {
+        if (!entries[0].isIntersecting || loading) return;
+        const cursor = container.dataset.nextCursor;
+        if (!cursor) {
+            observer.disconnect();
+            return;
+        }
+
+        loading = true;
+        try {
+            const response = await fetch(`/api/folders/${container.dataset.folderId}/records?cursor=${encodeURIComponent(cursor)}`);
+            if (!response.ok) throw new Error(await response.text());
+
+            const page = await response.json();
+            page.days.forEach(day => appendDay(container, day));
+            container.dataset.nextCursor = page.next_cursor || '';
+        } catch (error) {
+            console.error('Ошибка при загрузке записей:', error);
+        } finally {
+            loading = false;
+        }
+    }, { rootMargin: '200px' });
+    observer.observe(sentinel);
+}
+
+// Записи дня добавляются в уже выведенную группу этой даты или в новую группу
+function appendDay(container, day) {
+    let list;
+    const lastGroup = container.lastElementChild;
+    if (lastGroup && lastGroup.dataset.date === day.date) {
+        list = lastGroup.querySelector('.students-info__error-list');
+    } else {
+        const group = document.createElement('div');
+        group.className = 'date-group';
+        group.dataset.date = day.date;
+
+        const title = document.createElement('p');
+        title.className = 'students-info__error-list__title';
+        title.textContent = day.date;
+
+        list = document.createElement('div');
+        list.className = 'students-info__error-list';
+
+        group.append(title, list);
+        container.appendChild(group);
+    }
+
+    day.records.forEach(record => {
+        const item = document.createElement('div');
+        item.className = 'record-item';
+        item.innerHTML = `
+            <a href="/playback/${record.id}" class="record-link">
+                <label class="comment-input__wrap button">
+                    <span class="record-name" data-record-id="${record.id}"></span>
+                    <span class="record-summary" title="Длительность; ошибки при записи / при прослушивании"></span>
+                    <svg class="comment-input__icon" xmlns="http://www.w3.org/2000/svg" width="18" height="18"
+                         viewBox="0 0 18 18" fill="none">
+                        <path d="M8 4L12 9L8 14" stroke="#DDDDDD" stroke-width="2"/>
+                    </svg>
+                </label>
+            </a>
+            <div class="record-actions">
+                <i class="fas fa-edit record-action edit-record" data-record-id="${record.id}"></i>
+                <i class="fas fa-trash record-action delete-record" data-record-id="${record.id}" data-is-trash="${container.dataset.isTrash}"></i>
+            </div>
+        `;
+        item.querySelector('.record-name').textContent = record.name;
+        item.querySelector('.record-summary').textContent =
+            `${record.duration} · ${record.recorder_mistakes} / ${record.review_mistakes}`;
+        list.appendChild(item);
+        bindRecordActions(item);
+    });
+}
 
 // Функция для отображения формы редактирования
 function showEditForm(recordItem, recordNameElement, recordId, currentName) {
@@ -185,4 +281,26 @@ async function deleteRecord(recordId) {
         console.error('Ошибка при удалении записи:', error);
         alert('Ошибка при удалении записи: ' + error.message);
     }
-} 
\ No newline at end of file
+} 
+
+// Очистка всей корзины одним запросом
+async function emptyTrash() {
+    try {
+        const response = await fetch('/api/trash/empty', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            }
+        });
+        
+        if (!response.ok) {
+            const error = await response.text();
+            throw new Error(error);
+        }
+        
+        window.location.reload();
+    } catch (error) {
+        console.error('Ошибка при очистке корзины:', error);
+        alert('Ошибка при очистке корзины: ' + error.message);
+    }
+}
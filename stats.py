@@ -0,0 +1,153 @@
+from sqlalchemy import text
+
+# Сводная статистика хранится в таблице stats_daily по ключу (user_id, folder_id, day) и
+# поддерживается триггерами SQLite. Поэтому ее обновляют и изменения через ORM, и массовые
+# UPDATE/DELETE (перенос в корзину, очистка), без пересчета по mistake и record.
+# День - дата записи (record.datetime) в UTC
+
+STATS_COLUMNS = ('records', 'speech_seconds', 'voiced_seconds', 'recorder_mistakes', 'review_mistakes')
+
+
+def _upsert(values, source=None):
+    columns = ', '.join(('user_id', 'folder_id', 'day') + STATS_COLUMNS)
+    updates = ', '.join(f"{column} = {column} + excluded.{column}" for column in STATS_COLUMNS)
+    select = f"SELECT {', '.join(values)}" + (f" FROM {source}" if source else " WHERE 1")
+    return (f"INSERT INTO stats_daily ({columns}) {select} "
+            f"ON CONFLICT (user_id, folder_id, day) DO UPDATE SET {updates};")
+
+
+# Вклад записи: сама запись, ее длительность и ошибки, которые у нее есть на момент срабатывания
+def _record_values(row, sign):
+    return (
+        f"{row}.user_id", f"{row}.id_folder", f"date({row}.datetime)",
+        f"{sign}1",
+        f"{sign}COALESCE({row}.length, 0)",
+        f"{sign}COALESCE({row}.voiced_seconds, 0)",
+        f"{sign}(SELECT count(*) FROM mistake WHERE record_id = {row}.id AND type = 1)",
+        f"{sign}(SELECT count(*) FROM mistake WHERE record_id = {row}.id AND type = 2)",
+    )
+
+
+# Вклад ошибки приписывается дню и папке ее записи
+def _mistake_values(row, sign):
+    return (
+        "r.user_id", "r.id_folder", "date(r.datetime)", "0", "0", "0",
+        f"{sign}({row}.type IS 1)",
+        f"{sign}({row}.type IS 2)",
+    )
+
+
+def _drop_empty(row):
+    return (f"DELETE FROM stats_daily WHERE user_id = {row}.user_id AND folder_id = {row}.id_folder "
+            f"AND day = date({row}.datetime) AND records <= 0;")
+
+
+def _mistake_source(row):
+    return f"record r WHERE r.id = {row}.record_id"
+
+
+TRIGGERS = {
+    'stats_record_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS stats_record_insert AFTER INSERT ON record BEGIN
+            {_upsert(_record_values('NEW', ''))}
+        END""",
+    'stats_record_delete': f"""
+        CREATE TRIGGER IF NOT EXISTS stats_record_delete AFTER DELETE ON record BEGIN
+            {_upsert(_record_values('OLD', '-'))}
+            {_drop_empty('OLD')}
+        END""",
+    'stats_record_update': f"""
+        CREATE TRIGGER IF NOT EXISTS stats_record_update
+        AFTER UPDATE OF user_id, id_folder, length, voiced_seconds, datetime ON record BEGIN
+            {_upsert(_record_values('OLD', '-'))}
+            {_upsert(_record_values('NEW', ''))}
+            {_drop_empty('OLD')}
+        END""",
+    'stats_mistake_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS stats_mistake_insert AFTER INSERT ON mistake BEGIN
+            {_upsert(_mistake_values('NEW', ''), _mistake_source('NEW'))}
+        END""",
+    'stats_mistake_delete': f"""
+        CREATE TRIGGER IF NOT EXISTS stats_mistake_delete AFTER DELETE ON mistake BEGIN
+            {_upsert(_mistake_values('OLD', '-'), _mistake_source('OLD'))}
+        END""",
+    'stats_mistake_update': f"""
+        CREATE TRIGGER IF NOT EXISTS stats_mistake_update AFTER UPDATE OF type, record_id ON mistake BEGIN
+            {_upsert(_mistake_values('OLD', '-'), _mistake_source('OLD'))}
+            {_upsert(_mistake_values('NEW', ''), _mistake_source('NEW'))}
+        END""",
+}
+
+
+# Триггеры пересоздаются, чтобы база со старыми версиями триггеров получила новые столбцы
+def install_triggers(connection):
+    for name, ddl in TRIGGERS.items():
+        connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name}")
+        connection.exec_driver_sql(ddl)
+
+
+# Полный пересчет из record и mistake; выполняется в одной транзакции вызывающего
+def rebuild(connection):
+    connection.exec_driver_sql("DELETE FROM stats_daily")
+    connection.exec_driver_sql("""
+        INSERT INTO stats_daily (user_id, folder_id, day, records, speech_seconds, voiced_seconds,
+                                 recorder_mistakes, review_mistakes)
+        SELECT r.user_id, r.id_folder, date(r.datetime), count(*), COALESCE(sum(r.length), 0),
+               COALESCE(sum(r.voiced_seconds), 0), COALESCE(sum(m.recorder), 0), COALESCE(sum(m.review), 0)
+        FROM record r
+        LEFT JOIN (
+            SELECT record_id, sum(type IS 1) AS recorder, sum(type IS 2) AS review
+            FROM mistake GROUP BY record_id
+        ) m ON m.record_id = r.id
+        GROUP BY r.user_id, r.id_folder, date(r.datetime)
+    """)
+    return connection.exec_driver_sql("SELECT count(*) FROM stats_daily").scalar()
+
+
+GROUPINGS = {
+    'day': "day",
+    'month': "strftime('%Y-%m', day)",
+    'folder': "folder_id",
+    'total': None,
+}
+
+
+# Сумма по диапазону дней из сводной таблицы, сгруппированная по дню, месяцу, папке или целиком.
+# exclude_folder - папка, которую не нужно учитывать (корзина)
+def query_stats(session, user_id, date_from=None, date_to=None, group='day', folder_id=None, exclude_folder=None):
+    conditions = ["user_id = :user_id"]
+    params = {'user_id': user_id}
+    if date_from:
+        conditions.append("day >= :date_from")
+        params['date_from'] = date_from.isoformat()
+    if date_to:
+        conditions.append("day <= :date_to")
+        params['date_to'] = date_to.isoformat()
+    if folder_id is not None:
+        conditions.append("folder_id = :folder_id")
+        params['folder_id'] = folder_id
+    if exclude_folder is not None:
+        conditions.append("folder_id != :exclude_folder")
+        params['exclude_folder'] = exclude_folder
+
+    key = GROUPINGS[group]
+    sums = ', '.join(f"COALESCE(sum({column}), 0) AS {column}" for column in STATS_COLUMNS)
+    sql = f"SELECT {key + ' AS key, ' if key else ''}{sums} FROM stats_daily WHERE {' AND '.join(conditions)}"
+    if key:
+        sql += f" GROUP BY {key} ORDER BY {key}"
+
+    rows = []
+    for row in session.execute(text(sql), params).mappings():
+        item = {column: row[column] for column in STATS_COLUMNS}
+        if key:
+            item[group] = row['key']
+        minutes = item['speech_seconds'] / 60
+        item['speech_minutes'] = round(minutes, 2)
+        item['voiced_minutes'] = round(item['voiced_seconds'] / 60, 2)
+        # Доля времени с речью; паузы не учитываются
+        item['voiced_share'] = round(item['voiced_seconds'] / item['speech_seconds'], 3) if minutes else None
+        item['mistakes_per_minute'] = (
+            round((item['recorder_mistakes'] + item['review_mistakes']) / minutes, 3) if minutes else None
+        )
+        rows.append(item)
+    return rows
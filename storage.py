@@ -0,0 +1,287 @@
+import base64
+import hashlib
+import os
+import re
+import shutil
+import uuid
+from contextlib import closing, contextmanager
+
+from uploads import stream_to_file
+
+BLOB_PATH_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.wav$')
+
+
+# Файла нет в хранилище, и восстановить его не из чего
+class AudioMissing(Exception):
+    pass
+
+
+# Файл, только что положенный в хранилище, и его локальная копия spare. Пока ссылка на файл
+# не закоммичена в audio_blob, очистка может удалить файл с теми же байтами, оставшийся от
+# удаленной записи; restore кладет его обратно из копии. Копия удаляется при выходе из with
+class StagedAudio:
+    def __init__(self, store, path, size, spare):
+        self.store = store
+        self.path = path
+        self.size = size
+        self.spare = spare
+
+    def restore(self):
+        self.store._place(self.spare, self.path)
+
+    def discard(self):
+        if os.path.exists(self.spare):
+            os.remove(self.spare)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.discard()
+
+
+# Хранилище аудио по содержимому: файл называется sha256 своих байтов и лежит
+# в подкаталогах по первым символам хэша (ab/cd/abcd....wav), чтобы каталоги не разрастались.
+# Одинаковые файлы хранятся один раз, учет ссылок ведется в таблице audio_blob
+class AudioStore:
+    def __init__(self, root, chunk_size=64 * 1024):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.tmp_dir = os.path.join(root, '.tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    @staticmethod
+    def blob_path(digest):
+        return f"{digest[:2]}/{digest[2:4]}/{digest}.wav"
+
+    @staticmethod
+    def digest_of(path):
+        match = BLOB_PATH_RE.match(path or '')
+        return match.group(1) if match else None
+
+    def full_path(self, path):
+        return os.path.join(self.root, path)
+
+    def temp_path(self):
+        return os.path.join(self.tmp_dir, uuid.uuid4().hex)
+
+    # Поток пишется во временный файл с подсчетом хэша и затем атомарно кладется на место.
+    # Временный файл остается копией StagedAudio до коммита ссылки на него
+    def write(self, stream, limit):
+        tmp_path = self.temp_path()
+        hasher = hashlib.sha256()
+        size = stream_to_file(stream, tmp_path, limit, self.chunk_size, hasher)
+        return self._stage(tmp_path, hasher.hexdigest(), size)
+
+    # Перенос готового файла (склеенной докачки, старой записи) в хранилище.
+    # С move=False исходный файл остается на месте, а в хранилище попадает копия
+    def import_file(self, source_path, move=True):
+        hasher = hashlib.sha256()
+        with open(source_path, "rb") as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                hasher.update(chunk)
+        size = os.path.getsize(source_path)
+        if not move:
+            tmp_path = self.temp_path()
+            shutil.copyfile(source_path, tmp_path)
+            source_path = tmp_path
+        return self._stage(source_path, hasher.hexdigest(), size)
+
+    def _stage(self, spare, digest, size):
+        path = self.blob_path(digest)
+        try:
+            self._place(spare, path)
+        except BaseException:
+            os.remove(spare)
+            raise
+        return StagedAudio(self, path, size, spare)
+
+    # Файл кладется на место жесткой ссылкой на spare, без копирования байтов.
+    # Если такой файл уже есть, rename просто заменит его идентичной копией
+    def _place(self, spare, path):
+        target = self.full_path(path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = self.temp_path()
+        try:
+            os.link(spare, tmp_path)
+        except OSError:
+            shutil.copyfile(spare, tmp_path)
+        os.replace(tmp_path, target)
+
+    def delete(self, path):
+        target = self.full_path(path)
+        if os.path.exists(target):
+            os.remove(target)
+
+    # Общий интерфейс хранилищ: размер и время изменения файла (None, если файла нет),
+    # локальный путь для чтения и обработки, сохранение производных файлов (индекса пиков)
+    # и прямые ссылки для браузера. Локальное хранилище прямых ссылок не дает, файлы отдает приложение
+    supports_direct_upload = False
+
+    def stat(self, path):
+        try:
+            info = os.stat(self.full_path(path))
+        except OSError:
+            return None
+        return info.st_size, info.st_mtime
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    # Где лежит (или будет лежать после fetch) локальная копия файла
+    def local_path(self, path):
+        return self.full_path(path)
+
+    # Гарантирует наличие локальной копии; False, если файла нет
+    def fetch(self, path):
+        return os.path.exists(self.full_path(path))
+
+    # Файл для чтения на время обработки
+    @contextmanager
+    def local_copy(self, path):
+        yield self.full_path(path)
+
+    # Поток для последовательного чтения (выгрузка архивом)
+    def open(self, path):
+        return open(self.full_path(path), 'rb')
+
+    # Перенос построенного рядом производного файла в хранилище под именем path
+    def store_derived(self, source_path, path):
+        target = self.full_path(path)
+        if os.path.abspath(source_path) != os.path.abspath(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(source_path, target)
+
+    def download_url(self, path):
+        return None
+
+    def presign_upload(self, digest):
+        return None
+
+
+# Хранилище в S3-совместимом бакете (AWS S3, MinIO) с теми же именами файлов под префиксом.
+# Браузер загружает и скачивает аудио по подписанным ссылкам, приложение работает только с метаданными.
+# Для обработки файлы скачиваются во временный каталог, а индексы пиков кэшируются в cache_dir:
+# имена определяются содержимым, поэтому кэш никогда не устаревает. client можно передать готовый
+# (например, клиент moto в тестах); иначе он создается boto3 с учетными данными из окружения.
+# boto3 импортируется только здесь, чтобы локальное хранилище не тратило на него время запуска
+class S3AudioStore(AudioStore):
+    supports_direct_upload = True
+
+    def __init__(self, bucket, cache_dir, prefix='', client=None, endpoint_url=None, region=None,
+                 url_expires=3600, chunk_size=64 * 1024):
+        try:
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("Для хранилища S3 нужен пакет boto3 (pip install boto3)") from None
+        if client is None:
+            import boto3
+            from botocore.config import Config as BotoConfig
+            # Ссылки подписываются SigV4: только в ней заголовок x-amz-checksum-sha256 входит в подпись
+            client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region,
+                                  config=BotoConfig(signature_version='s3v4'))
+        super().__init__(cache_dir, chunk_size)
+        self.client = client
+        self.client_error = ClientError
+        self.bucket = bucket
+        self.prefix = prefix
+        self.url_expires = url_expires
+
+    def key(self, path):
+        return self.prefix + path
+
+    def _place(self, spare, path):
+        # Одинаковые байты уже загружены: повторная выгрузка не нужна
+        if not self.exists(path):
+            self.client.upload_file(spare, self.bucket, self.key(path), ExtraArgs={'ContentType': 'audio/wav'})
+
+    def delete(self, path):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(path))
+        super().delete(path)
+
+    def stat(self, path):
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.key(path))
+        except self.client_error as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return head['ContentLength'], head['LastModified'].timestamp()
+
+    def fetch(self, path):
+        target = self.full_path(path)
+        if os.path.exists(target):
+            return True
+        if not self.exists(path):
+            return False
+        tmp_path = self.temp_path()
+        try:
+            self.client.download_file(self.bucket, self.key(path), tmp_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp_path, target)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return True
+
+    # Аудио не кэшируется: скачивается во временный файл и удаляется вместе с тем, что построено рядом
+    @contextmanager
+    def local_copy(self, path):
+        tmp_dir = self.temp_path()
+        os.makedirs(tmp_dir)
+        try:
+            local_path = os.path.join(tmp_dir, os.path.basename(path))
+            self.client.download_file(self.bucket, self.key(path), local_path)
+            yield local_path
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # Тело объекта читается из ответа S3 кусками, без копии на диске
+    def open(self, path):
+        return closing(self.client.get_object(Bucket=self.bucket, Key=self.key(path))['Body'])
+
+    def store_derived(self, source_path, path):
+        self.client.upload_file(source_path, self.bucket, self.key(path))
+        super().store_derived(source_path, path)
+
+    def download_url(self, path):
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self.key(path), 'ResponseContentType': 'audio/wav'},
+            ExpiresIn=self.url_expires
+        )
+
+    # Подписанный PUT для загрузки из браузера. S3 сверяет sha256 тела с подписанным заголовком,
+    # поэтому под именем хэша не может оказаться другое содержимое
+    def presign_upload(self, digest):
+        path = self.blob_path(digest)
+        checksum = base64.b64encode(bytes.fromhex(digest)).decode('ascii')
+        url = self.client.generate_presigned_url(
+            'put_object',
+            Params={'Bucket': self.bucket, 'Key': self.key(path),
+                    'ContentType': 'audio/wav', 'ChecksumSHA256': checksum},
+            ExpiresIn=self.url_expires
+        )
+        return {
+            'url': url,
+            'path': path,
+            'headers': {'Content-Type': 'audio/wav', 'x-amz-checksum-sha256': checksum},
+        }
+
+
+# Хранилище по настройкам приложения: STORAGE_BACKEND = 'local' или 's3'
+def create_audio_store(config):
+    if config['STORAGE_BACKEND'] == 's3':
+        if not config['S3_BUCKET']:
+            raise RuntimeError("Для хранилища S3 нужно задать S3_BUCKET")
+        return S3AudioStore(
+            config['S3_BUCKET'], config['STORAGE_CACHE_FOLDER'],
+            prefix=config['S3_PREFIX'],
+            endpoint_url=config['S3_ENDPOINT_URL'],
+            region=config['S3_REGION'],
+            url_expires=config['S3_URL_EXPIRES'],
+            chunk_size=config['UPLOAD_CHUNK_SIZE']
+        )
+    if config['STORAGE_BACKEND'] != 'local':
+        raise RuntimeError(f"Неизвестное хранилище: {config['STORAGE_BACKEND']}")
+    return AudioStore(config['UPLOAD_FOLDER'], config['UPLOAD_CHUNK_SIZE'])
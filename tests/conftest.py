@@ -0,0 +1,173 @@
+import io
+import os
+import re
+import shutil
+import wave
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app
+from config import Config
+from extensions import audio_store
+from models import db, User, Folder, Record, Mistake, AudioBlob, Job
+from storage import AudioStore
+
+# Общие фикстуры тестов: приложение на временной базе, наполнение данными заданного размера
+# и подсчет SQL-запросов через события SQLAlchemy
+
+PASSWORD = 'secret-password'
+
+
+class TestConfig(Config):
+    __test__ = False
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    # Фоновые задачи не запускаются: тест видит только SQL самого запроса
+    JOB_WORKERS = 0
+    # Быстрый хэш, чтобы вход не занимал время теста и не требовал пересчета хэша
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1'
+    LOGIN_RATE_LIMIT = 1000
+    SLOW_REQUEST_THRESHOLD = None
+    # Выгрузка читает записи пачками; пачка больше любого тестового набора, поэтому число запросов постоянно
+    EXPORT_BATCH_SIZE = 1000
+
+
+def make_config(root):
+    class RootConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(root, 'site.db')
+        UPLOAD_FOLDER = os.path.join(root, 'uploads')
+        UPLOAD_SESSIONS_FOLDER = os.path.join(root, 'upload_sessions')
+        STORAGE_CACHE_FOLDER = os.path.join(root, 'storage_cache')
+    return RootConfig
+
+
+def wav_bytes(seconds=0.5, rate=8000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(bytes(int(rate * seconds) * 2))
+    return buffer.getvalue()
+
+
+# Набор данных размера size: владелец с size папками, по size записей в черновиках, корзине и
+# отдельной папке, по size ошибок у каждой записи, и size пользователей без папок.
+# Все записи ссылаются на один аудиофайл хранилища. Возвращает id объектов для адресов маршрутов
+def seed(size):
+    with audio_store.write(io.BytesIO(wav_bytes()), Config.MAX_UPLOAD_SIZE) as staged:
+        audio_file, audio_size = staged.path, staged.size
+    owner = User(first_name='Owner', last_name='Test', login='owner')
+    owner.set_password(PASSWORD)
+    db.session.add(owner)
+    db.session.add_all(User(first_name=f'User{i}', last_name='Test', login=f'user{i}', password_hash='-')
+                       for i in range(size))
+    db.session.flush()
+
+    drafts = Folder(name='Черновики', user_id=owner.id)
+    trash = Folder(name='Корзина', user_id=owner.id)
+    target = Folder(name='Уроки', user_id=owner.id)
+    db.session.add_all([drafts, trash, target])
+    db.session.add_all(Folder(name=f'Папка {i}', user_id=owner.id) for i in range(size))
+    db.session.flush()
+
+    now = datetime.utcnow()
+    records = []
+    for folder in (drafts, trash, target):
+        for i in range(size):
+            in_trash = folder is trash
+            records.append(Record(
+                user_id=owner.id, id_folder=folder.id, name=f'Запись {folder.name} {i}',
+                length=60.0, audio_file=audio_file, status='ready',
+                datetime=now - timedelta(days=i, minutes=len(records)),
+                trash=1 if in_trash else 0, trashed_at=now - timedelta(days=365) if in_trash else None,
+                speech_segments='[[0,500]]', voiced_seconds=0.5
+            ))
+    db.session.add_all(records)
+    db.session.flush()
+    db.session.add_all(
+        Mistake(record_id=record.id, time_of_mistake=i / 10, type=1 + i % 2, comment=f'ошибка {i}')
+        for record in records for i in range(size)
+    )
+    db.session.add(AudioBlob(hash=AudioStore.digest_of(audio_file), path=audio_file, size=audio_size,
+                             ref_count=len(records)))
+    job = Job(kind='process_record', record_id=records[0].id, status='done')
+    db.session.add(job)
+    db.session.commit()
+
+    first = records[0]
+    return {
+        'drafts': drafts.id,
+        'trash': trash.id,
+        'target': target.id,
+        'record': first.id,
+        'trash_record': records[size].id,
+        'mistake': Mistake.query.filter_by(record_id=first.id).order_by(Mistake.id).first().id,
+        'job': job.id,
+        'drafts_records': [record.id for record in records[:size]],
+    }
+
+
+# Шаблоны баз по размерам строятся один раз за сессию, каждый тест получает свою копию
+@pytest.fixture(scope='session')
+def seeded_templates(tmp_path_factory):
+    templates = {}
+
+    def build(size):
+        if size not in templates:
+            root = str(tmp_path_factory.mktemp(f'seed-{size}'))
+            app = create_app(make_config(root))
+            with app.app_context():
+                templates[size] = (root, seed(size))
+                db.engine.dispose()
+        return templates[size]
+    return build
+
+
+@pytest.fixture
+def seeded_app(seeded_templates, tmp_path):
+    def make(size):
+        template_root, ids = seeded_templates(size)
+        root = str(tmp_path / f'app-{size}')
+        shutil.copytree(template_root, root)
+        return create_app(make_config(root)), ids
+    return make
+
+
+class QueryLog:
+    def __init__(self):
+        self.statements = []
+
+    def __len__(self):
+        return len(self.statements)
+
+    # Одинаковые по форме запросы (без литералов и списков параметров IN) считаются вместе
+    def grouped(self):
+        return Counter(normalize_sql(statement) for statement in self.statements)
+
+
+def normalize_sql(statement):
+    statement = ' '.join(statement.split())
+    statement = re.sub(r'\(\s*(?:\?|__\[POSTCOMPILE_\w+\])(?:\s*,\s*\?)*\s*\)', '(?)', statement)
+    return re.sub(r"'[^']*'|\b\d+\b", '?', statement)
+
+
+# Все SQL-запросы, выполненные движком приложения внутри блока
+@contextmanager
+def count_queries(app):
+    log = QueryLog()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        log.statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield log
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
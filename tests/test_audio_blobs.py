@@ -0,0 +1,85 @@
+import io
+import threading
+import time
+
+import pytest
+
+from app import create_app, acquire_blob, remove_unreferenced_audio
+from conftest import make_config, wav_bytes
+from extensions import audio_store
+from models import db, AudioBlob
+from storage import AudioMissing, AudioStore
+
+# Учет ссылок на файлы хранилища при параллельной очистке: файл, который очистка удалила
+# между записью и acquire_blob новой записи, должен вернуться на место
+
+
+@pytest.fixture
+def app(tmp_path):
+    return create_app(make_config(str(tmp_path)))
+
+
+def stage(app):
+    return audio_store.write(io.BytesIO(wav_bytes()), app.config['MAX_UPLOAD_SIZE'])
+
+
+def test_acquire_restores_file_removed_by_purge(app):
+    with app.app_context(), stage(app) as staged:
+        # Очистка от удаленной записи с теми же байтами успела раньше ссылки новой записи
+        remove_unreferenced_audio(staged.path)
+        assert not audio_store.exists(staged.path)
+
+        acquire_blob(staged.path, staged.size, staged)
+        db.session.commit()
+        assert audio_store.exists(staged.path)
+        assert db.session.get(AudioBlob, AudioStore.digest_of(staged.path)).ref_count == 1
+
+
+def test_acquire_without_copy_reports_missing_file(app):
+    with app.app_context(), stage(app) as staged:
+        remove_unreferenced_audio(staged.path)
+        with pytest.raises(AudioMissing):
+            acquire_blob(staged.path, staged.size)
+        db.session.rollback()
+
+
+# Очистка начинается, пока транзакция с acquire_blob еще открыта: она ждет коммита и видит ссылку
+def test_purge_waits_for_pending_reference(app):
+    acquired, purging = threading.Event(), threading.Event()
+    errors = []
+
+    with app.app_context():
+        staged = stage(app)
+
+    def upload():
+        try:
+            with app.app_context():
+                acquire_blob(staged.path, staged.size, staged)
+                acquired.set()
+                purging.wait(5)
+                time.sleep(0.2)
+                db.session.commit()
+        except Exception as e:
+            errors.append(e)
+            acquired.set()
+
+    def purge():
+        try:
+            acquired.wait(5)
+            purging.set()
+            with app.app_context():
+                remove_unreferenced_audio(staged.path)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=upload), threading.Thread(target=purge)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    staged.discard()
+
+    assert errors == []
+    with app.app_context():
+        assert audio_store.exists(staged.path)
+        assert db.session.get(AudioBlob, AudioStore.digest_of(staged.path)) is not None
@@ -0,0 +1,54 @@
+import pytest
+
+import counters
+from conftest import PASSWORD
+from models import db, Folder, Record
+
+# Счетчики записей и папок поддерживаются триггерами: после любого изменяющего запроса
+# пересчет repair не должен находить расхождений
+
+MUTATIONS = {
+    'add_error': lambda ids: ('POST', f"/api/records/{ids['record']}/errors", {'json': {'time': 1500}}),
+    'delete_mistake': lambda ids: ('DELETE', f"/api/mistakes/{ids['mistake']}", {}),
+    'batch_mistakes': lambda ids: ('POST', f"/api/records/{ids['record']}/mistakes/batch", {'json': {'operations': [
+        {'op': 'add', 'time': 2500, 'type': 1},
+        {'op': 'delete', 'id': ids['mistake']},
+    ]}}),
+    'trash_record': lambda ids: ('POST', f"/api/records/{ids['record']}/trash", {}),
+    'delete_record': lambda ids: ('DELETE', f"/api/records/{ids['trash_record']}/delete", {}),
+    'move_records': lambda ids: ('POST', '/api/records/move',
+                                 {'json': {'records': ids['drafts_records'], 'folder': ids['target']}}),
+    'delete_folder': lambda ids: ('DELETE', f"/api/folders/{ids['target']}", {}),
+    'empty_trash': lambda ids: ('POST', '/api/trash/empty', {}),
+}
+
+
+def assert_consistent(app):
+    with app.app_context(), db.engine.begin() as connection:
+        assert counters.repair(connection) == (0, 0)
+
+
+@pytest.mark.parametrize('name', MUTATIONS)
+def test_counters_follow_mutations(seeded_app, name):
+    app, ids = seeded_app(5)
+    assert_consistent(app)
+    client = app.test_client()
+    client.post('/login', data={'login': 'owner', 'password': PASSWORD})
+    method, url, kwargs = MUTATIONS[name](ids)
+    response = client.open(url, method=method, **kwargs)
+    assert response.status_code == 200, response.get_data(as_text=True)[:500]
+    assert_consistent(app)
+
+
+def test_repair_fixes_drift(seeded_app):
+    app, ids = seeded_app(2)
+    with app.app_context():
+        db.session.query(Record).filter_by(id=ids['record']).update({'recorder_mistakes': 100})
+        db.session.query(Folder).filter_by(id=ids['drafts']).update({'record_count': 0, 'total_length': 0})
+        db.session.commit()
+        with db.engine.begin() as connection:
+            assert counters.repair(connection) == (1, 1)
+        record = db.session.get(Record, ids['record'])
+        folder = db.session.get(Folder, ids['drafts'])
+        assert (record.recorder_mistakes, record.review_mistakes) == (1, 1)
+        assert (folder.record_count, folder.total_length) == (2, 120.0)
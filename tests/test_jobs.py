@@ -0,0 +1,23 @@
+from app import create_app
+from conftest import make_config
+from extensions import job_queue
+from models import db, Job
+
+
+# Задачу удаляют мимо ORM, как purge_records при удалении записи, а затем обработчик падает.
+# Воркер должен пропустить задачу, а не упасть на просроченном объекте
+def test_job_deleted_while_running(tmp_path):
+    app = create_app(make_config(str(tmp_path)))
+
+    def delete_self(job):
+        db.session.execute(Job.__table__.delete().where(Job.id == job.id))
+        db.session.commit()
+        raise RuntimeError("запись удалена")
+
+    with app.app_context():
+        job_queue.handlers['delete_self'] = (delete_self, None)
+        job_queue.enqueue('delete_self')
+        db.session.commit()
+
+        assert job_queue.run_next('test') is True
+        assert Job.query.count() == 0
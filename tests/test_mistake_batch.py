@@ -0,0 +1,28 @@
+from conftest import PASSWORD
+from models import Mistake
+
+# Пакет, отправленный при уходе со страницы, ссылается на ошибки из еще не ответившего пакета
+# по времени нажатия: такие правки и удаления должны находить ошибку
+
+
+def test_batch_finds_mistakes_by_time(seeded_app):
+    app, ids = seeded_app(2)
+    client = app.test_client()
+    client.post('/login', data={'login': 'owner', 'password': PASSWORD})
+    url = f"/api/records/{ids['record']}/mistakes/batch"
+
+    response = client.post(url, json={'operations': [
+        {'op': 'add', 'time': 2500.4, 'type': 2, 'client_id': 'c1'},
+        {'op': 'add', 'time': 3500.6, 'type': 2, 'client_id': 'c2'},
+    ]})
+    assert response.status_code == 200
+
+    response = client.post(url, json={'operations': [
+        {'op': 'comment', 'time': 2500.4, 'comment': 'после ухода'},
+        {'op': 'delete', 'time': 3500.6},
+    ]})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    with app.app_context():
+        times = {m.time_ms: m.comment for m in Mistake.query.filter_by(record_id=ids['record'])}
+        assert times.get(2500) == 'после ухода'
+        assert 3501 not in times
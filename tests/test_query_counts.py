@@ -0,0 +1,180 @@
+import hashlib
+import io
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import pytest
+
+import archive
+from conftest import PASSWORD, count_queries, wav_bytes
+
+# Число SQL-запросов каждого маршрута не должно зависеть от объема данных: маршрут вызывается на
+# базах нескольких размеров, и если запросов становится больше, тест падает и печатает запросы, которых стало больше.
+# Новый маршрут без записи в ROUTES тоже роняет тест
+
+SIZES = (2, 5, 10)
+
+
+@dataclass
+class Route:
+    endpoint: str
+    method: str
+    # Адрес с подстановками из id набора данных и из результата setup: '/api/records/{record}'
+    url: str
+    status: int = 200
+    login: bool = True
+    # Аргументы запроса (json, data, headers...), функция от id набора данных
+    kwargs: Callable[[dict], dict] = field(default=lambda ids: {})
+    # Подготовка вне подсчета, возвращает дополнительные подстановки для адреса
+    setup: Optional[Callable] = None
+
+
+def create_upload(client, ids):
+    return {'upload': client.post('/api/uploads').get_json()['upload_id']}
+
+
+def upload_chunk(client, ids):
+    values = create_upload(client, ids)
+    data = wav_bytes()
+    client.put(f"/api/uploads/{values['upload']}/chunks/0", data=data,
+               headers={'X-Chunk-SHA256': hashlib.sha256(data).hexdigest()})
+    return values
+
+
+# Архив постоянного размера, чтобы от размера набора данных зависела только база
+def import_archive(ids):
+    audio = wav_bytes()
+    entries = [(archive.FOLDER_ENTRY, archive.folder_entry('Импорт'), None)]
+    for index in range(2):
+        directory = archive.record_dir(index, f'Запись {index}')
+        entries.append((f'{directory}/{archive.AUDIO_ENTRY}', audio, None))
+        entries.append((f'{directory}/{archive.RECORD_ENTRY}', archive.to_json({
+            'name': f'Запись {index}', 'duration': 500, 'audio': f'{directory}/{archive.AUDIO_ENTRY}',
+            'mistakes': [{'time': 100, 'type': 1, 'comment': 'ошибка'}],
+        }), None))
+    return {'data': b''.join(archive.stream_zip(entries)), 'content_type': 'application/zip'}
+
+
+ROUTES = [
+    Route('main.index', 'GET', '/'),
+    Route('main.blackhole_instructions', 'GET', '/blackhole-instructions'),
+    Route('main.record', 'GET', '/record'),
+    Route('main.save', 'GET', '/save'),
+    Route('main.playback', 'GET', '/playback/{record}'),
+    Route('main.folder', 'GET', '/folder/{drafts}'),
+    Route('main.get_folder_records', 'GET', '/api/folders/{drafts}/records'),
+    Route('main.add_folder', 'GET', '/add_folder'),
+    Route('main.create_folder', 'POST', '/create_folder', 302,
+          kwargs=lambda ids: {'data': {'folder_name': 'Новая папка'}}),
+    Route('main.register', 'POST', '/register', 302, login=False, kwargs=lambda ids: {'data': {
+        'first_name': 'New', 'last_name': 'User', 'login': 'newuser',
+        'password': PASSWORD, 'confirm_password': PASSWORD,
+    }}),
+    Route('main.login', 'POST', '/login', 302, login=False,
+          kwargs=lambda ids: {'data': {'login': 'owner', 'password': PASSWORD}}),
+    Route('main.logout', 'GET', '/logout', 302),
+    Route('main.get_job', 'GET', '/api/jobs/{job}'),
+    Route('main.save_record', 'POST', '/api/records', kwargs=lambda ids: {'data': {
+        'name': 'Новая запись', 'folder': str(ids['drafts']), 'duration': '500', 'errors': '[100, 200]',
+        'audio': (io.BytesIO(wav_bytes()), 'recording.wav'),
+    }}),
+    Route('main.create_direct_upload', 'POST', '/api/records/direct-upload', 501,
+          kwargs=lambda ids: {'json': {'sha256': '0' * 64, 'size': 100}}),
+    Route('main.create_upload', 'POST', '/api/uploads'),
+    Route('main.get_upload', 'GET', '/api/uploads/{upload}', setup=upload_chunk),
+    Route('main.put_upload_chunk', 'PUT', '/api/uploads/{upload}/chunks/0', setup=create_upload,
+          kwargs=lambda ids: {'data': wav_bytes(),
+                              'headers': {'X-Chunk-SHA256': hashlib.sha256(wav_bytes()).hexdigest()}}),
+    Route('main.complete_upload', 'POST', '/api/uploads/{upload}/complete', setup=upload_chunk,
+          kwargs=lambda ids: {'json': {'name': 'Запись по частям', 'folder': ids['drafts'], 'chunks': 1,
+                                       'duration': 500, 'errors': [100]}}),
+    Route('main.cancel_upload', 'DELETE', '/api/uploads/{upload}', setup=upload_chunk),
+    Route('main.get_record', 'GET', '/api/records/{record}'),
+    Route('main.get_record_audio', 'GET', '/api/records/{record}/audio'),
+    Route('main.get_record_peaks', 'GET', '/api/records/{record}/peaks'),
+    Route('main.get_record_speech', 'GET', '/api/records/{record}/speech'),
+    Route('main.add_error', 'POST', '/api/records/{record}/errors', kwargs=lambda ids: {'json': {'time': 1500}}),
+    Route('main.delete_mistake', 'DELETE', '/api/mistakes/{mistake}'),
+    Route('main.get_folders', 'GET', '/api/folders'),
+    Route('main.init_folders', 'GET', '/init_folders', login=False),
+    Route('main.init_test_user', 'GET', '/init_test_user', login=False),
+    Route('main.update_error_comment', 'POST', '/api/records/{record}/errors/comment',
+          kwargs=lambda ids: {'json': {'id': ids['mistake'], 'comment': 'новый комментарий'}}),
+    Route('main.batch_mistakes', 'POST', '/api/records/{record}/mistakes/batch',
+          kwargs=lambda ids: {'json': {'operations': [
+              {'op': 'add', 'time': 2500, 'type': 2, 'comment': 'добавлена'},
+              {'op': 'comment', 'id': ids['mistake'], 'comment': 'изменена'},
+              {'op': 'delete', 'id': ids['mistake']},
+          ]}}),
+    Route('main.settings', 'GET', '/settings'),
+    Route('main.folders', 'GET', '/folders'),
+    Route('main.delete_folder', 'DELETE', '/api/folders/{target}'),
+    Route('main.rename_folder', 'POST', '/api/folders/{target}/rename',
+          kwargs=lambda ids: {'json': {'name': 'Переименованная'}}),
+    Route('main.export_folder', 'GET', '/api/folders/{target}/export'),
+    Route('main.import_folder', 'POST', '/api/folders/import', kwargs=import_archive),
+    Route('main.profile_settings', 'POST', '/settings/profile', 302,
+          kwargs=lambda ids: {'data': {'first_name': 'Renamed', 'last_name': 'Owner'}}),
+    Route('main.password_settings', 'POST', '/settings/password', kwargs=lambda ids: {'data': {
+        'current_password': PASSWORD, 'new_password': PASSWORD + '2', 'confirm_password': PASSWORD + '2',
+    }}),
+    Route('main.rename_record', 'POST', '/api/records/{record}/rename',
+          kwargs=lambda ids: {'json': {'name': 'Новое название'}}),
+    Route('main.trash_record', 'POST', '/api/records/{record}/trash'),
+    Route('main.delete_record', 'DELETE', '/api/records/{trash_record}/delete'),
+    Route('main.get_stats', 'GET', '/api/stats?group=folder'),
+    Route('main.search_records', 'GET', '/api/search?q=Запись'),
+    Route('main.metrics', 'GET', '/metrics'),
+    Route('main.move_records_api', 'POST', '/api/records/move',
+          kwargs=lambda ids: {'json': {'records': ids['drafts_records'], 'folder': ids['target']}}),
+    Route('main.empty_trash', 'POST', '/api/trash/empty'),
+]
+
+
+def run_route(seeded_app, route, size):
+    app, ids = seeded_app(size)
+    client = app.test_client()
+    if route.login:
+        response = client.post('/login', data={'login': 'owner', 'password': PASSWORD})
+        assert response.status_code == 302, "не удалось войти тестовым пользователем"
+    values = dict(ids)
+    if route.setup:
+        values.update(route.setup(client, ids))
+    url = route.url.format(**values)
+    kwargs = route.kwargs(ids)
+
+    with count_queries(app) as log:
+        response = client.open(url, method=route.method, **kwargs)
+        # Потоковые ответы выполняют запросы при чтении тела
+        response.get_data()
+    assert response.status_code == route.status, (
+        f"{route.method} {url}: {response.status_code} {response.get_data(as_text=True)[:500]}"
+    )
+    return log
+
+
+def growth_report(small, large):
+    before, after = small.grouped(), large.grouped()
+    lines = []
+    for statement, count in after.most_common():
+        if count > before.get(statement, 0):
+            lines.append(f"  {before.get(statement, 0)} -> {count}: {statement}")
+    return '\n'.join(lines)
+
+
+def test_every_route_is_covered(seeded_app):
+    app, _ = seeded_app(SIZES[0])
+    endpoints = {rule.endpoint for rule in app.url_map.iter_rules() if rule.endpoint != 'static'}
+    covered = {route.endpoint for route in ROUTES}
+    assert endpoints - covered == set(), "маршруты без проверки числа запросов"
+    assert covered - endpoints == set(), "проверки для несуществующих маршрутов"
+
+
+@pytest.mark.parametrize('route', ROUTES, ids=lambda route: route.endpoint)
+def test_query_count_does_not_grow(seeded_app, route):
+    logs = [run_route(seeded_app, route, size) for size in SIZES]
+    counts = [len(log) for log in logs]
+    assert len(set(counts)) == 1, (
+        f"{route.method} {route.url}: число запросов растет с объемом данных "
+        f"{dict(zip(SIZES, counts))}\n{growth_report(logs[0], logs[-1])}"
+    )
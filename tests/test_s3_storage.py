@@ -0,0 +1,133 @@
+import base64
+import hashlib
+import io
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+requests = pytest.importorskip('requests')
+
+from app import create_app
+from conftest import PASSWORD, make_config, seed, wav_bytes
+from extensions import audio_store
+from models import db, AudioBlob, Record
+from storage import AudioStore, S3AudioStore
+
+# Хранилище S3 проверяется на moto: объекты, подписанные ссылки и сохранение записи
+# после прямой загрузки из браузера
+
+BUCKET = 'speakpeak-test'
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    for name, value in {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                        'AWS_SESSION_TOKEN': 'testing', 'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+        monkeypatch.setenv(name, value)
+
+    class S3Config(make_config(str(tmp_path))):
+        STORAGE_BACKEND = 's3'
+        S3_BUCKET = BUCKET
+        S3_PREFIX = 'audio/'
+        S3_REGION = 'us-east-1'
+
+    with moto.mock_aws():
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=BUCKET)
+        app = create_app(S3Config)
+        with app.app_context():
+            assert isinstance(audio_store._get_current_object(), S3AudioStore)
+        yield app
+
+
+def objects():
+    listing = boto3.client('s3', region_name='us-east-1').list_objects_v2(Bucket=BUCKET)
+    return [item['Key'] for item in listing.get('Contents', [])]
+
+
+def test_write_open_delete(app):
+    data = wav_bytes()
+    with app.app_context():
+        with audio_store.write(io.BytesIO(data), app.config['MAX_UPLOAD_SIZE']) as staged:
+            path = staged.path
+        assert path == AudioStore.blob_path(hashlib.sha256(data).hexdigest())
+        assert objects() == ['audio/' + path]
+        assert audio_store.stat(path)[0] == len(data)
+        with audio_store.open(path) as body:
+            assert body.read() == data
+
+        audio_store.delete(path)
+        assert not audio_store.exists(path)
+        assert objects() == []
+
+
+def test_download_url_is_signed(app):
+    with app.app_context():
+        with audio_store.write(io.BytesIO(wav_bytes()), app.config['MAX_UPLOAD_SIZE']) as staged:
+            path = staged.path
+        url = urlparse(audio_store.download_url(path))
+        assert url.path.endswith('/audio/' + path)
+        assert 'X-Amz-Signature' in parse_qs(url.query)
+
+
+def test_presign_upload(app):
+    digest = hashlib.sha256(wav_bytes()).hexdigest()
+    with app.app_context():
+        upload = audio_store.presign_upload(digest)
+    assert upload['path'] == AudioStore.blob_path(digest)
+    assert upload['headers']['x-amz-checksum-sha256'] == base64.b64encode(bytes.fromhex(digest)).decode()
+    url = urlparse(upload['url'])
+    assert url.path.endswith('/audio/' + upload['path'])
+    # Контрольная сумма входит в подпись, поэтому другое содержимое по ссылке не загрузить
+    assert 'x-amz-checksum-sha256' in parse_qs(url.query)['X-Amz-SignedHeaders'][0].split(';')
+
+
+def test_save_record_uploaded(app):
+    data = wav_bytes(seconds=1)
+    with app.app_context():
+        ids = seed(1)
+    client = app.test_client()
+    client.post('/login', data={'login': 'owner', 'password': PASSWORD})
+    assert b'data-direct-upload' in client.get('/save').data
+
+    upload = client.post('/api/records/direct-upload', json={
+        'sha256': hashlib.sha256(data).hexdigest(), 'size': len(data)
+    }).get_json()
+    fields = {'name': 'Прямая', 'folder': ids['drafts'], 'duration': 1000, 'errors': [500],
+              'upload': upload['token']}
+
+    # Пока файла в бакете нет, запись не создается
+    assert client.post('/api/records', json=fields).status_code == 409
+
+    # Браузер загружает файл по подписанной ссылке с выданными заголовками
+    assert requests.put(upload['url'], data=data, headers=upload['headers']).status_code == 200
+    response = client.post('/api/records', json=fields)
+    assert response.status_code == 200, response.get_data(as_text=True)
+
+    with app.app_context():
+        record = db.session.get(Record, response.get_json()['record_id'])
+        assert record.audio_file == upload['path']
+        blob = db.session.get(AudioBlob, AudioStore.digest_of(upload['path']))
+        assert (blob.size, blob.ref_count) == (len(data), 1)
+
+
+# Плеер открывает аудио с crossOrigin: перенаправление ведет в бакет, который по правилу CORS
+# разрешает GET с адреса сайта, иначе Web Audio получит вместо звука тишину
+def test_audio_redirects_to_bucket_with_cors(app):
+    with app.app_context():
+        ids = seed(1)
+    boto3.client('s3', region_name='us-east-1').put_bucket_cors(Bucket=BUCKET, CORSConfiguration={'CORSRules': [
+        {'AllowedOrigins': ['https://speakpeak.example'], 'AllowedMethods': ['GET', 'PUT'], 'AllowedHeaders': ['*']}
+    ]})
+    client = app.test_client()
+    client.post('/login', data={'login': 'owner', 'password': PASSWORD})
+
+    response = client.get(f"/api/records/{ids['record']}/audio")
+    assert response.status_code == 302
+    assert response.headers['Cache-Control'] == 'no-store'
+
+    audio = requests.get(response.headers['Location'], headers={'Origin': 'https://speakpeak.example'})
+    assert audio.status_code == 200
+    assert audio.headers['Access-Control-Allow-Origin'] == 'https://speakpeak.example'
+    assert audio.content == wav_bytes()
@@ -0,0 +1,73 @@
+import io
+import math
+import struct
+import wave
+
+from app import create_app
+from conftest import PASSWORD, make_config, seed
+from extensions import job_queue
+from models import db, Mistake, Record
+
+# Отрезки речи считает только фоновая обработка, а перенос ошибок на границу фразы
+# делается при отдаче записи и не меняет время нажатия в базе
+
+
+def speech_wav(rate=8000):
+    # Полсекунды тишины, секунда тона, полторы секунды тишины
+    samples = [0] * (rate // 2)
+    samples += [int(12000 * math.sin(2 * math.pi * 220 * i / rate)) for i in range(rate)]
+    samples += [0] * (rate * 3 // 2)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(struct.pack(f'<{len(samples)}h', *samples))
+    return buffer.getvalue()
+
+
+def logged_in(tmp_path):
+    app = create_app(make_config(str(tmp_path)))
+    with app.app_context():
+        ids = seed(1)
+    client = app.test_client()
+    client.post('/login', data={'login': 'owner', 'password': PASSWORD})
+    return app, client, ids
+
+
+def test_speech_get_does_not_write(tmp_path):
+    app, client, ids = logged_in(tmp_path)
+    with app.app_context():
+        record = db.session.get(Record, ids['record'])
+        record.speech_segments = None
+        record.status = 'processing'
+        db.session.commit()
+
+    assert client.get(f"/api/records/{ids['record']}/speech").status_code == 202
+
+    with app.app_context():
+        db.session.get(Record, ids['record']).status = 'ready'
+        db.session.commit()
+    assert client.get(f"/api/records/{ids['record']}/speech").status_code == 404
+    with app.app_context():
+        assert db.session.get(Record, ids['record']).speech_segments is None
+
+
+def test_processing_keeps_click_times(tmp_path):
+    app, client, ids = logged_in(tmp_path)
+    response = client.post('/api/records', data={
+        'name': 'Речь', 'folder': str(ids['drafts']), 'duration': '3000', 'errors': '[1834.5]',
+        'audio': (io.BytesIO(speech_wav()), 'speech.wav'),
+    })
+    record_id = response.get_json()['record_id']
+    with app.app_context():
+        job_queue.drain()
+        record = db.session.get(Record, record_id)
+        assert record.speech_segments is not None
+        assert Mistake.query.filter_by(record_id=record_id).one().time_of_mistake == 1.8345
+
+    errors = client.get(f"/api/records/{record_id}").get_json()['errors']
+    assert errors[0]['time'] == 1834.5
+    # Нажатие в паузе сразу после фразы показывается на ее конце, в целых миллисекундах
+    assert isinstance(errors[0]['snapped'], int)
+    assert 1400 <= errors[0]['snapped'] <= 1600
@@ -0,0 +1,33 @@
+import hashlib
+
+from app import create_app
+from conftest import PASSWORD, make_config, seed
+
+# Части докачки ограничены не только по одной: вся сессия не может быть больше записи
+
+
+def test_session_total_is_limited(tmp_path):
+    class SmallUploads(make_config(str(tmp_path))):
+        MAX_UPLOAD_SIZE = 1000
+        MAX_UPLOAD_CHUNK_SIZE = 400
+
+    app = create_app(SmallUploads)
+    with app.app_context():
+        seed(1)
+    client = app.test_client()
+    client.post('/login', data={'login': 'owner', 'password': PASSWORD})
+    upload_id = client.post('/api/uploads').get_json()['upload_id']
+
+    def put(index, size):
+        body = bytes([index]) * size
+        return client.put(f'/api/uploads/{upload_id}/chunks/{index}', data=body,
+                          headers={'X-Chunk-SHA256': hashlib.sha256(body).hexdigest()})
+
+    assert put(0, 400).status_code == 200
+    assert put(1, 400).status_code == 200
+    assert put(2, 400).status_code == 413
+    # Повторная отправка части заменяет ее и не считается сверх лимита
+    assert put(1, 400).status_code == 200
+    assert put(2, 200).status_code == 200
+    assert put(3, 1).status_code == 413
+    assert client.get(f'/api/uploads/{upload_id}').get_json()['bytes'] == 1000
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+# Части сессии вместе больше допустимого размера всей записи
+class SessionTooLarge(UploadTooLarge):
+    pass
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+class UploadSessionNotFound(Exception):
+    pass
+
+
+class MissingChunks(Exception):
+    def __init__(self, missing):
+        super().__init__(f"Не хватает частей: {missing}")
+        self.missing = missing
+
+
+# Запись потока на диск фиксированными чанками: память не зависит от длины записи.
+# Файл появляется под итоговым именем только целиком (через .part и rename)
+def stream_to_file(stream, path, limit, chunk_size, hasher=None):
+    tmp_path = path + '.part'
+    written = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > limit:
+                    raise UploadTooLarge()
+                if hasher is not None:
+                    hasher.update(chunk)
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return written
+
+
+# Сессии докачки: каталог <root>/<id> с meta.json и частями <номер>.chunk.
+# Время последней активности - mtime meta.json, по нему удаляются просроченные сессии
+def _session_dir(root, upload_id):
+    # id всегда uuid4 hex: не даем выйти за пределы root
+    if len(upload_id) != 32 or not all(c in '0123456789abcdef' for c in upload_id):
+        raise UploadSessionNotFound(upload_id)
+    return os.path.join(root, upload_id)
+
+
+def _chunk_path(session_dir, index):
+    return os.path.join(session_dir, f"{index:06d}.chunk")
+
+
+def create_session(root, user_id):
+    upload_id = uuid.uuid4().hex
+    session_dir = os.path.join(root, upload_id)
+    os.makedirs(session_dir)
+    with open(os.path.join(session_dir, 'meta.json'), 'w') as f:
+        json.dump({'user_id': user_id, 'created': time.time()}, f)
+    return upload_id
+
+
+def load_session(root, upload_id):
+    meta_path = os.path.join(_session_dir(root, upload_id), 'meta.json')
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise UploadSessionNotFound(upload_id)
+
+
+def touch_session(root, upload_id):
+    os.utime(os.path.join(_session_dir(root, upload_id), 'meta.json'))
+
+
+# Финализацию может выполнить только один запрос: meta.json атомарно переименовывается
+def claim_session(root, upload_id):
+    meta_path = os.path.join(_session_dir(root, upload_id), 'meta.json')
+    try:
+        os.rename(meta_path, meta_path + '.claimed')
+    except FileNotFoundError:
+        raise UploadSessionNotFound(upload_id)
+
+
+def release_session(root, upload_id):
+    meta_path = os.path.join(_session_dir(root, upload_id), 'meta.json')
+    os.rename(meta_path + '.claimed', meta_path)
+
+
+# Часть не больше limit, а все части сессии вместе - не больше total_limit: иначе сессию можно
+# было бы наполнять частями без конца, а размер записи проверялся бы только при склейке
+def write_chunk(root, upload_id, index, stream, checksum, limit, chunk_size, total_limit):
+    session_dir = _session_dir(root, upload_id)
+    target = _chunk_path(session_dir, index)
+    unverified = target + '.unverified'
+    # Повторно отправляемая часть заменит прежнюю, поэтому ее размер не учитывается
+    remaining = total_limit - sum(size for i, size in received_chunks(root, upload_id).items() if i != index)
+    hasher = hashlib.sha256()
+    try:
+        written = stream_to_file(stream, unverified, min(limit, remaining), chunk_size, hasher)
+    except UploadTooLarge:
+        if remaining < limit:
+            raise SessionTooLarge(index)
+        raise
+    if hasher.hexdigest() != checksum.lower():
+        os.remove(unverified)
+        raise ChecksumMismatch(index)
+    # Повторная отправка той же части просто перезаписывает ее
+    os.replace(unverified, target)
+    touch_session(root, upload_id)
+    return written
+
+
+def received_chunks(root, upload_id):
+    session_dir = _session_dir(root, upload_id)
+    chunks = {}
+    for name in os.listdir(session_dir):
+        if name.endswith('.chunk'):
+            chunks[int(name[:-len('.chunk')])] = os.path.getsize(os.path.join(session_dir, name))
+    return dict(sorted(chunks.items()))
+
+
+# Склейка частей 0..count-1 в итоговый файл без загрузки их в память
+def assemble(root, upload_id, count, target_path, limit, chunk_size):
+    session_dir = _session_dir(root, upload_id)
+    received = received_chunks(root, upload_id)
+    missing = [i for i in range(count) if i not in received]
+    if missing:
+        raise MissingChunks(missing)
+    if sum(received[i] for i in range(count)) > limit:
+        raise UploadTooLarge()
+
+    tmp_path = target_path + '.part'
+    try:
+        with open(tmp_path, "wb") as out:
+            for index in range(count):
+                with open(_chunk_path(session_dir, index), "rb") as chunk:
+                    shutil.copyfileobj(chunk, out, chunk_size)
+        os.replace(tmp_path, target_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def remove_session(root, upload_id):
+    shutil.rmtree(_session_dir(root, upload_id), ignore_errors=True)
+
+
+def purge_expired(root, ttl):
+    if not os.path.isdir(root):
+        return 0
+    deadline = time.time() - ttl
+    purged = 0
+    for upload_id in os.listdir(root):
+        session_dir = os.path.join(root, upload_id)
+        meta_path = os.path.join(session_dir, 'meta.json')
+        try:
+            expired = os.path.getmtime(meta_path) < deadline
+        except FileNotFoundError:
+            # Каталог без meta.json - остаток прерванного создания или удаления
+            expired = os.path.getmtime(session_dir) < deadline
+        if expired:
+            shutil.rmtree(session_dir, ignore_errors=True)
+            purged += 1
+    return purged
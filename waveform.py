@@ -0,0 +1,236 @@
+import os
+import shutil
+import subprocess
+import uuid
+import wave
+
+import numpy as np
+
+# Число сэмплов в одном столбце самого подробного уровня
+BASE_BLOCK = 256
+# Каждый следующий уровень вдвое грубее, пока столбцов не станет меньше этого числа
+MIN_BUCKETS = 16
+# Сколько столбцов базового уровня читается с диска за один проход
+CHUNK_BLOCKS = 4096
+# Частота, в которую ffmpeg декодирует не-WAV файлы
+DECODE_SAMPLE_RATE = 16000
+# Поиск речи: порог энергии - шумовой фон записи (нижний процентиль) плюс запас, но не тише абсолютного минимума.
+# Паузы короче MIN_SILENCE_MS не разрывают фразу, отрезки короче MIN_SPEECH_MS считаются щелчками
+SPEECH_MARGIN_DB = 12
+SPEECH_FLOOR_DB = -50
+NOISE_PERCENTILE = 10
+SPEECH_SMOOTH_MS = 30
+MIN_SILENCE_MS = 300
+MIN_SPEECH_MS = 120
+SPEECH_PAD_MS = 60
+# Время в паузе переносится на границу фразы, только если она ближе этого
+SNAP_DISTANCE_MS = 1000
+
+
+class UnsupportedAudio(Exception):
+    pass
+
+
+def peaks_path(audio_path):
+    return os.path.splitext(audio_path)[0] + '.peaks.npz'
+
+
+# Чтение PCM блоками float32 (моно, -1.0...1.0), чтобы память не зависела от длины файла.
+# WAV читается модулем wave, остальные форматы (webm/ogg из MediaRecorder) декодируются ffmpeg, если он установлен
+def read_pcm_blocks(audio_path, frames_per_chunk=BASE_BLOCK * CHUNK_BLOCKS):
+    try:
+        wav = wave.open(audio_path, 'rb')
+    except (wave.Error, EOFError):
+        wav = None
+
+    if wav is not None:
+        with wav:
+            sample_width = wav.getsampwidth()
+            channels = wav.getnchannels()
+            if sample_width not in (1, 2, 4):
+                raise UnsupportedAudio(f"Неподдерживаемая разрядность WAV: {sample_width * 8} бит")
+            yield wav.getframerate()
+            while True:
+                data = wav.readframes(frames_per_chunk)
+                if not data:
+                    break
+                yield _pcm_to_float(data, sample_width, channels)
+        return
+
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        raise UnsupportedAudio("Файл не в формате WAV, а ffmpeg не найден")
+
+    process = subprocess.Popen(
+        [ffmpeg, '-nostdin', '-loglevel', 'error', '-i', audio_path,
+         '-f', 's16le', '-ac', '1', '-ar', str(DECODE_SAMPLE_RATE), '-'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        yield DECODE_SAMPLE_RATE
+        while True:
+            data = process.stdout.read(frames_per_chunk * 2)
+            if not data:
+                break
+            yield _pcm_to_float(data, 2, 1)
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+    if process.returncode != 0:
+        raise UnsupportedAudio("ffmpeg не смог декодировать файл")
+
+
+def _pcm_to_float(data, sample_width, channels):
+    if sample_width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif sample_width == 2:
+        samples = np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768
+    else:
+        samples = np.frombuffer(data, dtype='<i4').astype(np.float32) / 2147483648
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+# Пирамида пиков и RMS: уровень 0 - по BASE_BLOCK сэмплов на столбец, каждый следующий вдвое грубее
+def build_peaks(audio_path):
+    pcm = read_pcm_blocks(audio_path)
+    sample_rate = next(pcm)
+
+    peak_parts, square_parts = [], []
+    total_samples = 0
+    tail = np.empty(0, dtype=np.float32)
+    for samples in pcm:
+        total_samples += len(samples)
+        if len(tail):
+            samples = np.concatenate([tail, samples])
+        usable = len(samples) - len(samples) % BASE_BLOCK
+        tail = samples[usable:]
+        if usable:
+            blocks = samples[:usable].reshape(-1, BASE_BLOCK)
+            peak_parts.append(np.abs(blocks).max(axis=1))
+            square_parts.append(np.square(blocks).mean(axis=1))
+    if len(tail):
+        peak_parts.append(np.abs(tail).max(keepdims=True))
+        square_parts.append(np.square(tail).mean(keepdims=True))
+
+    if not peak_parts:
+        raise UnsupportedAudio("Аудиофайл не содержит сэмплов")
+
+    peaks = np.concatenate(peak_parts)
+    squares = np.concatenate(square_parts)
+    levels = [(peaks, squares)]
+    while len(peaks) >= MIN_BUCKETS * 2:
+        if len(peaks) % 2:
+            peaks = np.append(peaks, peaks[-1])
+            squares = np.append(squares, squares[-1])
+        peaks = peaks.reshape(-1, 2).max(axis=1)
+        squares = squares.reshape(-1, 2).mean(axis=1)
+        levels.append((peaks, squares))
+
+    arrays = {
+        'sample_rate': np.array(sample_rate),
+        'block': np.array(BASE_BLOCK),
+        'samples': np.array(total_samples),
+    }
+    for level, (level_peaks, level_squares) in enumerate(levels):
+        arrays[f'peak_{level}'] = _quantize(level_peaks)
+        arrays[f'rms_{level}'] = _quantize(np.sqrt(level_squares))
+    return arrays
+
+
+def _quantize(values):
+    return np.round(np.clip(values, 0, 1) * 65535).astype(np.uint16)
+
+
+def save_peaks(audio_path):
+    arrays = build_peaks(audio_path)
+    target = peaks_path(audio_path)
+    # Индекс может строиться одновременно воркером и запросом, у каждого свой временный файл
+    tmp_path = f"{target}.{uuid.uuid4().hex}.part"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, target)
+    return target
+
+
+# Один уровень пирамиды. Если уровень не указан, берется самый грубый,
+# в котором не меньше bars столбцов
+def load_peaks_level(audio_path, level=None, bars=None):
+    with np.load(peaks_path(audio_path)) as data:
+        level_count = sum(1 for name in data.files if name.startswith('peak_'))
+        sizes = [len(data[f'peak_{i}']) for i in range(level_count)]
+        if level is None:
+            level = level_count - 1
+            if bars:
+                while level > 0 and sizes[level] < bars:
+                    level -= 1
+        if not 0 <= level < level_count:
+            raise IndexError(level)
+
+        sample_rate = int(data['sample_rate'])
+        samples_per_bucket = int(data['block']) * 2 ** level
+        return {
+            'level': level,
+            'levels': sizes,
+            'sample_rate': sample_rate,
+            'samples_per_bucket': samples_per_bucket,
+            'bucket_duration': samples_per_bucket / sample_rate * 1000,
+            'duration': int(data['samples']) / sample_rate * 1000,
+            'peaks': (data[f'peak_{level}'] / 65535).round(4).tolist(),
+            'rms': (data[f'rms_{level}'] / 65535).round(4).tolist(),
+        }
+
+
+# Отрезки речи [[начало, конец], ...] в миллисекундах по энергии кадров (rms - значения 0..1,
+# frame_ms - длительность кадра). Все шаги векторные, поэтому час записи обрабатывается за миллисекунды
+def detect_speech(rms, frame_ms, duration):
+    if not len(rms):
+        return []
+    window = max(1, int(round(SPEECH_SMOOTH_MS / frame_ms)))
+    energy = np.convolve(np.square(rms, dtype=np.float64), np.ones(window) / window, mode='same')
+    level_db = 10 * np.log10(energy + 1e-10)
+    threshold = max(np.percentile(level_db, NOISE_PERCENTILE) + SPEECH_MARGIN_DB, SPEECH_FLOOR_DB)
+
+    edges = np.diff(np.concatenate(([0], (level_db > threshold).astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1) * frame_ms
+    ends = np.flatnonzero(edges == -1) * frame_ms
+    if not len(starts):
+        return []
+
+    # Короткие паузы склеиваются: фраза продолжается до следующей длинной паузы
+    keep = starts[1:] - ends[:-1] >= MIN_SILENCE_MS
+    starts = np.concatenate((starts[:1], starts[1:][keep]))
+    ends = np.concatenate((ends[:-1][keep], ends[-1:]))
+    speech = ends - starts >= MIN_SPEECH_MS
+    starts = np.clip(starts[speech] - SPEECH_PAD_MS, 0, duration)
+    ends = np.clip(ends[speech] + SPEECH_PAD_MS, 0, duration)
+    return [[int(start), int(end)] for start, end in zip(np.round(starts), np.round(ends))]
+
+
+# Отрезки речи по готовому индексу пиков (RMS самого подробного уровня), без повторного чтения аудио
+def speech_segments(audio_path):
+    with np.load(peaks_path(audio_path)) as data:
+        sample_rate = int(data['sample_rate'])
+        frame_ms = int(data['block']) / sample_rate * 1000
+        duration = int(data['samples']) / sample_rate * 1000
+        rms = data['rms_0'] / 65535
+    return detect_speech(rms, frame_ms, duration)
+
+
+# Время (мс) в паузе переносится на ближайшую границу фразы, если до нее не дальше max_distance.
+# Время внутри фразы и далеко от речи остается как есть
+def snap_to_speech(times, segments, max_distance=SNAP_DISTANCE_MS):
+    if not len(times) or not segments:
+        return list(times)
+    times = np.asarray(times, dtype=np.float64)
+    bounds = np.asarray(segments, dtype=np.float64)
+    nearest = np.clip(times[:, None], bounds[:, 0], bounds[:, 1])
+    distance = np.abs(nearest - times[:, None])
+    closest = distance.argmin(axis=1)
+    rows = np.arange(len(times))
+    snapped = np.where(distance[rows, closest] <= max_distance, nearest[rows, closest], times)
+    return snapped.tolist()